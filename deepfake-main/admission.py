@@ -0,0 +1,217 @@
+"""
+Admission control in front of the rating pages.
+
+When Prolific releases the study, hundreds of participants arrive within a
+minute. If all of them start rating at once, every one of them waits on the same
+pool and the same MySQL, and everyone times out. Instead, admit() lets in as many
+sessions as the database currently handles well. The rest wait on
+pages/Waiting_room.py, which shows their place in the queue and does not touch
+the database.
+
+    pool, admitted = admission.enter(st.session_state, st.secrets, page="app.py")
+    if not admitted:
+        st.switch_page(admission.WAITING_PAGE)
+
+The capacity is shared by all workers on the host (shared_state.py) and adjusted
+every ADJUST_SECONDS:
+
+  * query latency (EWMA over this worker's statements) above the target, or
+    more than MAX_SATURATION of the pool checked out: shrink by 20%
+  * healthy and (almost) full: grow by 10%
+
+An admitted session holds a lease that every rerun renews. Leases of sessions
+that go quiet for LEASE_SECONDS expire, which returns their place. A waiting
+session that stops polling (tab closed) drops out of the queue after
+shared_state.TICKET_SECONDS.
+End_participation releases it straight away. Once a participant has an id they
+are never sent back to the queue.
+
+enter() fails open: when the tunnel, the database or the shared file cannot be
+reached, the participant is let in rather than shown a traceback, and the page
+gets no engine (None) to decide what it can still do.
+
+Bounds come from an optional `[admission]` table in secrets.toml
+(min_capacity, max_capacity, start_capacity, target_latency_ms).
+"""
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy import event
+
+import db
+import shared_state
+
+WAITING_PAGE = "pages/Waiting_room.py"
+
+MIN_CAPACITY = 10
+MAX_CAPACITY = 300
+START_CAPACITY = 40
+TARGET_LATENCY_MS = 250
+MAX_SATURATION = 0.8
+
+LEASE_SECONDS = 300
+STUDY_SECONDS = 180     # typical participation, for the wait estimate
+ADJUST_SECONDS = 5
+PUBLISH_SECONDS = 1
+STALE_SECONDS = 30      # no statements for this long: load counts as healthy
+EWMA_ALPHA = 0.2
+
+UNREACHABLE = "The study database cannot be reached right now. Please wait a minute and reload this page."
+
+_settings = dict(
+    min_capacity=MIN_CAPACITY,
+    max_capacity=MAX_CAPACITY,
+    start_capacity=START_CAPACITY,
+    target_latency_ms=TARGET_LATENCY_MS,
+)
+
+_latency_ms = None
+_latency_lock = threading.Lock()
+_last_publish = 0.0
+
+log = logging.getLogger("admission")
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def configure(settings=None):
+    """Apply secrets' [admission] table and give the shared capacity its start value."""
+    for key, value in dict(settings or {}).items():
+        if key in _settings:
+            _settings[key] = value
+    _settings["max_capacity"] = min(_settings["max_capacity"], shared_state.LEASE_SLOTS)
+    try:
+        state = shared_state.get_shared_state()
+        if not state.admission(_now_ms())["capacity"]:
+            start = min(max(_settings["start_capacity"], _settings["min_capacity"]), _settings["max_capacity"])
+            state.adjust_capacity(lambda capacity, _: capacity or start, _now_ms(), every_ms=0)
+    except Exception:
+        log.exception("shared state unavailable, admission capacity not set")
+
+
+# --------------------------------------------------------------------------------
+# Load measurement
+# --------------------------------------------------------------------------------
+def install(engine):
+    """Time every statement on engine into this worker's latency EWMA."""
+    if event.contains(engine, "after_cursor_execute", _after_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the statement's own execution context: a failed statement leaves nothing behind.
+    if context is not None:
+        context.admission_started = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    global _latency_ms
+    started = getattr(context, "admission_started", None)
+    if started is None:
+        return  # statement began before install()
+    elapsed = (time.perf_counter() - started) * 1000
+    with _latency_lock:
+        _latency_ms = elapsed if _latency_ms is None else _latency_ms + EWMA_ALPHA * (elapsed - _latency_ms)
+
+
+def _saturation(engine) -> float:
+    pool = engine.pool
+    slots = pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+    return pool.checkedout() / slots if slots else 0.0
+
+
+def _publish(engine):
+    global _last_publish
+    now = time.monotonic()
+    if _latency_ms is None or now - _last_publish < PUBLISH_SECONDS:
+        return
+    _last_publish = now
+    shared_state.get_shared_state().publish_load(_latency_ms, _saturation(engine), _now_ms())
+
+
+def _decide(capacity: int, load: dict) -> int:
+    healthy = (
+        _now_ms() - load["sampled_ms"] > STALE_SECONDS * 1000
+        or (load["latency_ms"] <= _settings["target_latency_ms"] and load["saturation"] <= MAX_SATURATION)
+    )
+    if not healthy:
+        capacity = int(capacity * 0.8)
+    elif load["active"] >= capacity - 1:
+        capacity += max(1, capacity // 10)
+    return min(max(capacity, _settings["min_capacity"]), _settings["max_capacity"])
+
+
+# --------------------------------------------------------------------------------
+# Sessions
+# --------------------------------------------------------------------------------
+def admit(session, engine=None, page: str = "app.py") -> bool:
+    """
+    True when this session may go on. session is st.session_state. engine is
+    the app engine on pages that use the database, None on the waiting page.
+    """
+    state = shared_state.get_shared_state()
+    if engine is not None:
+        install(engine)
+        _publish(engine)
+    now = _now_ms()
+    state.adjust_capacity(_decide, now, ADJUST_SECONDS * 1000)
+    expires = now + LEASE_SECONDS * 1000
+
+    ticket = session.get("admission")
+    if ticket is not None and ticket.get("slot") is not None:
+        if state.renew(ticket["slot"], ticket["owner"], expires):
+            return True
+        ticket["slot"] = None  # expired and handed on; mid-study sessions take a new one below
+    if ticket is None:
+        ticket = {"ticket": state.take_ticket(now), "owner": random.getrandbits(62) + 1, "slot": None, "page": page}
+        session["admission"] = ticket
+
+    mid_study = "participant_id" in session
+    ticket["slot"] = state.lease(None if mid_study else ticket["ticket"], ticket["owner"], expires, now)
+    # Mid-study with every lease slot taken: carry on without one.
+    return ticket["slot"] is not None or mid_study
+
+
+def enter(session, secrets, page: str):
+    """
+    (engine, admitted) for the top of a page. Without the database the engine
+    is None; without it or the shared file the session is admitted.
+    """
+    try:
+        engine = db.get_app_engine(secrets)
+    except Exception as e:
+        log.warning("no database engine for %s: %s", page, e)
+        engine = None
+    try:
+        return engine, admit(session, engine, page)
+    except Exception:
+        log.exception("admission failed on %s, letting the session in", page)
+        return engine, True
+
+
+def position(session) -> dict:
+    """Where a waiting session stands: sessions ahead and a rough wait."""
+    state = shared_state.get_shared_state()
+    now = _now_ms()
+    ahead = state.tickets_ahead(session["admission"]["ticket"], now)
+    load = state.admission(now)
+    # With the room full, a place frees up about every STUDY_SECONDS / capacity.
+    per_place = STUDY_SECONDS / max(load["capacity"], 1)
+    return {"ahead": ahead, "active": load["active"], "wait_seconds": int(ahead * per_place)}
+
+
+def return_page(session) -> str:
+    return session.get("admission", {}).get("page", "app.py")
+
+
+def release(session):
+    ticket = session.get("admission")
+    if ticket and ticket.get("slot") is not None:
+        shared_state.get_shared_state().release(ticket["slot"], ticket["owner"])
+        ticket["slot"] = None
@@ -0,0 +1,276 @@
+"""
+Vectorised analysis of exported study data (see export_parquet.py).
+
+    python analysis.py                                   # phase 3, attention-checked
+    python analysis.py --table english_ratings_phase2 --all-raters
+
+Ratings are loaded once into compact NumPy columns (int8 answers, -1 = missing)
+and every statistic is a handful of np.bincount passes over group_no, so a
+10M-row table is analysed in seconds (benchmarks/bench_analysis.py).
+
+Arms: 1 = control, 2 = T1 (inline warning while listening),
+3 = T2 (post-hoc warning after the real/fake judgement).
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+DEFAULT_EXPORTS = Path(__file__).resolve().parent / "exports"
+
+ARMS = {1: "control", 2: "T1", 3: "T2"}
+MISSING = -1
+
+RATING_COLUMNS = [
+    "participant_id", "audio_clip_id", "group_no",
+    "realness_scale", "realness_perception", "check_1",
+    "trust_content", "trust_media",
+]
+# Only asked in phase 3; the statistics that use them skip tables without them.
+TRUST_COLUMNS = ["trust_content", "trust_media"]
+
+# Value that counts as passing the attention check ("select 4 if yes").
+# Phase 2 stored the raw answer; phase 3 stores the boolean outcome.
+CHECK_PASS_VALUE = {
+    "english_ratings_phase2": 4,
+    "english_ratings_phase3": 1,
+}
+
+_Z95 = 1.959963984540054
+
+
+# --------------------------------------------------------------------------------
+# Loading
+# --------------------------------------------------------------------------------
+def load_table(table: str, exports_dir: Path = DEFAULT_EXPORTS, columns=None) -> pd.DataFrame:
+    """
+    Read every exported part file of `table` into one DataFrame.
+    Of `columns`, only those the table has are read.
+    """
+    parts = sorted((Path(exports_dir) / table).glob("part-*.parquet"))
+    if not parts:
+        raise FileNotFoundError(f"No exported parts for {table} in {exports_dir}")
+    if columns is not None:
+        present = set(pq.read_schema(parts[0]).names)
+        columns = [c for c in columns if c in present]
+    return pd.concat(
+        [pq.read_table(p, columns=columns).to_pandas() for p in parts],
+        ignore_index=True,
+    )
+
+
+def compact_ratings(df: pd.DataFrame, check_pass_value=1) -> dict:
+    """
+    Columnar NumPy view of the ratings used by every statistic below.
+    Answers become int8 with MISSING for NULL; check_1 becomes a bool mask.
+    The trust columns are left out when the table has none.
+    """
+    df = df[df["group_no"].notna()]
+
+    def small(name):
+        return df[name].fillna(MISSING).to_numpy(dtype=np.int8)
+
+    r = {
+        "participant_id": df["participant_id"].to_numpy(dtype=np.int64),
+        "audio_clip_id": df["audio_clip_id"].to_numpy(dtype=np.int64),
+        "group_no": small("group_no"),
+        "realness_scale": small("realness_scale"),
+        "realness_perception": small("realness_perception"),
+        "passed_check": df["check_1"].fillna(MISSING).to_numpy() == check_pass_value,
+    }
+    for name in TRUST_COLUMNS:
+        if name in df:
+            r[name] = small(name)
+    return r
+
+
+def load_ratings(table="english_ratings_phase3", exports_dir: Path = DEFAULT_EXPORTS) -> dict:
+    df = load_table(table, exports_dir, columns=RATING_COLUMNS)
+    return compact_ratings(df, CHECK_PASS_VALUE.get(table, 1))
+
+
+def load_participants(exports_dir: Path = DEFAULT_EXPORTS) -> pd.DataFrame:
+    return load_table("participants_phase3", exports_dir)
+
+
+def with_participants(ratings: dict, participants: pd.DataFrame, columns) -> pd.DataFrame:
+    """Attach participant columns (e.g. political_party) to each rating by participant_id."""
+    frame = pd.DataFrame(ratings)
+    return frame.merge(participants[["participant_id", *columns]], on="participant_id", how="left")
+
+
+# --------------------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------------------
+def _arms(r) -> int:
+    return int(r["group_no"].max()) + 1 if len(r["group_no"]) else 1
+
+
+def _select(r: dict, mask) -> dict:
+    return {k: v[mask] for k, v in r.items()}
+
+
+def _count(group, mask, n_arms):
+    return np.bincount(group[mask], minlength=n_arms)
+
+
+def _mean(group, values, n_arms):
+    ok = values != MISSING
+    total = np.bincount(group[ok], weights=values[ok], minlength=n_arms)
+    n = np.bincount(group[ok], minlength=n_arms)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / n, n
+
+
+def _wilson(successes, n):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = successes / n
+        denom = 1 + _Z95 ** 2 / n
+        centre = (p + _Z95 ** 2 / (2 * n)) / denom
+        half = _Z95 * np.sqrt(p * (1 - p) / n + _Z95 ** 2 / (4 * n ** 2)) / denom
+    return p, centre - half, centre + half
+
+
+def _arm_frame(data: dict, n_arms) -> pd.DataFrame:
+    frame = pd.DataFrame(data, index=pd.Index(range(n_arms), name="group_no"))
+    frame = frame[frame["n"] > 0] if "n" in frame else frame
+    frame.insert(0, "arm", [ARMS.get(g, str(g)) for g in frame.index])
+    return frame
+
+
+# --------------------------------------------------------------------------------
+# Statistics
+# --------------------------------------------------------------------------------
+def attention_filter(r: dict) -> dict:
+    """Keep only ratings that passed the attention check."""
+    return _select(r, r["passed_check"])
+
+
+def attention_summary(r: dict) -> pd.DataFrame:
+    n_arms = _arms(r)
+    g = r["group_no"]
+    n = np.bincount(g, minlength=n_arms)
+    passed = _count(g, r["passed_check"], n_arms)
+    p, lo, hi = _wilson(passed, n)
+    return _arm_frame({"n": n, "passed": passed, "pass_rate": p, "ci_low": lo, "ci_high": hi}, n_arms)
+
+
+def accuracy_by_arm(r: dict, clips_are_fake: bool = True) -> pd.DataFrame:
+    """
+    Share of correct real/fake judgements per arm, with 95% Wilson intervals.
+    Audio set 4 only contains AI-generated clips, so "Fake" (0) is correct by default.
+    """
+    n_arms = _arms(r)
+    g = r["group_no"]
+    judgement = r["realness_perception"]
+    judged = judgement != MISSING
+    correct = judgement == (0 if clips_are_fake else 1)
+    n = _count(g, judged, n_arms)
+    k = _count(g, correct, n_arms)
+    p, lo, hi = _wilson(k, n)
+    return _arm_frame({"n": n, "correct": k, "accuracy": p, "ci_low": lo, "ci_high": hi}, n_arms)
+
+
+def calibration(r: dict, clips_are_fake: bool = True) -> pd.DataFrame:
+    """
+    Realness-scale calibration per arm: mean scale, agreement between the
+    1-10 scale and the binary judgement (6-10 read as "Real"), and the Brier
+    score of (scale - 1) / 9 as a probability that the clip is real.
+    """
+    n_arms = _arms(r)
+    g = r["group_no"]
+    scale = r["realness_scale"]
+    judgement = r["realness_perception"]
+    rated = scale != MISSING
+    both = rated & (judgement != MISSING)
+
+    mean_scale, n = _mean(g, scale, n_arms)
+    agree = _count(g, both & ((scale >= 6) == (judgement == 1)), n_arms)
+    prob_real = (scale.astype(np.float32) - 1) / 9
+    truth = 0.0 if clips_are_fake else 1.0
+    sq_err = np.where(rated, (prob_real - truth) ** 2, 0)
+    brier = np.bincount(g, weights=sq_err, minlength=n_arms)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _arm_frame({
+            "n": n,
+            "mean_realness_scale": mean_scale,
+            "scale_judgement_agreement": agree / _count(g, both, n_arms),
+            "brier": brier / n,
+        }, n_arms)
+
+
+def scale_distribution(r: dict) -> pd.DataFrame:
+    """Counts of each realness_scale value (columns 1-10) per arm, in one bincount."""
+    n_arms = _arms(r)
+    rated = r["realness_scale"] != MISSING
+    flat = r["group_no"][rated].astype(np.int64) * 11 + r["realness_scale"][rated]
+    counts = np.bincount(flat, minlength=n_arms * 11).reshape(n_arms, 11)[:, 1:]
+    frame = pd.DataFrame(counts, columns=range(1, 11), index=pd.Index(range(n_arms), name="group_no"))
+    return frame[frame.sum(axis=1) > 0]
+
+
+def warning_effects(r: dict, clips_are_fake: bool = True, control: int = 1) -> pd.DataFrame:
+    """
+    Effect of each warning arm against control: difference in detection
+    accuracy (with a 95% normal-approximation interval), in mean realness
+    scale and in the two trust items where the table has them.
+    """
+    n_arms = _arms(r)
+    acc = accuracy_by_arm(r, clips_are_fake)
+    mean_scale, _ = _mean(r["group_no"], r["realness_scale"], n_arms)
+    trust = {name: _mean(r["group_no"], r[name], n_arms)[0] for name in TRUST_COLUMNS if name in r}
+    if control not in acc.index:
+        return pd.DataFrame()
+
+    p0, n0 = acc.at[control, "accuracy"], acc.at[control, "n"]
+    rows = []
+    for arm in acc.index:
+        if arm == control:
+            continue
+        p1, n1 = acc.at[arm, "accuracy"], acc.at[arm, "n"]
+        diff = p1 - p0
+        se = np.sqrt(p1 * (1 - p1) / n1 + p0 * (1 - p0) / n0)
+        rows.append({
+            "group_no": arm,
+            "arm": ARMS.get(arm, str(arm)),
+            "accuracy_diff": diff,
+            "ci_low": diff - _Z95 * se,
+            "ci_high": diff + _Z95 * se,
+            "realness_scale_diff": mean_scale[arm] - mean_scale[control],
+            **{f"{name}_diff": mean[arm] - mean[control] for name, mean in trust.items()},
+        })
+    return pd.DataFrame(rows).set_index("group_no")
+
+
+def report(r: dict, clips_are_fake: bool = True, attention_checked: bool = True) -> dict:
+    """All tables at once; the attention summary always covers every rater."""
+    tables = {"attention": attention_summary(r)}
+    if attention_checked:
+        r = attention_filter(r)
+    tables["accuracy"] = accuracy_by_arm(r, clips_are_fake)
+    tables["calibration"] = calibration(r, clips_are_fake)
+    tables["scale_distribution"] = scale_distribution(r)
+    tables["warning_effects"] = warning_effects(r, clips_are_fake)
+    return tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exports", type=Path, default=DEFAULT_EXPORTS, help="export directory")
+    parser.add_argument("--table", default="english_ratings_phase3", help="ratings table to analyse")
+    parser.add_argument("--all-raters", action="store_true", help="do not drop failed attention checks")
+    parser.add_argument("--clips-are-real", action="store_true", help="score 'Real' as the correct judgement")
+    args = parser.parse_args(argv)
+
+    ratings = load_ratings(args.table, args.exports)
+    tables = report(ratings, clips_are_fake=not args.clips_are_real, attention_checked=not args.all_raters)
+    with pd.option_context("display.width", 160, "display.max_columns", 20):
+        for name, table in tables.items():
+            print(f"\n== {name} ==")
+            print(table.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Questionnaire rendered and validated in the browser, submitted as one payload.
+
+With Streamlit widgets every answer is widget state that the server keeps in
+sync, and every step change is a rerun. T2 paid one extra full rerun just to
+freeze key_* into ans_* between its two steps. collect() hands the steps to a
+static component (components/answer_collector/index.html). The component draws
+the questions and checks each step's required answers locally. On the final
+submit it sends a single JSON value, so a clip costs one rerun, however many
+questions it has.
+
+    nonce = f"{audio_clip_id}-{count}"
+    answers = answer_collector.collect(STEPS, url, topic, nonce)
+    if answers is not None:
+        if save_to_db(answers):
+            answer_collector.done(nonce)
+        else:
+            answer_collector.reject(nonce, gaps)    # labels of the answers at fault
+
+The steps are questionnaire.Section / Question objects. The server checks the
+same required flags and allowed values again (questionnaire.missing and
+questionnaire.invalid), so the client is a convenience, not the only check.
+reject() sends those labels back: the component keeps the participant's
+answers, marks the questions and lets them submit again. Free text is cut off
+in the browser at questionnaire.TEXT_LIMIT, the length the server accepts.
+"""
+from dataclasses import asdict
+from pathlib import Path
+from typing import Optional
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+import questionnaire
+
+_component = components.declare_component(
+    "answer_collector", path=str(Path(__file__).resolve().parent / "components" / "answer_collector")
+)
+
+
+def _spec(section, topic: str) -> dict:
+    spec = asdict(section)
+    for question in spec["questions"]:
+        if question["prompt"]:
+            question["prompt"] = question["prompt"].format(topic=topic)
+    return spec
+
+
+def collect(sections, audio_url: str, topic: str, nonce: str, next_label: str = "Next ➜",
+            submit_label: str = "Submit and View Next") -> Optional[dict]:
+    """
+    Render sections as client-side steps. Returns the answers on the runs
+    after the participant submitted, until done() or reject(), and None
+    otherwise. nonce must change per clip: it resets the component and tells
+    repeated values apart.
+    """
+    rejection = st.session_state.get("answer_collector_rejected") or {}
+    if rejection.get("nonce") != nonce:
+        rejection = {}
+    value = _component(
+        sections=[_spec(section, topic) for section in sections],
+        audio_url=audio_url,
+        nonce=nonce,
+        next_label=next_label,
+        submit_label=submit_label,
+        text_limit=questionnaire.TEXT_LIMIT,
+        rejected=rejection.get("attempt"),
+        errors=rejection.get("errors", []),
+        key=f"answer_collector_{nonce}",
+        default=None,
+    )
+    if not value or value.get("nonce") != nonce:
+        return None
+    submission = [nonce, value.get("attempt")]
+    if st.session_state.get("answer_collector_done") == submission:
+        return None
+    st.session_state["answer_collector_pending"] = submission
+    return value["answers"]
+
+
+def done(nonce: str):
+    """
+    The answers of nonce are handled; collect() stops returning them. Call it
+    once they are saved, so a save that raised is tried again on the next run.
+    """
+    submission = st.session_state.get("answer_collector_pending")
+    if submission and submission[0] == nonce:
+        st.session_state["answer_collector_done"] = submission
+        st.session_state.pop("answer_collector_rejected", None)
+
+
+def reject(nonce: str, errors: list):
+    """
+    The answers of nonce were not accepted. The component shows errors (question
+    labels) on their questions and takes another submission, answers kept.
+    """
+    submission = st.session_state.get("answer_collector_pending")
+    if submission and submission[0] == nonce:
+        st.session_state["answer_collector_done"] = submission
+        st.session_state["answer_collector_rejected"] = {"nonce": nonce, "attempt": submission[1], "errors": errors}
@@ -1,19 +1,19 @@
 import streamlit as st
 import streamlit_survey as ss
 import streamlit_scrollable_textbox as stx
-import time
 
 import json
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 
-import pymysql
 import sqlalchemy
 import os
-from sshtunnel import SSHTunnelForwarder
-from fabric import Connection
 from sqlalchemy.exc import SQLAlchemyError
 
+import admission
+import arms
+import db
+
 # Set the page config at the top of the file
 st.set_page_config(
     page_title="Audio Persuasiveness",
@@ -21,6 +21,13 @@ st.set_page_config(
     initial_sidebar_state="collapsed"  # Collapsed sidebar by default
 )
 
+# Past the current capacity, new participants wait in the waiting room (admission.py)
+# One SSH tunnel + pool per server process (db.py); None while the database is unreachable
+admission.configure(st.secrets.get("admission"))
+pool, admitted = admission.enter(st.session_state, st.secrets, page="app.py")
+if not admitted:
+    st.switch_page(admission.WAITING_PAGE)
+
 # Initialize session state for sidebar state if not already set
 if 'sidebar_state' not in st.session_state:
     st.session_state.sidebar_state = 'collapsed'
@@ -106,77 +113,7 @@ consent3 = survey.checkbox("I confirm that I am at least 18 years old.")
 
 #######################################################################################################
 
-# # SSH and Database credentials
-ssh_host = st.secrets["ssh_host"]
-ssh_port = st.secrets["ssh_port"]
-ssh_user = st.secrets["ssh_user"]
-ssh_password = st.secrets["ssh_password"]
-
-db_host = st.secrets["db_host"]
-db_user = st.secrets["db_user"]
-db_password = st.secrets["db_password"]
-db_name = st.secrets["db_name"]
-db_port = st.secrets["db_port"]
-
-
-### Set up SSH connection and port forwarding
-### Set up SSH tunnel with keep-alive
-def start_ssh_tunnel():
-    try:
-        tunnel = SSHTunnelForwarder(
-            (ssh_host, ssh_port),
-            ssh_username=ssh_user,
-            ssh_password=ssh_password,
-            remote_bind_address=(db_host, db_port),
-            set_keepalive=30  # Send keep-alive packets every 60 seconds to keep connection alive
-        )
-        tunnel.start()
-        return tunnel
-    except Exception as e:
-        st.error(f"SSH tunnel connection failed: {e}")
-        raise
-
-
-# Establish Database connection with retry logic and optimized timeouts
-def get_connection(tunnel, retries=3, delay=5):
-    for attempt in range(retries):
-        try:
-            conn = pymysql.connect(
-                host='127.0.0.1',
-                user=db_user,
-                password=db_password,
-                database=db_name,
-                port=tunnel.local_bind_port,
-                connect_timeout=40600,  # Increased
-                read_timeout=10600,  # Increased
-                write_timeout=10600,  # Increased
-                max_allowed_packet=128 * 1024 * 1024  # 128MB
-            )
-            return conn
-        except pymysql.err.OperationalError as e:
-            st.error(f"Connection attempt {attempt + 1} failed: {e}")
-            if "MySQL server has gone away" in str(e):
-                # Specific handling for the lost connection error
-                st.error("MySQL server has gone away. Trying to reconnect...")
-            if attempt < retries - 1:
-                time.sleep(delay)
-            else:
-                st.error("Failed to connect to the database after multiple retries.")
-                raise
-
-    # SQLAlchemy connection pool with pre-ping and recycling for better connection management
-
-
-def get_sqlalchemy_engine(tunnel):
-    pool = create_engine(
-        "mysql+pymysql://",
-        creator=lambda: get_connection(tunnel),
-        pool_pre_ping=True,  # Ensure connection is alive before executing a query
-        pool_recycle=600,  # Recycle connections every 1 hour to prevent disconnection
-        pool_size=4000,  # Set pool size to handle multiple connections
-        max_overflow=3000  # Allow 10 extra simultaneous connections if needed
-    )
-    return pool
+db.start_deadline()  # DB time budget for this rerun
 
 
 # Database insertions
@@ -230,17 +167,18 @@ elif all([consent1, consent2, consent3]):
     prolific_id = st.text_input("Enter your unique Prolific ID:", max_chars=50, key="prolific_id")
 
     if st.button("Submit ID"):
-        if prolific_id:
-            tunnel = start_ssh_tunnel()
-            pool = get_sqlalchemy_engine(tunnel)
-
+        if pool is None:
+            st.error(admission.UNREACHABLE)
+        elif prolific_id:
             last_inserted_id = insert_participant_and_get_id(pool)
             insert_prolific_id(pool, last_inserted_id, prolific_id)
+            # Most under-filled arm against the configured quotas (arms.py)
+            arms.configure(st.secrets.get("arm_quotas"))
+            st.session_state['group_no'] = arms.assign(pool, last_inserted_id)
             st.session_state['participant_id'] = last_inserted_id
-            tunnel.stop()  # Stop tunnel when done
         else:
             st.write("Please enter your Prolific ID to continue.")
 
 if 'participant_id' in st.session_state:
     st.write("Let's check the case!")
-    st.switch_page("pages/Rate_responses_phase3.py")
+    st.switch_page(arms.ARM_PAGES[st.session_state.get('group_no', 1)])
@@ -0,0 +1,414 @@
+"""
+Move finished study phases and stale placeholder rows out of the live schema.
+
+    python archive.py run phase2 --measure               # into deepfakes_archive.* (compressed)
+    python archive.py run placeholders --to parquet      # into archive/<table>/*.parquet
+    python archive.py run placeholders --min-age-hours 48
+    python archive.py run phase2 placeholders --dry-run  # count only
+    python archive.py measure --label after-warmup --window 300
+    python archive.py report
+
+Phase 2 is over, but english_ratings_phase2 and participants_phase2 still sit
+in `deepfakes` next to the live phase-3 tables. Every participant also starts
+as an all-NULL row from insert_participant_and_get_id(), and most of those
+never get further. Both take space in the indexes and the buffer pool that the
+live study could use. The jobs:
+
+    phase2        every row of english_ratings_phase2 and participants_phase2
+    placeholders  participants_phase3 rows with every answer NULL, no
+                  prolific_ids_p3 row, no rating, and created at least
+                  --min-age-hours ago (in progress otherwise), then the
+                  arm_assignments_phase3 rows of participants no longer live
+
+The placeholder age needs participants_phase3.created_at (migration 6 in
+migrate.py). A rating spooled by fallback.py is not in the database yet, so
+`run` refuses while this host's spool holds anything; replay it first
+(python fallback.py replay). Spools on other hosts are covered by the age.
+
+Rows move in batches of --batch keys, one short transaction each. The keys are
+picked with a plain read. Only that batch is then locked (FOR UPDATE, with the
+job's condition checked again), copied and deleted. The job sleeps --pause
+seconds between batches and retries a batch that waits longer than
+LOCK_WAIT_SECONDS for a lock. The copy goes to a ROW_FORMAT=COMPRESSED table of
+the same name in --archive-schema, or to a zstd Parquet part file per batch.
+That file is written before the delete commits and removed if it fails.
+
+Deleting rows does not shrink the table files. --optimize rebuilds the tables
+that lost rows afterwards (OPTIMIZE TABLE, an online rebuild for InnoDB).
+
+--measure records data + index size per live table and the InnoDB buffer pool
+hit rate over --window seconds, before and after the run. Lines go to
+archive/measurements.jsonl. The hit rate only settles once the pool has warmed
+to the smaller working set, so take another `measure` a while after the run.
+"""
+import argparse
+import json
+import sys
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pymysql
+
+import db
+import export_parquet
+import fallback
+
+ARCHIVE_DIR = db.APP_DIR / "archive"
+ARCHIVE_SCHEMA = "deepfakes_archive"
+LIVE_SCHEMA = "deepfakes"
+MEASUREMENTS = "measurements.jsonl"
+DEFAULT_BATCH = 2000
+DEFAULT_PAUSE = 0.2
+DEFAULT_WINDOW = 60
+MIN_AGE_HOURS = 24
+LOCK_WAIT_SECONDS = 5
+LOCK_RETRIES = 5
+
+_LOCK_WAIT_TIMEOUT = 1205
+
+# Every column insert_participant_and_get_id() leaves NULL
+PARTICIPANT_ANSWERS = [
+    "age_group", "gender", "education", "occupation", "country_of_residence",
+    "nationality", "race", "native_tongue", "languages_spoken", "political_party",
+    "political_inclination", "listening_habits", "tech_savy", "ai_experience", "media_consumption",
+]
+
+
+@dataclass(frozen=True)
+class Job:
+    table: str
+    key: str = None     # None: the table's primary key, read from the server
+    where: str = ""     # condition on alias t; {horizon} is filled in per run
+
+
+_PLACEHOLDER = " AND ".join(f"t.{c} IS NULL" for c in PARTICIPANT_ANSWERS) + """
+    AND t.created_at <= '{horizon}'
+    AND NOT EXISTS (SELECT 1 FROM deepfakes.prolific_ids_p3 p WHERE p.participant_id = t.participant_id)
+    AND NOT EXISTS (SELECT 1 FROM deepfakes.english_ratings_phase3 r WHERE r.participant_id = t.participant_id)
+"""
+
+_ORPHANED_ASSIGNMENT = """
+    NOT EXISTS (SELECT 1 FROM deepfakes.participants_phase3 p WHERE p.participant_id = t.participant_id)
+"""
+
+JOBS = {
+    "phase2": [
+        Job("english_ratings_phase2"),
+        Job("participants_phase2", "participant_id"),
+    ],
+    "placeholders": [
+        Job("participants_phase3", "participant_id", _PLACEHOLDER),
+        # After the participants, so the placeholders just moved count as gone
+        Job("arm_assignments_phase3", "participant_id", _ORPHANED_ASSIGNMENT),
+    ],
+}
+
+
+# --------------------------------------------------------------------------------
+# Destinations
+# --------------------------------------------------------------------------------
+class TableArchive:
+    """Same-named compressed tables in another schema."""
+
+    def __init__(self, schema: str = ARCHIVE_SCHEMA):
+        self.schema = schema
+
+    def prepare(self, conn, job: Job):
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{self.schema}`")
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s AND table_name = %s",
+                (self.schema, job.table),
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute(f"CREATE TABLE `{self.schema}`.`{job.table}` LIKE {LIVE_SCHEMA}.`{job.table}`")
+                cursor.execute(f"ALTER TABLE `{self.schema}`.`{job.table}` ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8")
+
+    def write(self, cursor, job: Job, description, rows, keys):
+        cursor.execute(
+            f"INSERT INTO `{self.schema}`.`{job.table}` SELECT * FROM {LIVE_SCHEMA}.`{job.table}` "
+            f"WHERE `{job.key}` IN %s",
+            (keys,),
+        )
+        # Rolled back together with the delete, nothing to undo
+
+
+class ParquetArchive:
+    """One zstd Parquet file per batch under <directory>/<table>/."""
+
+    def __init__(self, directory: Path = ARCHIVE_DIR):
+        self.directory = Path(directory)
+
+    def prepare(self, conn, job: Job):
+        (self.directory / job.table).mkdir(parents=True, exist_ok=True)
+
+    def write(self, cursor, job: Job, description, rows, keys):
+        """Returns how to undo the write if the delete does not commit."""
+        schema = export_parquet.arrow_schema(description)
+        columns = list(zip(*rows))
+        batch = pa.Table.from_arrays(
+            [export_parquet._column(values, field.type) for values, field in zip(columns, schema)], schema=schema
+        )
+        # A batch re-run after a crash picks the same keys, so it overwrites its own file
+        path = self.directory / job.table / f"part-{keys[0]:012d}-{keys[-1]:012d}.parquet"
+        pq.write_table(batch, path, compression="zstd")
+        return lambda: path.unlink(missing_ok=True)
+
+
+# --------------------------------------------------------------------------------
+# Moving rows
+# --------------------------------------------------------------------------------
+def _condition(job: Job, horizon: str) -> str:
+    return f" AND ({job.where.format(horizon=horizon)})" if job.where else ""
+
+
+def _exists(conn, table: str, column: str = None) -> bool:
+    with conn.cursor() as cursor:
+        if column is None:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s AND table_name = %s",
+                (LIVE_SCHEMA, table),
+            )
+        else:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.columns "
+                "WHERE table_schema = %s AND table_name = %s AND column_name = %s",
+                (LIVE_SCHEMA, table, column),
+            )
+        return bool(cursor.fetchone()[0])
+
+
+def placeholder_horizon(conn, min_age_hours: float) -> str:
+    """Newest created_at a placeholder may have to count as abandoned, in server time."""
+    if not _exists(conn, "participants_phase3", "created_at"):
+        raise SystemExit("participants_phase3.created_at is missing; apply migration 6 (python migrate.py apply)")
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT NOW() - INTERVAL %s SECOND", (int(min_age_hours * 3600),))
+        return str(cursor.fetchone()[0])
+
+
+def next_keys(conn, job: Job, after, batch: int, horizon: str) -> list:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT t.`{job.key}` FROM {LIVE_SCHEMA}.`{job.table}` t "
+            f"WHERE t.`{job.key}` > %s{_condition(job, horizon)} ORDER BY t.`{job.key}` LIMIT %s",
+            (after, batch),
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def move_batch(conn, job: Job, keys: list, destination, horizon: str) -> int:
+    """Copy and delete the rows of keys that still qualify, in one transaction."""
+    undo = None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT t.* FROM {LIVE_SCHEMA}.`{job.table}` t "
+                f"WHERE t.`{job.key}` IN %s{_condition(job, horizon)} ORDER BY t.`{job.key}` FOR UPDATE",
+                (keys,),
+            )
+            description, rows = cursor.description, cursor.fetchall()
+            if rows:
+                index = [column[0] for column in description].index(job.key)
+                locked = [row[index] for row in rows]
+                undo = destination.write(cursor, job, description, rows, locked)
+                cursor.execute(f"DELETE FROM {LIVE_SCHEMA}.`{job.table}` WHERE `{job.key}` IN %s", (locked,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        if undo:
+            undo()
+        raise
+    return len(rows)
+
+
+def run_job(conn, job: Job, destination, batch=DEFAULT_BATCH, pause=DEFAULT_PAUSE,
+            min_age_hours=MIN_AGE_HOURS, dry_run=False) -> int:
+    if not _exists(conn, job.table):
+        print(f"{job.table}: no such table, skipped")
+        return 0
+    if job.key is None:
+        job = replace(job, key=db.primary_key(conn, job.table))
+    limit = placeholder_horizon(conn, min_age_hours) if "{horizon}" in job.where else ""
+    if dry_run:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {LIVE_SCHEMA}.`{job.table}` t WHERE 1{_condition(job, limit)}")
+            count = cursor.fetchone()[0]
+        conn.rollback()
+        print(f"{job.table}: {count} rows would be archived")
+        return count
+
+    destination.prepare(conn, job)
+    started, moved, after = time.perf_counter(), 0, 0
+    while True:
+        keys = next_keys(conn, job, after, batch, limit)
+        conn.rollback()     # end the read view, so purge is not held back between batches
+        if not keys:
+            break
+        for attempt in range(LOCK_RETRIES):
+            try:
+                moved += move_batch(conn, job, keys, destination, limit)
+                break
+            except pymysql.err.OperationalError as e:
+                if e.args[0] != _LOCK_WAIT_TIMEOUT or attempt == LOCK_RETRIES - 1:
+                    raise
+                time.sleep(pause * 2 ** attempt)
+        after = keys[-1]
+        print(f"  {job.table}: {moved} rows, up to {job.key}={after}", end="\r", flush=True)
+        time.sleep(pause)
+    print(f"{job.table}: {moved} rows archived in {time.perf_counter() - started:.1f}s" + " " * 20)
+    return moved
+
+
+def optimize(conn, tables):
+    with conn.cursor() as cursor:
+        for table in tables:
+            started = time.perf_counter()
+            cursor.execute(f"OPTIMIZE TABLE {LIVE_SCHEMA}.`{table}`")
+            cursor.fetchall()
+            print(f"{table}: rebuilt in {time.perf_counter() - started:.1f}s")
+
+
+# --------------------------------------------------------------------------------
+# Measurement
+# --------------------------------------------------------------------------------
+def table_sizes(conn) -> dict:
+    with conn.cursor() as cursor:
+        try:
+            # MySQL 8 caches these figures for a day by default
+            cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        except pymysql.err.MySQLError:
+            pass
+        cursor.execute(
+            "SELECT table_name, table_rows, data_length, index_length FROM information_schema.tables "
+            "WHERE table_schema = %s AND table_type = 'BASE TABLE'",
+            (LIVE_SCHEMA,),
+        )
+        return {name: {"rows": rows, "data_bytes": data, "index_bytes": index}
+                for name, rows, data, index in cursor.fetchall()}
+
+
+def _status(conn) -> dict:
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS LIKE 'Innodb_buffer_pool_%'")
+        return {name: int(value) for name, value in cursor.fetchall() if str(value).isdigit()}
+
+
+def buffer_pool(conn, window: float = DEFAULT_WINDOW) -> dict:
+    """Hit rate of logical reads over the next window seconds, and how full the pool is."""
+    first = _status(conn)
+    time.sleep(window)
+    last = _status(conn)
+    requests = last["Innodb_buffer_pool_read_requests"] - first["Innodb_buffer_pool_read_requests"]
+    misses = last["Innodb_buffer_pool_reads"] - first["Innodb_buffer_pool_reads"]
+    return {
+        "window_s": window,
+        "read_requests": requests,
+        "disk_reads": misses,
+        "hit_rate": 1 - misses / requests if requests else None,
+        "pages_total": last["Innodb_buffer_pool_pages_total"],
+        "pages_data": last["Innodb_buffer_pool_pages_data"],
+        "pages_free": last["Innodb_buffer_pool_pages_free"],
+    }
+
+
+def measure(conn, label: str, window: float = DEFAULT_WINDOW, directory=None) -> dict:
+    record = {"at": time.time(), "label": label, "tables": table_sizes(conn), "buffer_pool": buffer_pool(conn, window)}
+    conn.rollback()
+    directory = Path(directory or ARCHIVE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / MEASUREMENTS, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    return record
+
+
+def load_measurements(directory=None) -> list:
+    path = Path(directory or ARCHIVE_DIR) / MEASUREMENTS
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(before: dict, after: dict):
+    mb = 1024 * 1024
+    print(f"{'table':<32} {'rows':>20} {'data+index MB':>20}")
+    for table in sorted(set(before["tables"]) | set(after["tables"])):
+        b, a = before["tables"].get(table, {}), after["tables"].get(table, {})
+        size_b = (b.get("data_bytes", 0) + b.get("index_bytes", 0)) / mb
+        size_a = (a.get("data_bytes", 0) + a.get("index_bytes", 0)) / mb
+        print(f"{table:<32} {b.get('rows', 0):>9} -> {a.get('rows', 0):>8} {size_b:>9.1f} -> {size_a:>8.1f}")
+    for record in (before, after):
+        pool = record["buffer_pool"]
+        hit = "-" if pool["hit_rate"] is None else f"{pool['hit_rate']:.4%}"
+        print(f"{record['label']:<16} buffer pool hit rate {hit} over {pool['window_s']:.0f}s "
+              f"({pool['read_requests']} reads), {pool['pages_data']}/{pool['pages_total']} pages hold data")
+
+
+# --------------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "measure", "report"])
+    parser.add_argument("jobs", nargs="*", help=f"run: what to archive ({', '.join(JOBS)})")
+    parser.add_argument("--to", choices=["table", "parquet"], default="table")
+    parser.add_argument("--archive-schema", default=ARCHIVE_SCHEMA)
+    parser.add_argument("--dir", type=Path, default=ARCHIVE_DIR, help="Parquet parts and measurements")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="rows per transaction")
+    parser.add_argument("--pause", type=float, default=DEFAULT_PAUSE, help="seconds between batches")
+    parser.add_argument("--min-age-hours", type=float, default=MIN_AGE_HOURS,
+                        help="placeholders: leave participants created in the last N hours alone")
+    parser.add_argument("--dry-run", action="store_true", help="count what would move, write nothing")
+    parser.add_argument("--optimize", action="store_true", help="rebuild the tables rows were taken from")
+    parser.add_argument("--measure", action="store_true", help="measure sizes and hit rate before and after")
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW, help="seconds to sample the hit rate")
+    parser.add_argument("--label", default="manual", help="measure: name of this measurement")
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    args = parser.parse_args(argv)
+
+    if args.command == "report":
+        records = load_measurements(args.dir)
+        befores = [r for r in records if r["label"] == "before"]
+        if not befores:
+            raise SystemExit("no 'before' measurement; use run --measure")
+        compare(befores[-1], records[-1])
+        return
+    unknown = [name for name in args.jobs if name not in JOBS]
+    if unknown or (args.command == "run" and not args.jobs):
+        parser.error(f"name what to archive: {', '.join(JOBS)}")
+    spooled = fallback.pending() if args.command == "run" and not args.dry_run else []
+    if spooled:
+        raise SystemExit(f"unreplayed writes in {fallback.SPOOL_DIR} ({len(spooled)} files); "
+                         "run python fallback.py replay first")
+
+    with db.tunnel_session(db.load_secrets(args.secrets)) as (secrets, tunnel):
+        conn = db.get_connection(tunnel, secrets, autocommit=False)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SET SESSION innodb_lock_wait_timeout = {LOCK_WAIT_SECONDS}")
+            if args.command == "measure":
+                record = measure(conn, args.label, args.window, args.dir)
+                befores = [r for r in load_measurements(args.dir) if r["label"] == "before"]
+                compare(befores[-1] if befores else record, record)
+                return
+            before = None if args.dry_run or not args.measure else measure(conn, "before", args.window, args.dir)
+            destination = ParquetArchive(args.dir) if args.to == "parquet" else TableArchive(args.archive_schema)
+            shrunk = []
+            for name in args.jobs:
+                for job in JOBS[name]:
+                    if run_job(conn, job, destination, args.batch, args.pause, args.min_age_hours, args.dry_run):
+                        shrunk.append(job.table)
+            if args.optimize and not args.dry_run:
+                optimize(conn, shrunk)
+            if before is not None:
+                compare(before, measure(conn, "after", args.window, args.dir))
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
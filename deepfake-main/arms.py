@@ -0,0 +1,114 @@
+"""
+Quota-aware arm assignment for new phase-3 participants.
+
+The arm used to be chosen by which page file was deployed, so control, T1 and
+T2 ran as three recruitment waves. app.py now calls assign() once per
+participant. assign() puts the participant in the arm furthest below its quota
+and routes them to that arm's page.
+
+Counts live in shared_state.py, so every worker on the host sees the same
+ones and a pick never waits for MySQL. Each pick is appended to a local buffer
+and written to arm_assignments_phase3 in batches (flush()). That table is what
+the counters are seeded from after a restart.
+
+Quotas come from `arm_quotas = [control, t1, t2]` in secrets.toml.
+"""
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import shared_state
+
+# group_no of english_ratings_phase3 -> page that shows that arm
+ARM_PAGES = {
+    1: "pages/Rate_responses_phase3.py",
+    2: "pages/Rate_responses_phase3_T1.py",
+    3: "pages/Rate_responses_phase3_T2.py",
+}
+DEFAULT_QUOTAS = [200, 200, 200]
+
+FLUSH_EVERY = 20        # assignments
+FLUSH_SECONDS = 30
+
+CREATE_ASSIGNMENTS = """
+CREATE TABLE IF NOT EXISTS deepfakes.arm_assignments_phase3 (
+    participant_id INT NOT NULL PRIMARY KEY,
+    group_no INT NOT NULL,
+    assigned_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY ix_arm_assignments_group (group_no)
+)
+"""
+
+# Participants that rated before assignments were logged keep the arm they rated in.
+BACKFILL_ASSIGNMENTS = """
+INSERT IGNORE INTO deepfakes.arm_assignments_phase3 (participant_id, group_no)
+SELECT participant_id, MIN(group_no)
+FROM deepfakes.english_ratings_phase3
+GROUP BY participant_id
+"""
+
+_INSERT_ASSIGNMENTS = text(
+    """
+    INSERT IGNORE INTO deepfakes.arm_assignments_phase3 (participant_id, group_no)
+    VALUES (:participant_id, :group_no)
+    """
+)
+
+log = logging.getLogger("arms")
+
+_pending = []
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def configure(quotas=None):
+    """Publish the quotas to the shared counters; cheap when they are unchanged."""
+    quotas = list(quotas or DEFAULT_QUOTAS)
+    targets = {arm: int(quota) for arm, quota in zip(sorted(ARM_PAGES), quotas)}
+    state = shared_state.get_shared_state()
+    if state.arm_targets() != targets:
+        state.set_arm_targets(targets)
+
+
+def choose(assigned: dict, targets: dict) -> int:
+    """Arm with the lowest fill ratio; ties broken at random. Past quota, keep the ratios level."""
+    open_arms = [arm for arm in ARM_PAGES if targets.get(arm, 0) > 0]
+    if not open_arms:
+        return random.choice(list(ARM_PAGES))
+    fill = {arm: assigned.get(arm, 0) / targets[arm] for arm in open_arms}
+    lowest = min(fill.values())
+    return random.choice([arm for arm, ratio in fill.items() if ratio == lowest])
+
+
+def assign(engine, participant_id: int) -> int:
+    arm = shared_state.get_shared_state(engine).claim_arm(choose)
+    with _pending_lock:
+        _pending.append({"participant_id": participant_id, "group_no": arm})
+        due = len(_pending) >= FLUSH_EVERY or time.monotonic() - _last_flush > FLUSH_SECONDS
+    if due:
+        flush(engine)
+    return arm
+
+
+def flush(engine) -> int:
+    """Write buffered assignments. On failure they stay buffered for the next try."""
+    global _last_flush
+    with _pending_lock:
+        batch = _pending[:]
+        del _pending[:]
+        _last_flush = time.monotonic()
+    if not batch:
+        return 0
+    try:
+        with engine.begin() as db_conn:
+            db_conn.execute(_INSERT_ASSIGNMENTS, batch)
+    except SQLAlchemyError as e:
+        log.warning("could not persist %d arm assignments: %s", len(batch), e)
+        with _pending_lock:
+            _pending[:0] = batch
+        return 0
+    return len(batch)
@@ -0,0 +1,84 @@
+"""
+Time analysis.report() on a synthetic phase-3 ratings table.
+
+    python benchmarks/bench_analysis.py              # 10M rows
+    python benchmarks/bench_analysis.py --rows 1000000 --repeat 5
+
+Also times a row-by-row pandas groupby/apply version of the per-arm accuracy,
+the way the ad-hoc notebooks did it, on a slice of the data for comparison.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import analysis  # noqa: E402
+
+
+def synthetic_ratings(n: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    group_no = rng.integers(1, 4, n, dtype=np.int8)
+    # Warnings make "Fake" more likely and push the scale down.
+    p_fake = np.choose(group_no - 1, [0.45, 0.70, 0.60])
+    perception = (rng.random(n) >= p_fake).astype(np.int8)
+    scale = np.clip(np.where(perception == 1, 7, 3) + rng.integers(-2, 3, n), 1, 10).astype(np.int8)
+    scale[rng.random(n) < 0.01] = analysis.MISSING
+    return {
+        "participant_id": np.arange(n, dtype=np.int64),
+        "audio_clip_id": rng.integers(1, 400, n),
+        "group_no": group_no,
+        "realness_scale": scale,
+        "realness_perception": perception,
+        "trust_content": rng.integers(1, 11, n, dtype=np.int8),
+        "trust_media": rng.integers(1, 11, n, dtype=np.int8),
+        "passed_check": rng.random(n) < 0.93,
+    }
+
+
+def naive_accuracy(frame: pd.DataFrame) -> pd.Series:
+    return frame.groupby("group_no").apply(
+        lambda g: sum(1 for v in g["realness_perception"] if v == 0) / len(g)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--naive-rows", type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    ratings = synthetic_ratings(args.rows)
+    print(f"generated {args.rows:,} rows in {time.perf_counter() - started:.2f}s "
+          f"({sum(v.nbytes for v in ratings.values()) / 1e6:.0f} MB columnar)")
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        tables = analysis.report(ratings)
+        timings.append(time.perf_counter() - started)
+    print(f"analysis.report: best {min(timings):.2f}s, median {np.median(timings):.2f}s over {args.repeat} runs")
+
+    n = min(args.naive_rows, args.rows)
+    frame = pd.DataFrame({k: v[:n] for k, v in ratings.items()})
+    started = time.perf_counter()
+    naive_accuracy(frame)
+    naive = time.perf_counter() - started
+    started = time.perf_counter()
+    analysis.accuracy_by_arm({k: v[:n] for k, v in ratings.items()})
+    vectorised = time.perf_counter() - started
+    print(f"accuracy on {n:,} rows: row loop {naive:.2f}s vs bincount {vectorised:.3f}s "
+          f"({naive / vectorised:.0f}x)")
+
+    with pd.option_context("display.width", 160):
+        print(tables["accuracy"].to_string())
+        print(tables["warning_effects"].to_string())
+
+
+if __name__ == "__main__":
+    main()
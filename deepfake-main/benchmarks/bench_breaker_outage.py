@@ -0,0 +1,181 @@
+"""
+Fault injection: how many script threads a database outage ties up, with and
+without the circuit breaker in db.py.
+
+    python benchmarks/bench_breaker_outage.py
+    python benchmarks/bench_breaker_outage.py --threads 32 --outage 30 --timeout 5
+
+--threads simulated page reruns each loop on "check out, SELECT 1, think". The
+database is healthy, then unreachable for --outage seconds (every connect and
+every statement hangs for --timeout seconds and then fails, like a dead tunnel
+behind connect_timeout/read_timeout), then healthy again.
+
+  retry    the old page behaviour: plain pool, get_connection() retries
+           --retries times with --retry-delay between attempts
+  breaker  db.guarded_engine() with db.CircuitBreaker, no retries
+
+Per phase it prints thread occupancy (share of thread time spent inside a DB
+call), requests served, fast failures and tail latency, plus how long after the
+outage it took until requests succeeded again. SQLite stands in for MySQL so
+the script runs anywhere; only the injected waits matter.
+"""
+import argparse
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import db  # noqa: E402
+
+
+class Outage:
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.down = False
+
+    def hang(self):
+        if self.down:
+            time.sleep(self.timeout)
+            raise sqlite3.OperationalError("injected: database unreachable")
+
+
+class _Cursor:
+    def __init__(self, cursor, outage):
+        self._cursor, self._outage = cursor, outage
+
+    def execute(self, *args):
+        self._outage.hang()
+        return self._cursor.execute(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _Connection:
+    def __init__(self, connection, outage):
+        self._connection, self._outage = connection, outage
+
+    def cursor(self, *args):
+        return _Cursor(self._connection.cursor(*args), self._outage)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def make_creator(path, outage, retries=1, delay=0.0):
+    def creator():
+        for attempt in range(retries):
+            try:
+                outage.hang()
+                return _Connection(sqlite3.connect(path, check_same_thread=False), outage)
+            except sqlite3.OperationalError:
+                if attempt == retries - 1:
+                    raise
+                time.sleep(delay)
+    return creator
+
+
+def run(mode, args):
+    outage = Outage(args.timeout)
+    path = str(Path(tempfile.mkdtemp()) / "stand-in.db")
+    pool = dict(pool_pre_ping=True, pool_size=args.threads // 2, max_overflow=args.threads // 2, pool_timeout=args.timeout)
+    if mode == "retry":
+        engine = create_engine(
+            "sqlite://", creator=make_creator(path, outage, args.retries, args.retry_delay), poolclass=QueuePool, **pool
+        )
+    else:
+        breaker = db.CircuitBreaker(base_delay=args.timeout / 2, max_delay=args.timeout * 2)
+        engine = db.guarded_engine("sqlite://", make_creator(path, outage), breaker, **pool)
+
+    start = time.monotonic()
+    phases = [("before", args.before), ("outage", args.outage), ("after", args.after)]
+    bounds, t = [], 0.0
+    for name, length in phases:
+        bounds.append((name, t, t + length))
+        t += length
+    stop_at = start + t
+    events = []  # (thread, started, ended, ok, fast)
+    lock = threading.Lock()
+
+    def driver():
+        for name, begin, end in bounds:
+            time.sleep(max(0.0, start + begin - time.monotonic()))
+            outage.down = name == "outage"
+
+    def page(thread_no):
+        while time.monotonic() < stop_at:
+            started = time.monotonic()
+            ok = fast = False
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                ok = True
+            except db.DatabaseUnavailable:
+                fast = True
+            except Exception:
+                pass
+            ended = time.monotonic()
+            with lock:
+                events.append((thread_no, started - start, ended - start, ok, fast))
+            time.sleep(args.think)
+
+    threads = [threading.Thread(target=driver)] + [
+        threading.Thread(target=page, args=(i,), daemon=True) for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    threads[0].join()
+    time.sleep(args.timeout * args.retries + 1)  # let stragglers finish
+    engine.dispose()
+
+    rows = []
+    for name, begin, end in bounds:
+        # Time each thread spent inside DB calls, clipped to the phase.
+        busy = sum(max(0.0, min(e, end) - max(s, begin)) for _, s, e, _, _ in events)
+        in_phase = [ev for ev in events if begin <= ev[1] < end]
+        latency = np.array([e - s for _, s, e, _, _ in in_phase]) * 1000
+        rows.append({
+            "phase": name,
+            "occupancy": busy / (args.threads * (end - begin)),
+            "served": sum(ev[3] for ev in in_phase),
+            "fast_fail": sum(ev[4] for ev in in_phase),
+            "p50_ms": np.percentile(latency, 50) if len(latency) else float("nan"),
+            "p99_ms": np.percentile(latency, 99) if len(latency) else float("nan"),
+        })
+    outage_end = bounds[1][2]
+    first_ok = min((s for _, s, _, ok, _ in events if ok and s >= outage_end), default=float("nan"))
+    return rows, first_ok - outage_end
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--before", type=float, default=5)
+    parser.add_argument("--outage", type=float, default=20)
+    parser.add_argument("--after", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=3, help="injected hang per connect/statement, seconds")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--retry-delay", type=float, default=2)
+    parser.add_argument("--think", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    print(f"{args.threads} threads; healthy {args.before:.0f}s, outage {args.outage:.0f}s, "
+          f"healthy {args.after:.0f}s; injected hang {args.timeout}s\n")
+    print(f"{'mode':<8} {'phase':<7} {'occupancy':>9} {'served':>7} {'fast fail':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in ("retry", "breaker"):
+        rows, recovery = run(mode, args)
+        for row in rows:
+            print(f"{mode:<8} {row['phase']:<7} {row['occupancy']:>9.0%} {row['served']:>7} "
+                  f"{row['fast_fail']:>9} {row['p50_ms']:>8.0f} {row['p99_ms']:>8.0f}")
+        print(f"{mode:<8} first success {recovery:.1f}s after the outage ended\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Storage and query-speed comparison: text-encoded multi-selects vs encoding.py.
+
+    python benchmarks/bench_encoding.py --rows 1000000
+
+For each field it compares the bytes stored per row (json.dumps / ", ".join
+text vs the integer column) and the time to answer "which rows selected X"
+by string parsing, by substring search and by the vectorised bit test.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import encoding  # noqa: E402
+
+COLUMN_BYTES = {"mask": 4, "codes": 8}
+
+
+def random_selections(field, n, rng, max_selections=3):
+    labels = np.array(encoding.FIELDS[field].labels, dtype=object)
+    sizes = rng.integers(1, max_selections + 1, n)
+    return [list(labels[rng.choice(len(labels), k, replace=False)]) for k in sizes]
+
+
+def legacy_text(field, selections):
+    if encoding.FIELDS[field].legacy_format == "json":
+        return [json.dumps(s) for s in selections]
+    return [", ".join(s) for s in selections]
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+
+    rows = []
+    for name, field in encoding.FIELDS.items():
+        selections = random_selections(name, args.rows, rng)
+        raw = pd.Series(legacy_text(name, selections))
+        encoded = np.array([encoding.encode(name, s) for s in selections], dtype=np.uint64)
+        probe = field.labels[1]
+
+        parsed_hits, t_parse = timed(lambda: raw.map(lambda v: probe in encoding.parse_legacy(name, v)).to_numpy())
+        substring_hits, t_substring = timed(lambda: raw.str.contains(probe, regex=False).to_numpy())
+        bit_hits, t_bits = timed(lambda: encoding.contains(name, encoded, probe))
+        assert (parsed_hits == bit_hits).all()
+
+        text_bytes = raw.str.len().mean()
+        rows.append({
+            "field": name,
+            "text B/row": round(text_bytes, 1),
+            "encoded B/row": COLUMN_BYTES[field.kind],
+            "size ratio": round(text_bytes / COLUMN_BYTES[field.kind], 1),
+            "parse+test ms": round(t_parse * 1000),
+            "substring ms": round(t_substring * 1000),
+            "bit test ms": round(t_bits * 1000, 1),
+            "speedup vs parse": round(t_parse / t_bits),
+            # Substring search also matches inside longer labels ("Niger" in "Nigeria").
+            "substring false hits": int((substring_hits & ~bit_hits).sum()),
+        })
+
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(f"{args.rows:,} rows per field\n")
+        print(pd.DataFrame(rows).set_index("field").to_string())
+
+
+if __name__ == "__main__":
+    main()
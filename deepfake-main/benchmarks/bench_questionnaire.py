@@ -0,0 +1,245 @@
+"""
+Payload and rerun time per interaction: phase-2 questionnaire as one st.form
+vs in sections (questionnaire.py).
+
+    python benchmarks/bench_questionnaire.py
+    python benchmarks/bench_questionnaire.py --participants 5 --miss-one
+
+For each renderer it serves a stand-in page with that renderer through
+`streamlit run`, with no database behind it. It then plays participants over
+the real websocket protocol, the way the browser does. BackMsg.rerun_script
+carries the widget states, and fragment reruns send their fragment_id.
+
+  form      load, fill every widget (a form does not rerun), submit
+  sections  load, then per section: fill its form, Next (fragment rerun)
+
+--miss-one makes every participant skip one required answer once. The form
+clears on submit and everything has to be entered again. The sectioned page
+shows an error in that section and keeps the rest.
+
+Per interaction kind it prints the bytes of ForwardMsgs received until the run
+finished, and the time from sending the rerun to script_finished.
+"""
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado import httpclient, websocket
+
+APP_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(APP_DIR))
+import questionnaire  # noqa: E402
+
+PAGE = '''
+import sys
+sys.path.insert(0, {app_dir!r})
+import streamlit as st
+import questionnaire
+
+st.session_state.setdefault("submitted", 0)
+
+def on_submit(answers):
+    st.session_state["submitted"] += 1
+
+st.title("Welcome, Audio Explorer! 🎧")
+questionnaire.{renderer}("Immigration", "https://example.org/clip.wav", on_submit)
+st.write("submitted", st.session_state["submitted"])
+'''
+
+WIDGETS = {"radio", "multiselect", "checkbox", "text_area", "button"}
+DONE = {
+    ForwardMsg.FINISHED_SUCCESSFULLY,
+    ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+    ForwardMsg.FINISHED_WITH_COMPILE_ERROR,
+}
+
+
+class Browser:
+    """Just enough of the frontend: widget registry, widget states, reruns."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}   # widget id -> (user key, element type, fragment id, proto)
+        self.values = {}    # user key -> value as the frontend would send it
+
+    def key_of(self, widget_id: str) -> str:
+        return widget_id.rsplit("-", 1)[-1]
+
+    def find(self, key=None, submit=False):
+        for widget_id, (user_key, kind, fragment_id, proto) in self.widgets.items():
+            if (submit and kind == "button" and proto.is_form_submitter) or (key and user_key == key):
+                return widget_id, fragment_id
+        raise KeyError(key or "form submit button")
+
+    def _state(self, widget_id, value):
+        msg = WidgetState(id=widget_id)
+        if value is True and self.widgets[widget_id][1] == "button":
+            msg.trigger_value = True
+        elif isinstance(value, bool):
+            msg.bool_value = value
+        elif isinstance(value, list):
+            msg.string_array_value.data.extend(value)
+        else:
+            msg.string_value = str(value)
+        return msg
+
+    async def rerun(self, fragment_id="", trigger=None):
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_name = ""
+        if fragment_id:
+            msg.rerun_script.fragment_id = fragment_id
+        for widget_id, (key, kind, _, _) in self.widgets.items():
+            if kind == "button":
+                if widget_id == trigger:
+                    msg.rerun_script.widget_states.widgets.append(self._state(widget_id, True))
+            elif key in self.values:
+                msg.rerun_script.widget_states.widgets.append(self._state(widget_id, self.values[key]))
+
+        started = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        received, seen, full_run = 0, {}, not fragment_id
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), 30)
+            if raw is None:
+                raise ConnectionError("session closed")
+            received += len(raw)
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                full_run, seen = not forward.new_session.fragment_ids_this_run, {}
+            elif kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type in WIDGETS:
+                    proto = getattr(element, element_type)
+                    seen[proto.id] = (self.key_of(proto.id), element_type, forward.delta.fragment_id, proto)
+            elif kind == "script_finished" and forward.script_finished in DONE:
+                break
+        if full_run:
+            self.widgets = seen
+        else:
+            fragments = {fragment for _, _, fragment, _ in seen.values()} | {fragment_id}
+            self.widgets = {k: v for k, v in self.widgets.items() if v[2] not in fragments}
+            self.widgets.update(seen)
+        return received, time.perf_counter() - started
+
+
+def answer_for(question):
+    if question.kind == "scale":
+        return str(random.randint(1, 10))
+    if question.kind == "radio":
+        return random.choice(question.options)
+    if question.kind == "multiselect":
+        return random.sample(question.options, 2)
+    if question.kind == "checkbox":
+        return random.random() < 0.5
+    return "nothing in particular"
+
+
+async def fill_form(browser, record, miss_one):
+    questions = [q for section in questionnaire.SECTIONS for q in section.questions]
+    skipped = random.choice([q for q in questions if q.required]) if miss_one else None
+    for attempt in range(2 if miss_one else 1):
+        browser.values = {q.key: answer_for(q) for q in questions if q is not skipped or attempt}
+        submit, _ = browser.find(submit=True)
+        record("submit", *await browser.rerun(trigger=submit))
+
+
+async def fill_sections(browser, record, miss_one):
+    sections = questionnaire.SECTIONS
+    skipped_in = random.randrange(len(sections)) if miss_one else None
+    for index, section in enumerate(sections):
+        required = [q for q in section.questions if q.required]
+        skipped = random.choice(required) if index == skipped_in and required else None
+        browser.values.update({q.key: answer_for(q) for q in section.questions if q is not skipped})
+        nxt, fragment_id = browser.find(f"{questionnaire.SECTION_KEY}_next")
+        if skipped is not None:
+            record("next (error)", *await browser.rerun(fragment_id, trigger=nxt))
+            browser.values[skipped.key] = answer_for(skipped)
+            nxt, fragment_id = browser.find(f"{questionnaire.SECTION_KEY}_next")
+        kind = "submit" if index == len(sections) - 1 else "next"
+        record(kind, *await browser.rerun(fragment_id, trigger=nxt))
+    browser.values.clear()
+
+
+async def play(base, renderer, participants, miss_one):
+    samples = defaultdict(list)
+
+    def record(kind, size, seconds):
+        samples[kind].append((size, seconds))
+
+    for _ in range(participants):
+        request = httpclient.HTTPRequest(base.replace("http", "ws", 1) + "/_stcore/stream")
+        ws = await websocket.websocket_connect(request, subprotocols=["streamlit"])
+        browser = Browser(ws)
+        try:
+            record("load", *await browser.rerun())
+            fill = fill_form if renderer == "render_form" else fill_sections
+            await fill(browser, record, miss_one)
+        finally:
+            ws.close()
+    return samples
+
+
+async def wait_up(base, timeout=60):
+    http = httpclient.AsyncHTTPClient()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await http.fetch(base + "/_stcore/health", raise_error=False)).code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.3)
+    raise TimeoutError("streamlit did not come up")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--participants", type=int, default=3)
+    parser.add_argument("--miss-one", action="store_true")
+    parser.add_argument("--port", type=int, default=8750)
+    args = parser.parse_args(argv)
+
+    workdir = Path(tempfile.mkdtemp())
+    print(f"{'renderer':<9} {'interaction':<13} {'n':>4} {'KB median':>9} {'KB max':>7} "
+          f"{'ms median':>9} {'ms p95':>7}")
+    for renderer, name in (("render_form", "form"), ("render_sections", "sections")):
+        page = workdir / f"{name}.py"
+        page.write_text(PAGE.format(app_dir=str(APP_DIR), renderer=renderer))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", str(page), "--server.port", str(args.port),
+             "--server.headless", "true", "--browser.gatherUsageStats", "false"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        base = f"http://127.0.0.1:{args.port}"
+        try:
+            asyncio.run(wait_up(base))
+            samples = asyncio.run(play(base, renderer, args.participants, args.miss_one))
+        finally:
+            server.terminate()
+            server.wait()
+        total = 0
+        for kind, rows in samples.items():
+            sizes = np.array([size for size, _ in rows]) / 1024
+            times = np.array([seconds for _, seconds in rows]) * 1000
+            total += sizes.sum()
+            print(f"{name:<9} {kind:<13} {len(rows):>4} {np.median(sizes):>9.1f} {sizes.max():>7.1f} "
+                  f"{np.median(times):>9.1f} {np.percentile(times, 95):>7.1f}")
+        print(f"{name:<9} {'per particip.':<13} {'':>4} {total / args.participants:>9.1f} KB in total\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Completed participants per minute vs number of Streamlit workers (serve.py).
+
+    python benchmarks/bench_scale_out.py --workers 1 2 4 --sessions 40
+    python benchmarks/bench_scale_out.py --standin --cpu-ms 30 --io-ms 60
+
+For each worker count it starts serve.py, then keeps --sessions simulated
+participants busy for --duration seconds. A participant opens a real Streamlit
+session through the proxy (websocket, BackMsg.rerun_script) and walks the page
+flow app -> rating page -> Demographics -> End_participation, doing
+--reruns-per-page script runs on each page, which is what a browser triggers
+while the form is filled in. A participant counts as completed when the last run
+of the last page has finished.
+
+By default the real app is served, so the pages do their real DB work (secrets
+must point at a test database). --standin serves a generated page that spends
+--cpu-ms holding the GIL and --io-ms waiting (like a query) per run instead, to
+measure the deployment on its own.
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado import httpclient, websocket
+
+APP_DIR = Path(__file__).resolve().parents[1]
+FLOW = ["", "Rate_responses_phase3", "Demographics", "End_participation"]
+
+STANDIN_PAGE = '''
+import time
+import streamlit as st
+
+started = time.thread_time()
+while (time.thread_time() - started) * 1000 < {cpu_ms}:
+    pass
+time.sleep({io_ms} / 1000)
+st.write("run", st.session_state.setdefault("runs", 0))
+st.session_state["runs"] += 1
+'''
+
+
+async def run_page(ws, page_name: str, timeout: float):
+    msg = BackMsg()
+    msg.rerun_script.page_name = page_name
+    msg.rerun_script.query_string = ""
+    await ws.write_message(msg.SerializeToString(), binary=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        raw = await asyncio.wait_for(ws.read_message(), max(deadline - time.monotonic(), 0.001))
+        if raw is None:
+            raise ConnectionError("session closed")
+        if isinstance(raw, str):
+            continue
+        forward = ForwardMsg()
+        forward.ParseFromString(raw)
+        if forward.WhichOneof("type") == "script_finished":
+            return
+
+
+async def participant(base: str, flow, reruns: int, timeout: float) -> None:
+    http = httpclient.AsyncHTTPClient()
+    response = await http.fetch(base + "/", raise_error=False)
+    cookies = [c.split(";", 1)[0] for c in response.headers.get_list("Set-Cookie")]
+    request = httpclient.HTTPRequest(
+        base.replace("http", "ws", 1) + "/_stcore/stream",
+        headers={"Cookie": "; ".join(cookies)},
+    )
+    ws = await websocket.websocket_connect(request, subprotocols=["streamlit"])
+    try:
+        for page in flow:
+            for _ in range(reruns):
+                await run_page(ws, page, timeout)
+    finally:
+        ws.close()
+
+
+async def drive(base: str, sessions: int, duration: float, flow, reruns: int, timeout: float) -> dict:
+    completed, failed = 0, 0
+    stop_at = time.monotonic() + duration
+
+    async def loop():
+        nonlocal completed, failed
+        while time.monotonic() < stop_at:
+            try:
+                await participant(base, flow, reruns, timeout)
+            except Exception:
+                failed += 1
+                await asyncio.sleep(0.5)
+            else:
+                if time.monotonic() <= stop_at:
+                    completed += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(loop() for _ in range(sessions)))
+    elapsed = time.monotonic() - started
+    return {"completed": completed, "failed": failed, "per_minute": completed * 60 / elapsed}
+
+
+def start_server(workers: int, port: int, script: str, extra=()):
+    process = subprocess.Popen(
+        [sys.executable, str(APP_DIR / "serve.py"), "--workers", str(workers),
+         "--port", str(port), "--address", "127.0.0.1", "--first-worker-port", str(port + 100),
+         "--script", script, *extra],
+        cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return process
+
+
+async def wait_up(base: str, timeout: float = 120):
+    http = httpclient.AsyncHTTPClient()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await http.fetch(base + "/_stcore/health", raise_error=False)).code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("serve.py did not come up")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--sessions", type=int, default=40, help="concurrent simulated participants")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--reruns-per-page", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60, help="per script run")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--standin", action="store_true")
+    parser.add_argument("--cpu-ms", type=float, default=30)
+    parser.add_argument("--io-ms", type=float, default=60)
+    args = parser.parse_args(argv)
+
+    script, flow, extra = "app.py", FLOW, []
+    if args.standin:
+        page = Path(tempfile.mkdtemp()) / "standin.py"
+        page.write_text(STANDIN_PAGE.format(cpu_ms=args.cpu_ms, io_ms=args.io_ms))
+        script, flow, extra = str(page), FLOW[:1] * len(FLOW), ["--warm-connections", "0"]
+
+    base = f"http://127.0.0.1:{args.port}"
+    print(f"{args.sessions} sessions, {args.duration:.0f}s, {len(flow)} pages x {args.reruns_per_page} runs")
+    print(f"{'workers':>7} {'completed':>9} {'failed':>6} {'per min':>8} {'speedup':>7}")
+    baseline = None
+    for workers in args.workers:
+        server = start_server(workers, args.port, script, extra)
+        try:
+            asyncio.run(wait_up(base))
+            result = asyncio.run(
+                drive(base, args.sessions, args.duration, flow, args.reruns_per_page, args.timeout)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        baseline = baseline or result["per_minute"] or None
+        speedup = result["per_minute"] / baseline if baseline else float("nan")
+        print(f"{workers:>7} {result['completed']:>9} {result['failed']:>6} "
+              f"{result['per_minute']:>8.1f} {speedup:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Round trips and latency of one submission, phase 2 (Rate_responses.py) and
+phase 3 (Rate_responses_phase3*.py).
+
+    python benchmarks/bench_submit.py
+    python benchmarks/bench_submit.py --rtt-ms 40 --submissions 200 --phase 3
+
+phase 2
+  split       the old save path: insert_rating() in one pool.begin(), then
+              mark_as_rated() in a second one
+  single      both in one fallback.begin() transaction on one checkout
+phase 3
+  select      the original sequence: insert and both summary upserts, then
+              the rerun picks the next clip with ORDER BY RAND() on a new checkout
+  statements  insert and upserts only; the next clip comes from the in-memory
+              playlist (playlist.py, catalog.py)
+  procedure   summary.submit_rating(): one CALL. The stand-in runs the
+              procedure's statements locally and charges one round trip
+
+The engine is set up like db.get_app_engine() (pool_pre_ping, reset on
+return). Every DBAPI call that goes to the server costs one round trip and
+sleeps --rtt-ms. That covers the pre-ping, each statement, executemany (pymysql
+sends a multi-row INSERT), COMMIT and the ROLLBACK at checkin. That RTT is what
+the SSH tunnel adds. SQLite stands in for MySQL so the script runs anywhere.
+The statements are the pages', minus MySQL-only syntax.
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import fallback  # noqa: E402
+import summary  # noqa: E402
+
+SCHEMA = (
+    "CREATE TABLE audio_clips (audio_clip_id INTEGER PRIMARY KEY, url TEXT, topic TEXT, group_no INT, rated INT)",
+    "CREATE TABLE english_ratings_phase2 (rating_id INTEGER PRIMARY KEY, participant_id INT, audio_clip_id INT, "
+    "realness_scale INT, group_no INT, mip_topics TEXT, mip_topics_mask INT)",
+    "CREATE TABLE multiselect_members (field_id INT, code INT, row_id INT, PRIMARY KEY (field_id, code, row_id))",
+    f"CREATE TABLE english_ratings_phase3 (rating_id INTEGER PRIMARY KEY, {', '.join(summary.RATING_COLUMNS)})",
+    f"CREATE TABLE clip_summary_phase3 (audio_clip_id INT, group_no INT, {', '.join(summary._COUNTERS)}, "
+    "PRIMARY KEY (audio_clip_id, group_no))",
+    f"CREATE TABLE arm_summary_phase3 (group_no INT PRIMARY KEY, {', '.join(summary._COUNTERS)})",
+)
+INSERT_RATING = text(
+    "INSERT INTO english_ratings_phase2 (participant_id, audio_clip_id, realness_scale, group_no, mip_topics, "
+    "mip_topics_mask) VALUES (:participant_id, :audio_clip_id, :realness_scale, :group_no, :mip_topics, :mask)"
+)
+DELETE_MEMBERS = text("DELETE FROM multiselect_members WHERE row_id = :row_id AND field_id IN (1, 2)")
+INSERT_MEMBERS = text("INSERT OR IGNORE INTO multiselect_members (field_id, code, row_id) VALUES (:field_id, :code, :row_id)")
+MARK_RATED = text("UPDATE audio_clips SET rated = 1 WHERE audio_clip_id = :audio_clip_id")
+INSERT_RATING_PHASE3 = (
+    f"INSERT INTO english_ratings_phase3 ({', '.join(summary.RATING_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in summary.RATING_COLUMNS)})"
+)
+_SET_COUNTERS = ", ".join(f"{c} = {c} + excluded.{c}" for c in summary._COUNTERS)
+UPSERT_CLIP = (
+    f"INSERT INTO clip_summary_phase3 (audio_clip_id, group_no, {summary._INSERT_COLUMNS}) "
+    f"VALUES (?, ?, {', '.join('?' for _ in summary._COUNTERS)}) "
+    f"ON CONFLICT (audio_clip_id, group_no) DO UPDATE SET {_SET_COUNTERS}"
+)
+UPSERT_ARM = (
+    f"INSERT INTO arm_summary_phase3 (group_no, {summary._INSERT_COLUMNS}) "
+    f"VALUES (?, {', '.join('?' for _ in summary._COUNTERS)}) "
+    f"ON CONFLICT (group_no) DO UPDATE SET {_SET_COUNTERS}"
+)
+PICK_CLIP = text("SELECT audio_clip_id, url, topic FROM audio_clips WHERE group_no = 4 ORDER BY RANDOM() LIMIT 1")
+
+
+class Wire:
+    """Counts round trips per thread and charges each one rtt seconds."""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.local = threading.local()
+
+    def trip(self):
+        self.local.trips = getattr(self.local, "trips", 0) + 1
+        time.sleep(self.rtt)
+
+    def take(self) -> int:
+        trips, self.local.trips = getattr(self.local, "trips", 0), 0
+        return trips
+
+
+def _phase3_statements(cursor, rating: dict):
+    """What submit_rating_phase3 does, in SQLite."""
+    counters = summary._increments(rating["realness_scale"], rating["realness_perception"], rating["check_1"],
+                                   rating["trust_content"], rating["trust_media"])
+    counters = [counters[c] for c in summary._COUNTERS]
+    cursor.execute(INSERT_RATING_PHASE3, [rating[c] for c in summary.RATING_COLUMNS])
+    cursor.execute(UPSERT_CLIP, [rating["audio_clip_id"], rating["group_no"], *counters])
+    cursor.execute(UPSERT_ARM, [rating["group_no"], *counters])
+
+
+class _Cursor:
+    def __init__(self, cursor, wire):
+        self._cursor, self._wire = cursor, wire
+
+    def execute(self, statement, *args):
+        self._wire.trip()
+        if statement.startswith("CALL deepfakes.submit_rating_phase3"):
+            # SQLite has no procedures: the body runs here, on the server's side of the wire
+            return _phase3_statements(self._cursor, dict(zip(summary.RATING_COLUMNS, args[0])))
+        if statement.startswith("SELECT COUNT(*) FROM information_schema.routines"):
+            return self._cursor.execute("SELECT 1")
+        return self._cursor.execute(statement, *args)
+
+    def executemany(self, *args):
+        self._wire.trip()
+        return self._cursor.executemany(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _Connection:
+    def __init__(self, connection, wire):
+        self._connection, self._wire = connection, wire
+
+    def cursor(self, *args):
+        return _Cursor(self._connection.cursor(*args), self._wire)
+
+    def commit(self):
+        self._wire.trip()
+        return self._connection.commit()
+
+    def rollback(self):
+        self._wire.trip()
+        return self._connection.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def make_engine(rtt_ms: float, clips: int):
+    path = str(Path(tempfile.mkdtemp()) / "stand-in.db")
+    setup = sqlite3.connect(path)
+    for statement in SCHEMA:
+        setup.execute(statement)
+    setup.executemany("INSERT INTO audio_clips VALUES (?, ?, 'Immigration', 4, 0)",
+                      [(i, f"https://example.org/{i}.wav") for i in range(1, clips + 1)])
+    setup.commit()
+    setup.close()
+    wire = Wire(rtt_ms / 1000)
+    engine = create_engine(
+        "sqlite://",
+        creator=lambda: _Connection(sqlite3.connect(path, check_same_thread=False, isolation_level=None), wire),
+        poolclass=QueuePool, pool_pre_ping=True, pool_size=4, max_overflow=4,
+    )
+    return engine, wire
+
+
+def insert_rating(db_conn, participant_id, audio_clip_id):
+    topics = random.sample(range(1, 12), 3)
+    result = db_conn.execute(INSERT_RATING, {
+        "participant_id": participant_id, "audio_clip_id": audio_clip_id, "realness_scale": random.randint(1, 10),
+        "group_no": 2, "mip_topics": ",".join(map(str, topics)), "mask": sum(1 << t for t in topics),
+    })
+    db_conn.execute(DELETE_MEMBERS, {"row_id": result.lastrowid})
+    db_conn.execute(INSERT_MEMBERS, [{"field_id": 1, "code": t, "row_id": result.lastrowid} for t in topics])
+
+
+def submit_split(engine, participant_id, audio_clip_id):
+    with engine.begin() as db_conn:
+        insert_rating(db_conn, participant_id, audio_clip_id)
+    with engine.begin() as db_conn:
+        db_conn.execute(MARK_RATED, {"audio_clip_id": audio_clip_id})
+
+
+def submit_single(engine, participant_id, audio_clip_id):
+    with fallback.begin(engine) as db_conn:
+        insert_rating(db_conn, participant_id, audio_clip_id)
+        db_conn.execute(MARK_RATED, {"audio_clip_id": audio_clip_id})
+
+
+def random_rating(participant_id, audio_clip_id) -> dict:
+    return {
+        "participant_id": participant_id, "audio_clip_id": audio_clip_id, "realness_scale": random.randint(1, 10),
+        "realness_perception": random.randint(0, 1), "confident": random.randint(1, 5),
+        "difficult_to_decide": random.randint(1, 5), "trust_content": random.randint(1, 5),
+        "trust_media": random.randint(1, 5), "scam": "No", "take_greenland": "No",
+        "open_ended_response": "", "check_1": random.random() < 0.9, "group_no": random.randint(1, 3),
+    }
+
+
+def submit_phase3_statements(engine, participant_id, audio_clip_id):
+    with fallback.begin(engine) as db_conn:
+        # The page's INSERT and summary.record_rating(), one DBAPI call each
+        _phase3_statements(db_conn.connection.cursor(), random_rating(participant_id, audio_clip_id))
+
+
+def submit_phase3_select(engine, participant_id, audio_clip_id):
+    submit_phase3_statements(engine, participant_id, audio_clip_id)
+    with engine.connect() as db_conn:
+        db_conn.execute(PICK_CLIP).fetchone()
+
+
+def submit_phase3_procedure(engine, participant_id, audio_clip_id):
+    with fallback.begin(engine) as db_conn:
+        if not summary.submit_rating(db_conn, random_rating(participant_id, audio_clip_id)):
+            raise RuntimeError("procedure not found")
+
+
+MODES = {
+    2: {"split": submit_split, "single": submit_single},
+    3: {"select": submit_phase3_select, "statements": submit_phase3_statements,
+        "procedure": submit_phase3_procedure},
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=100)
+    parser.add_argument("--rtt-ms", type=float, default=25.0, help="round-trip time through the tunnel")
+    parser.add_argument("--clips", type=int, default=500)
+    parser.add_argument("--phase", type=int, choices=sorted(MODES), action="append",
+                        help="only this phase (default: all)")
+    args = parser.parse_args(argv)
+
+    print(f"{'mode':<12} {'trips/submit':>12} {'ms median':>9} {'ms p95':>7}")
+    for name, submit in [(f"{phase}:{name}", submit) for phase in args.phase or sorted(MODES)
+                         for name, submit in MODES[phase].items()]:
+        engine, wire = make_engine(args.rtt_ms, args.clips)
+        with engine.connect():
+            pass  # open the pooled connection outside the measurement
+        trips, times = [], []
+        for participant_id in range(1, args.submissions + 1):
+            wire.take()
+            started = time.perf_counter()
+            submit(engine, participant_id, random.randint(1, args.clips))
+            times.append((time.perf_counter() - started) * 1000)
+            trips.append(wire.take())
+        engine.dispose()
+        times = np.array(times)
+        print(f"{name:<12} {np.mean(trips):>12.1f} {np.median(times):>9.1f} {np.percentile(times, 95):>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+In-process copy of deepfakes.audio_clips for the rating pages.
+
+Every form render used to ask MySQL for `ORDER BY RAND() LIMIT 1`, which sorts
+the whole audio set for one row. The clip list changes only when clips are
+imported, so each worker keeps it in memory and picks locally. Importers bump
+the catalog version in shared_state.py; a worker reloads its copy the next time
+it sees a newer version.
+"""
+import random
+import threading
+from typing import NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import db
+import shared_state
+
+# Phase-3 clips are audio_clips.group_no = 4 (not the arm, which is ratings.group_no)
+AUDIO_SET_NO = 4
+
+_SELECT_CLIPS = text(
+    """
+    SELECT audio_clip_id, url, topic
+    FROM deepfakes.audio_clips
+    WHERE group_no = :audio_set_no
+    ORDER BY audio_clip_id
+    """
+)
+
+
+class Clip(NamedTuple):
+    audio_clip_id: int
+    url: str
+    topic: Optional[str]
+
+
+_lock = threading.Lock()
+_catalog = {}  # audio_set_no -> (catalog version, [Clip, ...])
+
+
+def clips(engine, audio_set_no: int = AUDIO_SET_NO) -> list:
+    version = shared_state.get_shared_state().catalog_version
+    cached = _catalog.get(audio_set_no)
+    if cached and cached[0] == version:
+        return cached[1]
+    with _lock:
+        cached = _catalog.get(audio_set_no)
+        if not cached or cached[0] != version:
+            try:
+                with engine.connect() as db_conn:
+                    rows = db_conn.execute(_SELECT_CLIPS, {"audio_set_no": audio_set_no}).fetchall()
+            except (db.DatabaseUnavailable, OperationalError):
+                # Keep serving the copy we have until the database is back.
+                if cached:
+                    return cached[1]
+                raise
+            cached = (version, [Clip(*row) for row in rows])
+            _catalog[audio_set_no] = cached
+    return cached[1]
+
+
+def random_clip(engine, audio_set_no: int = AUDIO_SET_NO) -> Optional[Clip]:
+    """Uniform pick, same distribution as ORDER BY RAND() LIMIT 1. None if the set is empty."""
+    available = clips(engine, audio_set_no)
+    return random.choice(available) if available else None
+
@@ -0,0 +1,510 @@
+"""
+Database access shared by the Streamlit pages and the command-line tools.
+
+The pages pass st.secrets to get_app_engine(); outside Streamlit we read the
+same .streamlit/secrets.toml directly so both always hit the same database.
+"""
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pymysql
+import toml
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+from sshtunnel import SSHTunnelForwarder
+
+APP_DIR = Path(__file__).resolve().parent
+
+log = logging.getLogger("db")
+
+
+# --------------------------------------------------------------------------------
+# Secrets
+# --------------------------------------------------------------------------------
+def load_secrets(path=None) -> dict:
+    """
+    Same lookup Streamlit does: ./.streamlit/secrets.toml, then next to app.py,
+    then ~/.streamlit/secrets.toml. DEEPFAKE_SECRETS overrides all of them.
+    """
+    candidates = [
+        path,
+        os.environ.get("DEEPFAKE_SECRETS"),
+        Path.cwd() / ".streamlit" / "secrets.toml",
+        APP_DIR / ".streamlit" / "secrets.toml",
+        Path.home() / ".streamlit" / "secrets.toml",
+    ]
+    for candidate in candidates:
+        if candidate and Path(candidate).is_file():
+            return toml.load(candidate)
+    raise FileNotFoundError("No secrets.toml found (looked in ./.streamlit, the app folder and ~/.streamlit)")
+
+
+# --------------------------------------------------------------------------------
+# SSH + DB
+# --------------------------------------------------------------------------------
+def start_ssh_tunnel(secrets: dict) -> SSHTunnelForwarder:
+    tunnel = SSHTunnelForwarder(
+        (secrets["ssh_host"], secrets["ssh_port"]),
+        ssh_username=secrets["ssh_user"],
+        ssh_password=secrets["ssh_password"],
+        remote_bind_address=(secrets["db_host"], secrets["db_port"]),
+        set_keepalive=30,
+    )
+    tunnel.start()
+    return tunnel
+
+
+def get_connection(tunnel, secrets: dict, **kwargs):
+    # tunnel is None for a database reachable directly (e.g. a local stand-in)
+    if tunnel is not None and not tunnel.is_active:
+        tunnel.restart()
+    options = dict(
+        host="127.0.0.1" if tunnel else secrets["db_host"],
+        user=secrets["db_user"],
+        password=secrets["db_password"],
+        database=secrets["db_name"],
+        port=tunnel.local_bind_port if tunnel else int(secrets["db_port"]),
+        connect_timeout=30,
+        read_timeout=600,
+        write_timeout=600,
+        max_allowed_packet=128 * 1024 * 1024,
+    )
+    options.update(kwargs)
+    return pymysql.connect(**options)
+
+
+def get_sqlalchemy_engine(tunnel, secrets: dict, **kwargs):
+    options = dict(pool_pre_ping=True, pool_recycle=3600, pool_size=2, max_overflow=2)
+    options.update(kwargs)
+    return create_engine(
+        "mysql+pymysql://",
+        creator=lambda: get_connection(tunnel, secrets),
+        **options,
+    )
+
+
+@contextmanager
+def tunnel_session(secrets=None):
+    """
+    Yield (secrets, tunnel) and always stop the tunnel afterwards.
+    Without ssh_host in the secrets the database is used directly and tunnel is None.
+    """
+    secrets = secrets or load_secrets()
+    if not secrets.get("ssh_host"):
+        yield secrets, None
+        return
+    tunnel = start_ssh_tunnel(secrets)
+    try:
+        yield secrets, tunnel
+    finally:
+        tunnel.stop()
+
+
+# --------------------------------------------------------------------------------
+# Circuit breaker
+# --------------------------------------------------------------------------------
+# Client errors for a server that cannot be reached or went away mid-statement.
+# Anything else (lock wait timeouts, deadlocks, KILL QUERY, bad SQL) comes from a
+# healthy server and does not count against the breaker.
+CONNECTION_ERRORS = {2003, 2006, 2013}
+
+
+class DatabaseUnavailable(SQLAlchemyError):
+    """Raised without touching the network while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    closed: calls go through; `failure_threshold` failures in a row open it.
+    open: calls fail at once with DatabaseUnavailable until the backoff expires.
+    half-open: one probe call goes through; success closes, failure reopens with
+    a longer backoff. Backoff doubles from base_delay up to max_delay, jittered
+    so the workers do not all probe at the same moment.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold=3, base_delay=1.0, max_delay=15.0, probe_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.retry_at = 0.0
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now < self.retry_at:
+                    raise DatabaseUnavailable(f"database unavailable, retrying in {self.retry_at - now:.0f}s")
+                self.state = self.HALF_OPEN
+                self.probe_started = now
+            elif self.state == self.HALF_OPEN:
+                if now - self.probe_started < self.probe_timeout:
+                    raise DatabaseUnavailable("database unavailable, probe in progress")
+                self.probe_started = now
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trips = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.trips += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (self.trips - 1))
+                self.retry_at = time.monotonic() + random.uniform(delay / 2, delay)
+                self.state = self.OPEN
+
+    def call(self, fn, *args, **kwargs):
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+def guarded_engine(url, creator, breaker: CircuitBreaker, **kwargs):
+    """
+    Engine whose checkouts go through `breaker`: failed new connections and
+    statements that lost the server count against it, and while it is open
+    connect() raises DatabaseUnavailable before waiting on the pool or the network.
+    """
+
+    class BreakerPool(QueuePool):
+        def connect(self):
+            breaker.before_call()
+            return super().connect()
+
+    def guarded_creator():
+        try:
+            connection = creator()
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return connection
+
+    engine = create_engine(url, creator=guarded_creator, poolclass=BreakerPool, **kwargs)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        code = getattr(context.original_exception, "args", (None,))[:1]
+        if context.is_disconnect or (code and code[0] in CONNECTION_ERRORS):
+            breaker.record_failure()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _succeeded(*args):
+        breaker.record_success()
+
+    return engine
+
+
+# --------------------------------------------------------------------------------
+# Deadlines
+# --------------------------------------------------------------------------------
+# Seconds of DB time one page rerun (or one save callback) may use in total.
+PAGE_BUDGET = 10.0
+
+_deadline = contextvars.ContextVar("db_deadline", default=None)
+
+
+class DeadlineExceeded(SQLAlchemyError):
+    """The rerun's DB budget ran out; a running statement was cancelled on the server."""
+
+
+def start_deadline(seconds: float = PAGE_BUDGET):
+    """
+    Give the rest of this rerun `seconds` of DB time. Call at the top of a page
+    and at the top of on_click callbacks, which run before the page does.
+    """
+    _deadline.set(time.monotonic() + seconds)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """A tighter budget for one block; never extends the surrounding one."""
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+class _Watchdog:
+    """One thread firing callbacks at their due time, instead of a Timer per statement."""
+
+    def __init__(self):
+        self._heap = []
+        self._cancelled = set()
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="db-deadlines", daemon=True).start()
+
+    def arm(self, at: float, fn) -> int:
+        with self._cond:
+            token = next(self._ids)
+            heapq.heappush(self._heap, (at, token, fn))
+            self._cond.notify()
+            return token
+
+    def disarm(self, token: int):
+        with self._cond:
+            self._cancelled.add(token)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, token, fn = heapq.heappop(self._heap)
+                if token in self._cancelled:
+                    self._cancelled.discard(token)
+                    continue
+            try:
+                fn()
+            except Exception:
+                pass  # the statement finishes or fails on its own; nothing else to do
+
+
+_watchdog = None
+_statement_ids = itertools.count()
+
+# MySQL error for a statement stopped by KILL QUERY
+ER_QUERY_INTERRUPTED = 1317
+
+
+def install_deadlines(engine, side_connect):
+    """
+    Enforce the contextvar deadline on every statement of `engine`. An overrun
+    statement is cancelled with KILL QUERY from a separate connection made by
+    `side_connect`, so the pooled connection stays usable and goes back to the
+    pool, and the caller gets DeadlineExceeded.
+    """
+    global _watchdog
+    if _watchdog is None:
+        _watchdog = _Watchdog()
+
+    def kill(info, statement: int):
+        with info["deadline_lock"]:
+            if info.get("deadline_token") is None or info.get("statement") != statement:
+                return  # finished meanwhile
+            info["killed"] = statement
+            side = side_connect()
+            try:
+                with side.cursor() as cursor:
+                    cursor.execute(f"KILL QUERY {int(info['thread_id'])}")
+            finally:
+                side.close()
+
+    @event.listens_for(engine, "connect")
+    def _remember_thread_id(dbapi_connection, connection_record):
+        connection_record.info["thread_id"] = dbapi_connection.thread_id()
+        connection_record.info["deadline_lock"] = threading.Lock()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _arm(conn, cursor, statement, parameters, context, executemany):
+        info = conn.info
+        info.pop("killed", None)
+        info["statement"] = None
+        left = remaining()
+        if left is None:
+            return
+        if left <= 0:
+            raise DeadlineExceeded("DB time budget for this page used up")
+        statement_no = info["statement"] = next(_statement_ids)
+        info["deadline_token"] = _watchdog.arm(time.monotonic() + left, lambda: kill(info, statement_no))
+
+    def _disarm(info):
+        token = info.get("deadline_token")
+        if token is not None:
+            with info["deadline_lock"]:
+                info["deadline_token"] = None
+            _watchdog.disarm(token)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _done(conn, cursor, statement, parameters, context, executemany):
+        _disarm(conn.info)
+        conn.info.pop("killed", None)   # a KILL that came too late hit nothing
+
+    @event.listens_for(engine, "handle_error")
+    def _cancelled(context):
+        if context.connection is None:
+            return
+        info = context.connection.info
+        _disarm(info)
+        killed = info.pop("killed", None)
+        code = getattr(context.original_exception, "args", (None,))[:1]
+        # Only the statement the watchdog killed, failing because it was killed
+        if killed is not None and killed == info.get("statement") and code == (ER_QUERY_INTERRUPTED,):
+            raise DeadlineExceeded("query cancelled after exceeding the page's DB time budget") from (
+                context.original_exception
+            )
+
+
+# --------------------------------------------------------------------------------
+# Schema probes
+# --------------------------------------------------------------------------------
+# Workers can be running before the migration a write path needs (migrate.py).
+# A probe asks information_schema once; an answer of "missing" is asked again
+# after PROBE_SECONDS, so applying the migration takes effect without a restart.
+PROBE_SECONDS = 60.0
+
+_COUNT_TABLES = text(
+    "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = 'deepfakes' AND table_name IN :names"
+).bindparams(bindparam("names", expanding=True))
+_COUNT_COLUMNS = text(
+    """
+    SELECT COUNT(*) FROM information_schema.columns
+    WHERE table_schema = 'deepfakes' AND table_name = :table AND column_name IN :names
+    """
+).bindparams(bindparam("names", expanding=True))
+_COUNT_ROUTINES = text(
+    "SELECT COUNT(*) FROM information_schema.routines WHERE routine_schema = 'deepfakes' AND routine_name IN :names"
+).bindparams(bindparam("names", expanding=True))
+
+
+class SchemaProbe:
+    """
+    Whether all of `names` exist: tables, columns of `table`, or routines.
+    Call it with the connection that is about to use them. On a spooled
+    connection (fallback.py) nothing can be read, so only what an earlier probe
+    found counts as present.
+    """
+
+    def __init__(self, kind: str, names, table: str = None, needed_by: str = ""):
+        self._query = {"tables": _COUNT_TABLES, "columns": _COUNT_COLUMNS, "routines": _COUNT_ROUTINES}[kind]
+        self._params = {"names": list(names), **({"table": table} if table else {})}
+        self.description = f"{kind} {', '.join(names)}" + (f" of {table}" if table else "")
+        self.needed_by = needed_by
+        self.present = None
+        self.checked_at = 0.0
+
+    def __call__(self, db_conn) -> bool:
+        if self.present or (self.present is False and time.monotonic() - self.checked_at < PROBE_SECONDS):
+            return self.present
+        try:
+            found = db_conn.execute(self._query, self._params).scalar()
+        except DatabaseUnavailable:
+            return bool(self.present)
+        self.present, self.checked_at = found == len(self._params["names"]), time.monotonic()
+        if not self.present:
+            log.warning("%s missing, %s skipped until it exists (python migrate.py apply)",
+                        self.description, self.needed_by or "its write path")
+        return self.present
+
+
+_PRIMARY_KEY_SQL = """
+    SELECT column_name FROM information_schema.key_column_usage
+    WHERE table_schema = 'deepfakes' AND table_name = %(table)s AND constraint_name = 'PRIMARY'
+    ORDER BY ordinal_position
+"""
+_primary_keys = {}
+
+
+def primary_key(db_conn, table: str) -> str:
+    """
+    The single-column primary key of deepfakes.<table>, as the server has it.
+    The study tables were created by hand, so their key names are read rather
+    than assumed. db_conn is a SQLAlchemy connection or a raw pymysql one.
+    """
+    if table not in _primary_keys:
+        if isinstance(db_conn, pymysql.connections.Connection):
+            with db_conn.cursor() as cursor:
+                cursor.execute(_PRIMARY_KEY_SQL, {"table": table})
+                columns = [row[0] for row in cursor.fetchall()]
+        else:
+            columns = list(db_conn.execute(text(_PRIMARY_KEY_SQL.replace("%(table)s", ":table")),
+                                           {"table": table}).scalars())
+        if len(columns) != 1:
+            raise LookupError(f"deepfakes.{table} has no single-column primary key: {columns}")
+        _primary_keys[table] = columns[0]
+    return _primary_keys[table]
+
+
+# --------------------------------------------------------------------------------
+# Shared engine for the Streamlit pages
+# --------------------------------------------------------------------------------
+# One tunnel and one pool per server process. Every page used to open its own on
+# each rerun; with serve.py there is one of these per worker process.
+# Timeouts are short on purpose: the breaker, not a long wait, handles a sick DB.
+APP_CONNECT = dict(connect_timeout=10, read_timeout=60, write_timeout=60)
+APP_POOL = dict(pool_pre_ping=True, pool_recycle=3600, pool_size=10, max_overflow=20, pool_timeout=10)
+
+app_breaker = CircuitBreaker()
+_app_lock = threading.Lock()
+_app_engine = None
+_app_tunnel = None
+
+
+def get_app_engine(secrets=None):
+    """
+    Process-wide engine used by app.py and the pages. secrets is st.secrets (or
+    any mapping); without it the secrets.toml lookup of load_secrets() is used.
+    Raises DatabaseUnavailable while app_breaker is open.
+    """
+    global _app_engine, _app_tunnel
+    if _app_engine is not None:
+        return _app_engine
+    with _app_lock:
+        if _app_engine is None:
+            secrets = dict(secrets) if secrets is not None else load_secrets()
+            tunnel = app_breaker.call(start_ssh_tunnel, secrets) if secrets.get("ssh_host") else None
+            pool = dict(APP_POOL)
+            pool["pool_size"] = int(secrets.get("db_pool_size", pool["pool_size"]))
+            pool["max_overflow"] = int(secrets.get("db_max_overflow", pool["max_overflow"]))
+            _app_tunnel = tunnel
+            _app_engine = guarded_engine(
+                "mysql+pymysql://",
+                lambda: get_connection(tunnel, secrets, **APP_CONNECT),
+                app_breaker,
+                **pool,
+            )
+            event.listen(_app_engine, "connect", _stamp_connection)
+            install_deadlines(_app_engine, lambda: get_connection(tunnel, secrets, connect_timeout=5))
+    return _app_engine
+
+
+def _stamp_connection(dbapi_connection, connection_record):
+    # Read by worker.py's keep-warm to reconnect before pool_recycle would.
+    connection_record.info["connected_at"] = time.time()
+
+
+def dispose_app_engine():
+    """Close the pooled connections and the tunnel (worker shutdown)."""
+    global _app_engine, _app_tunnel
+    with _app_lock:
+        if _app_engine is not None:
+            _app_engine.dispose()
+        if _app_tunnel is not None:
+            _app_tunnel.stop()
+        _app_engine = _app_tunnel = None
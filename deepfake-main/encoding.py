@@ -0,0 +1,385 @@
+"""
+Compact storage for the multi-select answers.
+
+Historically the answers are stored as text: mip_topics / mip_topics_before as
+", ".join(...) strings and nationality / race / native_tongue /
+listening_habits as json.dumps lists. Every analysis had to parse them again.
+
+Each multi-select now also gets a fixed code table (the option lists below,
+which the pages render from) and one integer column:
+
+- mask:  bit i set <=> option i selected (fields with at most 16 options)
+- codes: up to 4 selected options packed as 16-bit slots, code = index + 1,
+         0 = empty slot (country / language lists, max_selections=3)
+
+Membership lookups that need an index go through multiselect_members
+(field_id, code, row_id), one row per selected option; the decoded views
+turn the integers back into readable labels via multiselect_codes.
+
+Codes are list positions: only ever APPEND to these lists, never reorder or
+delete, or previously stored rows decode to the wrong labels.
+
+    python encoding.py schema      # print DDL (tables, columns, views)
+    python encoding.py backfill    # encode rows stored before this change
+"""
+import csv
+import json
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+import db
+
+# --------------------------------------------------------------------------------
+# Code tables
+# --------------------------------------------------------------------------------
+TOPICS = [
+    "Immigration",
+    "National Security",
+    "Economy",
+    "Racism",
+    "Climate",
+    "Education",
+    "Gender",
+    "Government / Poor leadership",
+    "Elections / Democracy",
+    "Crime & Public safety",
+    "Healthcare",
+    "Poverty / Homelessness",
+    "Unifying the country",
+    "Other",
+]
+
+RACES = [
+    "American Indian or Alaska Native",
+    "Asian",
+    "Black or African American",
+    "Hispanic or Latino",
+    "Middle Eastern or North African",
+    "Native Hawaiian or Pacific Islander",
+    "White",
+]
+
+MOTHER_TONGUES = [
+    "English", "Spanish", "Chinese (Mandarin)", "Hindi", "Arabic", "French",
+    "Bengali", "Russian", "Portuguese", "Indonesian", "Japanese", "German",
+    "Korean", "Turkish", "Vietnamese", "Italian", "Tamil", "Urdu", "Persian (Farsi)",
+    "Punjabi", "Javanese", "Telugu", "Marathi", "Thai", "Dutch", "Swedish",
+    "Greek", "Polish", "Czech", "Hungarian", "Romanian", "Ukrainian", "Hebrew",
+    "Malay", "Burmese", "Hausa", "Igbo", "Yoruba", "Swahili", "Tagalog (Filipino)",
+    "Nepali", "Sinhala", "Amharic", "Zulu", "Somali", "Pashto", "Kazakh", "Uzbek",
+    "Khmer", "Lao", "Finnish", "Danish", "Norwegian", "Slovak", "Croatian",
+    "Bulgarian", "Serbian", "Lithuanian", "Latvian", "Estonian", "Georgian",
+    "Armenian", "Mongolian", "Bosnian", "Azerbaijani", "Macedonian", "Albanian",
+    "Malayalam", "Kannada", "Gujarati", "Oriya (Odia)", "Other",
+]
+
+LISTENING_HABITS = [
+    "Symphonies",
+    "Audiobooks",
+    "Podcasts",
+    "Music",
+    "Nature Sounds",
+    "White Noise",
+    "Other",
+]
+
+COUNTRY_CSV = Path(__file__).resolve().parent / "UNSD_Methodology_ancestry.csv"
+
+
+def _load_countries():
+    with open(COUNTRY_CSV, encoding="utf-8-sig", newline="") as f:
+        return sorted(row["Country or Area"] for row in csv.DictReader(f, delimiter=";"))
+
+
+# Sorted like the Demographics page always showed them. The bundled CSV is frozen.
+COUNTRIES = _load_countries()
+
+
+@dataclass(frozen=True)
+class Field:
+    field_id: int
+    name: str
+    labels: list
+    kind: str  # "mask" or "codes"
+    table: str
+    column: str
+    legacy_format: str  # "comma" or "json"
+
+    @property
+    def index(self):
+        return {label: i for i, label in enumerate(self.labels)}
+
+
+FIELDS = {
+    f.name: f for f in [
+        Field(1, "mip_topics", TOPICS, "mask", "english_ratings_phase2", "mip_topics_mask", "comma"),
+        Field(2, "mip_topics_before", TOPICS, "mask", "english_ratings_phase2", "mip_topics_before_mask", "comma"),
+        Field(3, "race", RACES, "mask", "participants_phase3", "race_mask", "json"),
+        Field(4, "listening_habits", LISTENING_HABITS, "mask", "participants_phase3", "listening_habits_mask", "json"),
+        Field(5, "nationality", COUNTRIES, "codes", "participants_phase3", "nationality_codes", "json"),
+        Field(6, "native_tongue", MOTHER_TONGUES, "codes", "participants_phase3", "native_tongue_codes", "json"),
+    ]
+}
+
+CODE_BITS = 16
+CODE_SLOTS = 4
+_SLOT = (1 << CODE_BITS) - 1
+
+
+# --------------------------------------------------------------------------------
+# Encode / decode
+# --------------------------------------------------------------------------------
+def encode(field: str, selected) -> int | None:
+    """List of option labels -> integer column value (None for no answer)."""
+    if not selected:
+        return None
+    f = FIELDS[field]
+    index = f.index
+    unknown = [s for s in selected if s not in index]
+    if unknown:
+        raise ValueError(f"{field}: not in the code table: {unknown}")
+    if f.kind == "mask":
+        value = 0
+        for label in selected:
+            value |= 1 << index[label]
+        return value
+    if len(selected) > CODE_SLOTS:
+        raise ValueError(f"{field}: at most {CODE_SLOTS} selections can be packed")
+    value = 0
+    for slot, label in enumerate(selected):
+        value |= (index[label] + 1) << (slot * CODE_BITS)
+    return value
+
+
+def codes(field: str, value) -> list[int]:
+    """Integer column value -> selected option indices (in code-table order for masks)."""
+    if value is None:
+        return []
+    value = int(value)
+    if FIELDS[field].kind == "mask":
+        return [i for i in range(len(FIELDS[field].labels)) if value >> i & 1]
+    slots = [(value >> (s * CODE_BITS)) & _SLOT for s in range(CODE_SLOTS)]
+    return [c - 1 for c in slots if c]
+
+
+def decode(field: str, value) -> list[str]:
+    labels = FIELDS[field].labels
+    return [labels[i] for i in codes(field, value)]
+
+
+def parse_legacy(field: str, raw) -> list[str]:
+    """The text format the pages wrote before encoded columns existed."""
+    if raw is None or raw == "":
+        return []
+    if FIELDS[field].legacy_format == "json":
+        return json.loads(raw)
+    return raw.split(", ")
+
+
+def members(field: str, selected) -> list[dict]:
+    """Rows for multiselect_members (without row_id)."""
+    f = FIELDS[field]
+    return [{"field_id": f.field_id, "code": f.index[label]} for label in selected or []]
+
+
+# --------------------------------------------------------------------------------
+# Vectorised helpers for analysis (NumPy arrays of encoded values, 0 = no answer)
+# --------------------------------------------------------------------------------
+def contains(field: str, values: np.ndarray, label: str) -> np.ndarray:
+    """Boolean array: which rows selected `label`."""
+    f = FIELDS[field]
+    i = f.index[label]
+    values = np.asarray(values, dtype=np.uint64)
+    if f.kind == "mask":
+        return (values >> np.uint64(i)) & np.uint64(1) == 1
+    hit = np.zeros(values.shape, dtype=bool)
+    for s in range(CODE_SLOTS):
+        hit |= (values >> np.uint64(s * CODE_BITS)) & np.uint64(_SLOT) == i + 1
+    return hit
+
+
+def option_counts(field: str, values: np.ndarray) -> dict:
+    """How often each option was selected, without decoding a single row."""
+    return {label: int(contains(field, values, label).sum()) for label in FIELDS[field].labels}
+
+
+# --------------------------------------------------------------------------------
+# Schema
+# --------------------------------------------------------------------------------
+_COLUMN_TYPES = {"mask": "INT UNSIGNED NULL", "codes": "BIGINT UNSIGNED NULL"}
+
+CREATE_CODES = """
+CREATE TABLE IF NOT EXISTS deepfakes.multiselect_codes (
+    field_id TINYINT UNSIGNED NOT NULL,
+    field VARCHAR(32) NOT NULL,
+    code SMALLINT UNSIGNED NOT NULL,
+    label VARCHAR(128) NOT NULL,
+    PRIMARY KEY (field_id, code)
+)
+"""
+
+# row_id is the primary key of the row the field belongs to (participant or rating).
+CREATE_MEMBERS = """
+CREATE TABLE IF NOT EXISTS deepfakes.multiselect_members (
+    field_id TINYINT UNSIGNED NOT NULL,
+    code SMALLINT UNSIGNED NOT NULL,
+    row_id BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (field_id, code, row_id),
+    KEY ix_row (row_id, field_id)
+)
+"""
+
+
+def add_column_statements() -> list[str]:
+    return [
+        f"ALTER TABLE deepfakes.{f.table} ADD COLUMN {f.column} {_COLUMN_TYPES[f.kind]}"
+        for f in FIELDS.values()
+    ]
+
+
+def _decoded_expression(f: Field, alias: str) -> str:
+    if f.kind == "mask":
+        match = f"{alias}.{f.column} & (1 << c.code)"
+    else:
+        # A slot holds code + 1, 0 when empty; subtracting from it would underflow the UNSIGNED value
+        slots = ", ".join(
+            f"({alias}.{f.column} >> {s * CODE_BITS}) & {_SLOT}" for s in range(CODE_SLOTS)
+        )
+        match = f"c.code + 1 IN ({slots})"
+    return (
+        f"(SELECT GROUP_CONCAT(c.label ORDER BY c.code SEPARATOR ', ') "
+        f"FROM deepfakes.multiselect_codes c WHERE c.field_id = {f.field_id} AND {match}) AS {f.name}_decoded"
+    )
+
+
+def view_statements() -> list[str]:
+    statements = []
+    tables = sorted({f.table for f in FIELDS.values()})
+    for table in tables:
+        decoded = ",\n    ".join(_decoded_expression(f, "t") for f in FIELDS.values() if f.table == table)
+        statements.append(
+            f"CREATE OR REPLACE VIEW deepfakes.{table}_decoded AS\n"
+            f"SELECT t.*,\n    {decoded}\nFROM deepfakes.{table} t"
+        )
+    return statements
+
+
+def sync_code_tables(db_conn):
+    """Write the code tables; an existing code with a different label is a hard error."""
+    existing = {
+        (r.field_id, r.code): r.label
+        for r in db_conn.execute(text("SELECT field_id, code, label FROM deepfakes.multiselect_codes"))
+    }
+    rows = []
+    for f in FIELDS.values():
+        for code, label in enumerate(f.labels):
+            stored = existing.get((f.field_id, code))
+            if stored is not None and stored != label:
+                raise ValueError(f"{f.name} code {code} is '{stored}' in the DB but '{label}' here")
+            if stored is None:
+                rows.append({"field_id": f.field_id, "field": f.name, "code": code, "label": label})
+    if rows:
+        db_conn.execute(text(
+            "INSERT INTO deepfakes.multiselect_codes (field_id, field, code, label) "
+            "VALUES (:field_id, :field, :code, :label)"
+        ), rows)
+
+
+# --------------------------------------------------------------------------------
+# Write path
+# --------------------------------------------------------------------------------
+_INSERT_MEMBERS = text(
+    "INSERT IGNORE INTO deepfakes.multiselect_members (field_id, code, row_id) VALUES (:field_id, :code, :row_id)"
+)
+_DELETE_MEMBERS = text(
+    "DELETE FROM deepfakes.multiselect_members WHERE row_id = :row_id AND field_id IN :field_ids"
+).bindparams(bindparam("field_ids", expanding=True))
+
+
+# Migration 2 adds the encoded columns and multiselect_members. Until the pages
+# see them (db.SchemaProbe), they write the text columns only; run backfill
+# once PROBE_SECONDS after the migration to encode those rows.
+_ENCODED_COLUMNS = {
+    table: db.SchemaProbe("columns", [f.column for f in FIELDS.values() if f.table == table], table=table,
+                          needed_by=f"encoded multi-selects of {table} (migration 2)")
+    for table in sorted({f.table for f in FIELDS.values()})
+}
+_MEMBERS_TABLE = db.SchemaProbe("tables", ["multiselect_members"],
+                                needed_by="multi-select membership rows (migration 2)")
+
+
+def encoded(db_conn, table: str) -> bool:
+    """Whether the encoded columns of `table` and multiselect_members exist yet."""
+    return _ENCODED_COLUMNS[table](db_conn) and _MEMBERS_TABLE(db_conn)
+
+
+def replace_members(db_conn, row_id: int, answers: dict):
+    """Replace the membership rows of one participant/rating: answers = {field: [labels]}."""
+    field_ids = [FIELDS[name].field_id for name in answers]
+    db_conn.execute(_DELETE_MEMBERS, {"row_id": row_id, "field_ids": field_ids})
+    rows = [dict(m, row_id=row_id) for name, selected in answers.items() for m in members(name, selected)]
+    if rows:
+        db_conn.execute(_INSERT_MEMBERS, rows)
+
+
+# --------------------------------------------------------------------------------
+# Backfill of rows written as text only
+# --------------------------------------------------------------------------------
+_ENCODED_TABLES = ["participants_phase3", "english_ratings_phase2"]
+
+
+def backfill(engine, batch_size=1000):
+    """Encode rows written before the encoded columns existed, one short transaction per batch."""
+    for table in _ENCODED_TABLES:
+        with engine.connect() as db_conn:
+            key = db.primary_key(db_conn, table)
+        fields = [f for f in FIELDS.values() if f.table == table]
+        legacy = ", ".join(f.name for f in fields)
+        last = 0
+        while True:
+            with engine.begin() as db_conn:
+                rows = db_conn.execute(text(
+                    f"SELECT {key}, {legacy} FROM deepfakes.{table} "
+                    f"WHERE {key} > :last ORDER BY {key} LIMIT {int(batch_size)}"
+                ), {"last": last}).mappings().all()
+                for row in rows:
+                    # Options that were renamed or dropped before the code tables existed are skipped.
+                    answers = {
+                        f.name: [label for label in parse_legacy(f.name, row[f.name]) if label in f.index]
+                        for f in fields
+                    }
+                    values = {f.column: encode(f.name, answers[f.name]) for f in fields}
+                    assignments = ", ".join(f"{c} = :{c}" for c in values)
+                    db_conn.execute(
+                        text(f"UPDATE deepfakes.{table} SET {assignments} WHERE {key} = :row_id"),
+                        dict(values, row_id=row[key]),
+                    )
+                    replace_members(db_conn, row[key], answers)
+            if not rows:
+                break
+            last = rows[-1][key]
+            print(f"{table}: encoded up to {key}={last}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "schema"
+    if command == "schema":
+        for statement in [CREATE_CODES, CREATE_MEMBERS, *add_column_statements(), *view_statements()]:
+            print(statement.strip() + ";\n")
+    elif command == "backfill":
+        with db.tunnel_session() as (secrets, tunnel):
+            engine = db.get_sqlalchemy_engine(tunnel, secrets)
+            with engine.begin() as db_conn:
+                sync_code_tables(db_conn)
+            backfill(engine)
+    else:
+        sys.exit(f"unknown command {command!r} (schema | backfill)")
+
+
+if __name__ == "__main__":
+    main()
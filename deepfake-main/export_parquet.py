@@ -0,0 +1,220 @@
+"""
+Stream study tables out of MySQL into Parquet.
+
+    python export_parquet.py                      # all tables, incremental
+    python export_parquet.py english_ratings_phase3 --full
+    python export_parquet.py --out /data/exports --chunk-rows 20000
+
+Rows are read with an unbuffered server-side cursor (pymysql SSCursor) and
+written one Parquet row group per chunk, so memory stays at roughly one chunk
+whatever the table size. Each run writes a new part file per table holding only
+rows not exported yet; the high-water marks live in <out>/_state.json and are
+only advanced after a part file is complete. Keys are taken at INSERT but rows
+show up at COMMIT, so a lower key can appear after a higher one was exported:
+each run re-reads ID_OVERLAP keys below the mark and skips those already in a
+part file.
+--full re-exports a table from the start and then drops its older part files.
+Tables whose rows change after insert (ALWAYS_FULL) are exported that way on
+every run.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pymysql
+from pymysql.constants import FIELD_TYPE
+
+import db
+
+# Tables exported by default. Each is ordered, and exported incrementally, by its
+# monotonic (auto-increment) primary key, read from the server (db.primary_key).
+TABLES = ["english_ratings_phase2", "english_ratings_phase3", "participants_phase3", "prolific_ids_p3"]
+# Rows inserted as placeholders and UPDATEd later (Demographics): a part file
+# would freeze them as they were, so these are re-exported in full each run.
+ALWAYS_FULL = {"participants_phase3"}
+
+DEFAULT_OUT = db.APP_DIR / "exports"
+DEFAULT_CHUNK_ROWS = 50_000
+STATE_FILE = "_state.json"
+# Keys below the high-water mark that are read again, for rows that committed late
+ID_OVERLAP = 500
+
+_INT_TYPES = {FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.INT24,
+              FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR}
+_FLOAT_TYPES = {FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE, FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL}
+_TIME_TYPES = {FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP}
+
+
+def arrow_schema(description) -> pa.Schema:
+    """Fix the Arrow schema from the cursor metadata, so an all-NULL chunk cannot change it."""
+    fields = []
+    for name, type_code, *_ in description:
+        if type_code in _INT_TYPES:
+            arrow_type = pa.int64()
+        elif type_code in _FLOAT_TYPES:
+            arrow_type = pa.float64()
+        elif type_code in _TIME_TYPES:
+            arrow_type = pa.timestamp("us")
+        elif type_code == FIELD_TYPE.DATE:
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def _column(values, arrow_type):
+    if pa.types.is_floating(arrow_type):
+        values = [None if v is None else float(v) for v in values]
+    elif pa.types.is_string(arrow_type):
+        values = [None if v is None else (v.decode() if isinstance(v, bytes) else str(v)) for v in values]
+    return pa.array(values, type=arrow_type)
+
+
+# --------------------------------------------------------------------------------
+# State
+# --------------------------------------------------------------------------------
+def load_state(out_dir: Path) -> dict:
+    path = out_dir / STATE_FILE
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save_state(out_dir: Path, state: dict):
+    tmp = out_dir / (STATE_FILE + ".tmp")
+    tmp.write_text(json.dumps(state, indent=2, sort_keys=True))
+    os.replace(tmp, out_dir / STATE_FILE)
+
+
+# --------------------------------------------------------------------------------
+# Export
+# --------------------------------------------------------------------------------
+def exported_keys(table_dir: Path, key: str, after) -> set:
+    """Keys above `after` that some part file of the table already holds."""
+    keys = set()
+    for part in table_dir.glob("part-*.parquet"):
+        last = int(part.stem.rsplit("-", 1)[1])
+        if last > after:
+            keys.update(k for k in pq.read_table(part, columns=[key]).column(key).to_pylist() if k > after)
+    return keys
+
+
+def export_table(conn, table: str, key: str, out_dir: Path, after=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                 skip=frozenset()):
+    """
+    Stream `table` rows with key > after, except the keys in skip, into one new
+    part file. Returns (rows written, last key, part file) - the last two are
+    None when nothing was new.
+    """
+    table_dir = out_dir / table
+    table_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = table_dir / f".part-{int(time.time())}.parquet.tmp"
+
+    sql = f"SELECT * FROM `{table}`"
+    args = ()
+    if after is not None:
+        sql += f" WHERE `{key}` > %s"
+        args = (after,)
+    sql += f" ORDER BY `{key}`"
+
+    rows_written, first_key, last_key = 0, None, None
+    writer = None
+    try:
+        with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+            cursor.execute(sql, args)
+            schema = arrow_schema(cursor.description)
+            key_index = schema.names.index(key)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    rows = [row for row in rows if row[key_index] not in skip]
+                    if not rows:
+                        continue
+                    columns = list(zip(*rows))
+                    batch = pa.Table.from_arrays(
+                        [_column(values, field.type) for values, field in zip(columns, schema)],
+                        schema=schema,
+                    )
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+                        first_key = rows[0][key_index]
+                    writer.write_table(batch, row_group_size=chunk_rows)
+                    rows_written += len(rows)
+                    last_key = rows[-1][key_index]
+            finally:
+                if writer is not None:
+                    writer.close()
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    if not rows_written:
+        return 0, None, None
+    part = table_dir / f"part-{first_key:012d}-{last_key:012d}.parquet"
+    os.replace(tmp_path, part)
+    return rows_written, last_key, part
+
+
+def _drop_older_parts(table_dir: Path, keep):
+    """After a successful full export, the new part (None: no rows) supersedes all earlier ones."""
+    for part in table_dir.glob("part-*.parquet"):
+        if part != keep:
+            part.unlink()
+
+
+def run(tables, out_dir: Path, full=False, chunk_rows=DEFAULT_CHUNK_ROWS, keys=None):
+    keys = dict(keys or {})
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state = load_state(out_dir)
+
+    with db.tunnel_session() as (secrets, tunnel):
+        for table in tables:
+            # One connection per table: an unbuffered cursor owns its connection until drained.
+            conn = db.get_connection(tunnel, secrets, read_timeout=3600)
+            try:
+                with conn.cursor() as cursor:
+                    # The server gives up on slow readers after net_write_timeout seconds.
+                    cursor.execute("SET SESSION net_write_timeout = 3600")
+                keys.setdefault(table, db.primary_key(conn, table))
+                started = time.perf_counter()
+                whole = full or table in ALWAYS_FULL
+                high = None if whole else state.get(table)
+                after, skip = None, frozenset()
+                if high is not None:
+                    after = high - ID_OVERLAP
+                    skip = exported_keys(out_dir / table, keys[table], after)
+                rows, last_key, part = export_table(conn, table, keys[table], out_dir, after, chunk_rows, skip)
+            finally:
+                conn.close()
+            if whole:
+                _drop_older_parts(out_dir / table, keep=part)
+            if last_key is not None:
+                # Rows that committed late sit below the mark; it never moves back
+                state[table] = last_key if high is None else max(high, last_key)
+                save_state(out_dir, state)
+            print(f"{table}: {rows} rows after {keys[table]}={after} "
+                  f"in {time.perf_counter() - started:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tables", nargs="*", default=TABLES, help="tables to export (default: all)")
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT, help="export directory")
+    parser.add_argument("--full", action="store_true", help="ignore _state.json and export everything")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="rows per Parquet row group")
+    parser.add_argument("--key", action="append", default=[], metavar="TABLE=COLUMN",
+                        help="order by COLUMN instead of the primary key of TABLE")
+    args = parser.parse_args(argv)
+
+    keys = dict(item.split("=", 1) for item in args.key)
+    run(args.tables, args.out, full=args.full, chunk_rows=args.chunk_rows, keys=keys)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Local spool for writes made while the database is unavailable.
+
+    with fallback.begin(pool) as db_conn:
+        db_conn.execute(insert_query, params)
+        summary.record_rating(db_conn, ...)
+
+begin() behaves like pool.begin(). When the circuit breaker in db.py is open,
+or no connection can be made, it yields a recording connection instead. The
+statements of the block are then appended as one JSON line, one transaction
+each, to spool/<host>-<pid>.jsonl next to the app. A participant's answers are
+kept and their page carries on.
+
+Only writes can be spooled. A SELECT on the recording connection raises
+DatabaseUnavailable. `result.lastrowid` is a placeholder that replay()
+replaces with the real id from the same transaction.
+
+Replay runs from the worker keep-warm thread once the database answers again,
+or by hand:
+
+    python fallback.py status
+    python fallback.py replay
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import OperationalError
+
+import db
+
+SPOOL_DIR = db.APP_DIR / "spool"
+_REPLAYING = ".replaying"
+
+log = logging.getLogger("fallback")
+
+
+# --------------------------------------------------------------------------------
+# Recording
+# --------------------------------------------------------------------------------
+class _SpooledResult:
+    def __init__(self, index: int):
+        self.lastrowid = {"$lastrowid": index}
+        self.rowcount = 0
+
+
+class SpoolConnection:
+    """Stands in for a Connection inside begin() and records what would have run."""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, clause, params=None):
+        sql = str(getattr(clause, "text", clause))
+        if sql.lstrip().upper().startswith("SELECT"):
+            raise db.DatabaseUnavailable("database unavailable, cannot read while spooling")
+        expanding = [name for name, bp in getattr(clause, "_bindparams", {}).items() if bp.expanding]
+        self.statements.append({"sql": sql, "expanding": expanding, "params": params or {}})
+        return _SpooledResult(len(self.statements) - 1)
+
+
+def spool_path() -> Path:
+    return SPOOL_DIR / f"{socket.gethostname()}-{os.getpid()}.jsonl"
+
+
+def _append(record: dict):
+    SPOOL_DIR.mkdir(exist_ok=True)
+    line = json.dumps(record, default=str) + "\n"
+    while True:
+        path = spool_path()
+        with open(path, "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # replay() renames the file it takes; write to a fresh one if that happened meanwhile.
+            if not path.exists() or path.stat().st_ino != os.fstat(f.fileno()).st_ino:
+                continue
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            return
+
+
+@contextmanager
+def begin(engine):
+    """engine.begin(), or a spooled transaction while the database is unavailable (or engine is None)."""
+    try:
+        transaction = engine.begin() if engine is not None else None
+    except (db.DatabaseUnavailable, OperationalError):
+        transaction = None
+    if transaction is None:
+        recorder = SpoolConnection()
+        yield recorder
+        if recorder.statements:
+            _append({"spooled_at": time.time(), "statements": recorder.statements})
+            log.warning("database unavailable, spooled %d statements", len(recorder.statements))
+        return
+    with transaction as db_conn:
+        yield db_conn
+
+
+# --------------------------------------------------------------------------------
+# Replay
+# --------------------------------------------------------------------------------
+def _resolve(value, ids):
+    if isinstance(value, dict):
+        if set(value) == {"$lastrowid"}:
+            return ids[value["$lastrowid"]]
+        return {k: _resolve(v, ids) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v, ids) for v in value]
+    return value
+
+
+def _replay_transaction(db_conn, statements):
+    ids = []
+    for statement in statements:
+        clause = text(statement["sql"])
+        if statement["expanding"]:
+            clause = clause.bindparams(*(bindparam(name, expanding=True) for name in statement["expanding"]))
+        result = db_conn.execute(clause, _resolve(statement["params"], ids))
+        ids.append(result.lastrowid)
+
+
+def pending() -> list:
+    return sorted(SPOOL_DIR.glob("*.jsonl*")) if SPOOL_DIR.is_dir() else []
+
+
+def replay(engine) -> int:
+    """
+    Apply every spooled transaction in order. Each file is renamed before it is
+    read, so concurrent writers start a new one and two replayers never share a
+    file. The position is kept in a sidecar, so a crash does not apply twice.
+    """
+    applied = 0
+    for path in pending():
+        if path.name.endswith(".offset"):
+            continue
+        if _REPLAYING not in path.name:
+            taken = path.with_name(f"{path.name}{_REPLAYING}-{os.getpid()}")
+            try:
+                path.rename(taken)
+            except FileNotFoundError:
+                continue
+            path = taken
+        offset_path = path.with_name(path.name + ".offset")
+        with open(path, "r+", encoding="utf-8") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            done = int(offset_path.read_text()) if offset_path.exists() else 0
+            for number, line in enumerate(f):
+                if number < done or not line.strip():
+                    continue
+                with engine.begin() as db_conn:
+                    _replay_transaction(db_conn, json.loads(line)["statements"])
+                offset_path.write_text(str(number + 1))
+                applied += 1
+        path.unlink()
+        offset_path.unlink(missing_ok=True)
+    if applied:
+        log.info("replayed %d spooled transactions", applied)
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["status", "replay"])
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    if args.command == "status":
+        for path in pending():
+            if not path.name.endswith(".offset"):
+                with open(path, encoding="utf-8") as f:
+                    print(f"{path.name}: {sum(1 for line in f if line.strip())} transactions")
+    else:
+        with db.tunnel_session(db.load_secrets(args.secrets)) as (secrets, tunnel):
+            print(f"replayed {replay(db.get_sqlalchemy_engine(tunnel, secrets))} transactions")
@@ -0,0 +1,232 @@
+"""
+Load a manifest of clips into deepfakes.audio_clips in one go.
+
+    python import_clips.py clips.csv                       # audio set 4 (catalog.AUDIO_SET_NO)
+    python import_clips.py clips.parquet --audio-set 5 --dry-run --rejects rejects.csv
+    python import_clips.py clips.csv --load-data           # LOAD DATA LOCAL INFILE
+    python import_clips.py clips.csv --skip-url-check --concurrency 64
+
+The manifest (CSV or Parquet) needs `url` and `topic`. It may also have
+`audio_clip_id`; clips without one are numbered after the current maximum.
+Every row is checked before anything is written:
+
+    metadata  http(s) URL, non-empty topic, no URL twice in the manifest,
+              audio_clip_id unique and below shared_state.MAX_CLIP_ID
+    URL       HEAD (or a one-byte ranged GET where HEAD is refused) answers
+              2xx with an audio/* or octet-stream content type, --concurrency
+              at a time
+
+Rows whose URL is already in the audio set are skipped, so a manifest can be
+re-run after fixing its rejects. Rows are written in one transaction, either
+as multi-row INSERTs of --batch rows or with LOAD DATA LOCAL INFILE (needs
+local_infile on the server). The script then bumps the catalog version in
+shared_state.py. Workers on this host reload their clip list on their next
+read (catalog.py). On other hosts run `python shared_state.py bump-catalog`.
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+
+import catalog
+import db
+import shared_state
+
+DEFAULT_BATCH = 1000
+DEFAULT_CONCURRENCY = 32
+URL_TIMEOUT = 10
+AUDIO_TYPES = ("audio/", "application/octet-stream", "binary/octet-stream")
+
+_INSERT = (
+    "INSERT INTO deepfakes.audio_clips (audio_clip_id, url, topic, group_no, rated) "
+    "VALUES (%s, %s, %s, %s, 0)"
+)
+_LOAD_DATA = (
+    "LOAD DATA LOCAL INFILE %s INTO TABLE deepfakes.audio_clips "
+    "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+    "(audio_clip_id, url, topic, group_no) SET rated = 0"
+)
+
+
+def read_manifest(path: Path) -> pd.DataFrame:
+    if path.suffix.lower() in (".parquet", ".pq"):
+        frame = pd.read_parquet(path)
+    else:
+        frame = pd.read_csv(path, dtype={"url": str, "topic": str})
+    frame.columns = [c.strip().lower() for c in frame.columns]
+    missing = {"url", "topic"} - set(frame.columns)
+    if missing:
+        raise SystemExit(f"{path}: manifest needs column(s) {', '.join(sorted(missing))}")
+    if "audio_clip_id" not in frame.columns:
+        frame["audio_clip_id"] = None
+    frame = frame[["audio_clip_id", "url", "topic"]].copy()
+    frame["url"] = frame["url"].fillna("").str.strip()
+    frame["topic"] = frame["topic"].fillna("").str.strip()
+    return frame
+
+
+# --------------------------------------------------------------------------------
+# Validation
+# --------------------------------------------------------------------------------
+def check_metadata(frame: pd.DataFrame) -> pd.Series:
+    """Reason per row, "" for rows that are fine."""
+    reasons = pd.Series("", index=frame.index)
+
+    def flag(mask, reason):
+        reasons[mask & (reasons == "")] = reason
+
+    schemes = frame["url"].map(lambda url: urlparse(url).scheme)
+    flag(~schemes.isin(["http", "https"]), "not an http(s) URL")
+    flag(frame["topic"] == "", "empty topic")
+    flag(frame["url"].duplicated(keep="first"), "URL repeated in the manifest")
+    ids = pd.to_numeric(frame["audio_clip_id"], errors="coerce")
+    given = frame["audio_clip_id"].notna()
+    flag(given & (ids.isna() | (ids % 1 != 0)), "audio_clip_id is not an integer")
+    flag(given & ((ids <= 0) | (ids >= shared_state.MAX_CLIP_ID)),
+         f"audio_clip_id outside 1..{shared_state.MAX_CLIP_ID - 1}")
+    flag(given & ids.duplicated(keep="first"), "audio_clip_id repeated in the manifest")
+    return reasons
+
+
+def check_url(session: requests.Session, url: str) -> str:
+    try:
+        response = session.head(url, timeout=URL_TIMEOUT, allow_redirects=True)
+        if response.status_code in (403, 405, 501):
+            # Some object stores refuse HEAD; ask for one byte instead
+            response = session.get(url, timeout=URL_TIMEOUT, headers={"Range": "bytes=0-0"}, stream=True)
+            response.close()
+    except requests.RequestException as e:
+        return f"unreachable: {type(e).__name__}"
+    if not 200 <= response.status_code < 300:
+        return f"HTTP {response.status_code}"
+    content_type = response.headers.get("Content-Type", "").lower()
+    if content_type and not content_type.startswith(AUDIO_TYPES):
+        return f"not audio ({content_type.split(';')[0]})"
+    return ""
+
+
+def check_urls(urls, concurrency: int = DEFAULT_CONCURRENCY) -> list:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(lambda url: check_url(session, url), urls))
+
+
+# --------------------------------------------------------------------------------
+# Loading
+# --------------------------------------------------------------------------------
+def existing(conn, audio_set_no: int):
+    """URLs already in the audio set, every used audio_clip_id, and the highest one."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT audio_clip_id, url, group_no FROM deepfakes.audio_clips FOR UPDATE")
+        rows = cursor.fetchall()
+    urls = {url for _, url, group_no in rows if group_no == audio_set_no}
+    ids = {audio_clip_id for audio_clip_id, _, _ in rows}
+    return urls, ids, max(ids, default=0)
+
+
+def insert_rows(conn, rows: list, batch: int):
+    # pymysql turns executemany on INSERT ... VALUES into multi-row statements
+    with conn.cursor() as cursor:
+        for start in range(0, len(rows), batch):
+            cursor.executemany(_INSERT, rows[start:start + batch])
+
+
+def load_data(conn, rows: list):
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False, encoding="utf-8", newline="") as f:
+        for row in rows:
+            f.write("\t".join(str(value).replace("\\", "\\\\").replace("\t", " ").replace("\n", " ")
+                              for value in row) + "\n")
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(_LOAD_DATA, (f.name,))
+    finally:
+        os.unlink(f.name)
+
+
+def run(path: Path, audio_set_no: int, batch=DEFAULT_BATCH, concurrency=DEFAULT_CONCURRENCY,
+        check_remote=True, use_load_data=False, dry_run=False, rejects_path=None, secrets=None) -> int:
+    started = time.perf_counter()
+    frame = read_manifest(path)
+    frame["reason"] = check_metadata(frame)
+    if check_remote:
+        ok = frame["reason"] == ""
+        frame.loc[ok, "reason"] = check_urls(frame.loc[ok, "url"].tolist(), concurrency)
+    print(f"{len(frame)} rows checked in {time.perf_counter() - started:.1f}s")
+
+    with db.tunnel_session(db.load_secrets(secrets)) as (secrets, tunnel):
+        conn = db.get_connection(tunnel, secrets, autocommit=False, local_infile=use_load_data)
+        try:
+            known_urls, known_ids, next_id = existing(conn, audio_set_no)
+            frame.loc[(frame["reason"] == "") & frame["url"].isin(known_urls), "reason"] = "already imported"
+            ids = pd.to_numeric(frame["audio_clip_id"], errors="coerce")
+            frame.loc[(frame["reason"] == "") & ids.isin(known_ids), "reason"] = "audio_clip_id already used"
+
+            good = frame[frame["reason"] == ""].copy()
+            numbered = good["audio_clip_id"].notna()
+            if numbered.any():
+                next_id = max(next_id, int(pd.to_numeric(good.loc[numbered, "audio_clip_id"]).max()))
+            good.loc[~numbered, "audio_clip_id"] = range(next_id + 1, next_id + 1 + int((~numbered).sum()))
+            too_high = pd.to_numeric(good["audio_clip_id"]) >= shared_state.MAX_CLIP_ID
+            if too_high.any():
+                raise SystemExit(f"{int(too_high.sum())} new clips would get an id above "
+                                 f"{shared_state.MAX_CLIP_ID - 1}; give them audio_clip_id in the manifest")
+            rows = [(int(r.audio_clip_id), r.url, r.topic, audio_set_no) for r in good.itertuples()]
+
+            if dry_run or not rows:
+                conn.rollback()
+            else:
+                loading = time.perf_counter()
+                load_data(conn, rows) if use_load_data else insert_rows(conn, rows, batch)
+                conn.commit()
+                print(f"{len(rows)} clips written to audio set {audio_set_no} "
+                      f"in {time.perf_counter() - loading:.1f}s")
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    rejected = frame[frame["reason"] != ""]
+    for reason, count in rejected["reason"].value_counts().items():
+        print(f"  skipped {count}: {reason}")
+    if rejects_path and len(rejected):
+        rejected.to_csv(rejects_path, index=False, quoting=csv.QUOTE_MINIMAL)
+        print(f"rejected rows written to {rejects_path}")
+    if dry_run:
+        print(f"dry run: {len(rows)} clips would be written")
+    elif rows:
+        version = shared_state.get_shared_state().bump_catalog_version()
+        print(f"catalog version on this host is now {version}")
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", type=Path, help="CSV or Parquet with url, topic[, audio_clip_id]")
+    parser.add_argument("--audio-set", type=int, default=catalog.AUDIO_SET_NO, help="audio_clips.group_no")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="rows per multi-row INSERT")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="URL checks at a time")
+    parser.add_argument("--skip-url-check", action="store_true")
+    parser.add_argument("--load-data", action="store_true", help="use LOAD DATA LOCAL INFILE")
+    parser.add_argument("--dry-run", action="store_true", help="check everything, write nothing")
+    parser.add_argument("--rejects", help="write skipped rows and why to this CSV")
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    args = parser.parse_args(argv)
+
+    run(args.manifest, args.audio_set, args.batch, args.concurrency, not args.skip_url_check,
+        args.load_data, args.dry_run, args.rejects, args.secrets)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
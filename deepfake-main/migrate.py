@@ -0,0 +1,339 @@
+"""
+Versioned schema migrations and an index advisor for the study tables.
+
+    python migrate.py status               # applied / pending migrations
+    python migrate.py apply [--bench]      # apply pending ones, optionally timing queries before/after
+    python migrate.py advise               # EXPLAIN the app's queries and propose indexes
+    python migrate.py bench                # time the app's queries once
+    python migrate.py --secrets standin.toml advise
+
+The query set is captured from the source itself: every constant SQL string
+passed to text(...) in the top-level modules and pages/*.py. Without ssh_host
+in the secrets file the database is used directly, so the same commands run
+against a local stand-in before the real database.
+"""
+import argparse
+import ast
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import pymysql
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import arms
+import db
+import encoding
+import summary
+
+# Every top-level module (benchmarks/ is not matched) and every page
+QUERY_SOURCES = ["*.py", "pages/*.py"]
+
+# Values bound to :params when EXPLAINing / timing captured queries.
+SAMPLE_PARAMS = {
+    "audio_set_no": 4,
+    "group_no": 1,
+    "prolific_id": "MIGRATION_PROBE",
+}
+SAMPLE_DEFAULT = 1
+
+BENCH_RUNS = 20
+
+# MySQL errors that mean "this step was already applied by hand".
+_ALREADY_APPLIED = {1050, 1060, 1061}  # table exists, duplicate column, duplicate key name
+
+
+# --------------------------------------------------------------------------------
+# Migrations
+# --------------------------------------------------------------------------------
+def ensure_index(db_conn, table: str, name: str, columns: list[str]):
+    """Create the index unless an existing one already starts with these columns."""
+    rows = db_conn.execute(text(
+        """
+        SELECT index_name, column_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = :table
+        ORDER BY index_name, seq_in_index
+        """
+    ), {"table": table}).fetchall()
+    existing = {}
+    for index_name, column_name in rows:
+        existing.setdefault(index_name, []).append(column_name.lower())
+    wanted = [c.lower() for c in columns]
+    if any(cols[:len(wanted)] == wanted for cols in existing.values()):
+        print(f"  {table}: an index on ({', '.join(columns)}) already exists")
+        return
+    db_conn.execute(text(f"CREATE INDEX {name} ON deepfakes.{table} ({', '.join(columns)})"))
+    print(f"  {table}: created {name} ({', '.join(columns)})")
+
+
+def _hot_path_indexes(db_conn):
+    # Clip sampling: WHERE group_no = :audio_set_no ORDER BY RAND()
+    ensure_index(db_conn, "audio_clips", "ix_audio_clips_group", ["group_no"])
+    # mark_as_rated / rating joins
+    ensure_index(db_conn, "audio_clips", "ix_audio_clips_id", ["audio_clip_id"])
+    # update_participant
+    ensure_index(db_conn, "participants_phase3", "ix_participants_phase3_id", ["participant_id"])
+    # Prolific ID lookups and the participant join
+    ensure_index(db_conn, "prolific_ids_p3", "ix_prolific_ids_p3_prolific", ["prolific_id"])
+    ensure_index(db_conn, "prolific_ids_p3", "ix_prolific_ids_p3_participant", ["participant_id"])
+    for table in ("english_ratings_phase2", "english_ratings_phase3"):
+        ensure_index(db_conn, table, f"ix_{table}_participant", ["participant_id"])
+        ensure_index(db_conn, table, f"ix_{table}_clip_arm", ["audio_clip_id", "group_no"])
+
+
+def _summary_tables(db_conn):
+    summary.rebuild(db_conn)
+
+
+def _encoded_multiselects(db_conn):
+    for statement in [encoding.CREATE_CODES, encoding.CREATE_MEMBERS, *encoding.add_column_statements()]:
+        _execute_tolerant(db_conn, statement)
+    for statement in encoding.view_statements():
+        db_conn.execute(text(statement))
+    encoding.sync_code_tables(db_conn)
+
+
+def _decoded_views(db_conn):
+    for statement in encoding.view_statements():
+        db_conn.execute(text(statement))
+
+
+# Rows that exist when this is applied all get the time of the ALTER
+_PARTICIPANT_CREATED_AT = """
+ALTER TABLE deepfakes.participants_phase3
+    ADD COLUMN created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+"""
+
+
+# (version, description, steps). Steps are SQL strings or callables taking a connection.
+# Append only: never edit a migration that may already be applied somewhere.
+MIGRATIONS = [
+    (1, "per-clip and per-arm summary tables (summary.py)", [_summary_tables]),
+    (2, "encoded multi-select columns, code tables and decoded views (encoding.py)", [_encoded_multiselects]),
+    (3, "indexes for the hot query predicates", [_hot_path_indexes]),
+    (4, "arm assignment log (arms.py)", [arms.CREATE_ASSIGNMENTS, arms.BACKFILL_ASSIGNMENTS]),
+    (5, "one-call rating submission procedure (summary.py)",
+     [summary.DROP_SUBMIT_PROCEDURE, summary.CREATE_SUBMIT_PROCEDURE]),
+    (6, "participants_phase3.created_at, the placeholder age for archive.py", [_PARTICIPANT_CREATED_AT]),
+    (7, "decoded views that read empty code slots (encoding.py)", [_decoded_views]),
+]
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS deepfakes.schema_migrations (
+    version INT NOT NULL PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INT NOT NULL
+)
+"""
+
+
+def _execute_tolerant(db_conn, statement: str):
+    try:
+        db_conn.execute(text(statement))
+    except OperationalError as e:
+        code = e.orig.args[0] if isinstance(e.orig, pymysql.err.MySQLError) else None
+        if code not in _ALREADY_APPLIED:
+            raise
+        print(f"  skipped (already applied): {statement.strip().splitlines()[0]}")
+
+
+def applied_versions(engine) -> set:
+    with engine.begin() as db_conn:
+        db_conn.execute(text(CREATE_MIGRATIONS_TABLE))
+        return {r[0] for r in db_conn.execute(text("SELECT version FROM deepfakes.schema_migrations"))}
+
+
+def apply(engine, target=None):
+    done = applied_versions(engine)
+    for version, description, steps in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        print(f"applying {version}: {description}")
+        started = time.perf_counter()
+        # MySQL commits DDL implicitly, so a failed migration is re-run from its first step;
+        # every step is written to be idempotent for that reason.
+        with engine.begin() as db_conn:
+            for step in steps:
+                if callable(step):
+                    step(db_conn)
+                else:
+                    _execute_tolerant(db_conn, step)
+            db_conn.execute(
+                text(
+                    "INSERT INTO deepfakes.schema_migrations (version, description, duration_ms) "
+                    "VALUES (:version, :description, :ms)"
+                ),
+                {"version": version, "description": description,
+                 "ms": int((time.perf_counter() - started) * 1000)},
+            )
+
+
+def status(engine):
+    done = applied_versions(engine)
+    for version, description, _ in MIGRATIONS:
+        print(f"{'applied' if version in done else 'pending':8} {version:3}  {description}")
+
+
+# --------------------------------------------------------------------------------
+# Query capture
+# --------------------------------------------------------------------------------
+def capture_queries(root: Path = db.APP_DIR) -> list[dict]:
+    """Every constant SQL string passed to text(...) in the app, with its location."""
+    queries = []
+    for pattern in QUERY_SOURCES:
+        for path in sorted(root.glob(pattern)):
+            tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+            for node in ast.walk(tree):
+                if (
+                    isinstance(node, ast.Call)
+                    and getattr(node.func, "id", None) == "text"
+                    and node.args
+                    and isinstance(node.args[0], ast.Constant)
+                    and isinstance(node.args[0].value, str)
+                ):
+                    sql = " ".join(node.args[0].value.split()).rstrip(";")
+                    # Expanding IN :ids parameters are probed with a single value.
+                    sql = re.sub(r"\bIN\s+:(\w+)", r"IN (:\1)", sql, flags=re.I)
+                    if sql.split(" ", 1)[0].upper() in ("SELECT", "UPDATE", "DELETE", "INSERT"):
+                        queries.append({"where": f"{path.relative_to(root)}:{node.lineno}", "sql": sql})
+    # The rating pages share their queries; keep one entry per statement.
+    unique = {}
+    for q in queries:
+        unique.setdefault(q["sql"], q)
+    return list(unique.values())
+
+
+def sample_params(sql: str) -> dict:
+    return {name: SAMPLE_PARAMS.get(name, SAMPLE_DEFAULT) for name in re.findall(r"(?<!:):(\w+)", sql)}
+
+
+def read_only_form(sql: str) -> str | None:
+    """A SELECT touching the same rows, so writes can be timed without changing data."""
+    upper = sql.upper()
+    if upper.startswith("SELECT"):
+        return sql
+    m = re.match(r"UPDATE\s+([\w.]+)\s+SET\s+.*?\s+(WHERE\s+.*)$", sql, re.I | re.S)
+    if m:
+        return f"SELECT COUNT(*) FROM {m.group(1)} {m.group(2)}"
+    m = re.match(r"DELETE\s+FROM\s+([\w.]+)\s+(WHERE\s+.*)$", sql, re.I | re.S)
+    if m:
+        return f"SELECT COUNT(*) FROM {m.group(1)} {m.group(2)}"
+    return None  # plain INSERT ... VALUES: nothing to look up
+
+
+# --------------------------------------------------------------------------------
+# Advisor
+# --------------------------------------------------------------------------------
+def predicate_columns(sql: str):
+    """(table, equality columns, range columns, order-by columns) of a single-table statement."""
+    table = re.search(r"\b(?:FROM|UPDATE|INTO)\s+(?:\w+\.)?(\w+)", sql, re.I)
+    where = re.search(r"\bWHERE\s+(.*?)(?:\bORDER\s+BY\b|\bGROUP\s+BY\b|\bLIMIT\b|$)", sql, re.I | re.S)
+    order = re.search(r"\bORDER\s+BY\s+(.*?)(?:\bLIMIT\b|$)", sql, re.I | re.S)
+    equality, ranges = [], []
+    if where:
+        for column, op in re.findall(r"(\w+)\s*(=|\bIN\b|>=|<=|>|<|\bBETWEEN\b)\s*\(?:", where.group(1), re.I):
+            (equality if op.upper() in ("=", "IN") else ranges).append(column)
+    order_by = []
+    if order:
+        order_by = [c.split()[0] for c in order.group(1).split(",") if "(" not in c]
+    return (table.group(1) if table else None), equality, ranges, order_by
+
+
+def advise(engine) -> list[dict]:
+    """EXPLAIN every captured query and suggest an index where MySQL scans."""
+    proposals = []
+    with engine.connect() as db_conn:
+        for q in capture_queries():
+            try:
+                plan = db_conn.execute(text("EXPLAIN " + q["sql"]), sample_params(q["sql"])).mappings().all()
+            except OperationalError as e:
+                print(f"{q['where']}: EXPLAIN failed: {e.orig}")
+                continue
+            for step in plan:
+                scans = step.get("type") in ("ALL", "index") or step.get("key") is None
+                print(f"{q['where']}: table={step.get('table')} type={step.get('type')} "
+                      f"key={step.get('key')} rows={step.get('rows')} extra={step.get('Extra')}")
+                table, equality, ranges, order_by = predicate_columns(q["sql"])
+                columns = list(dict.fromkeys(equality + ranges[:1] + ([] if ranges else order_by)))
+                if scans and table and columns:
+                    proposals.append({
+                        "where": q["where"],
+                        "table": table,
+                        "columns": columns,
+                        "ddl": f"CREATE INDEX ix_{table}_{'_'.join(columns)} ON deepfakes.{table} ({', '.join(columns)})",
+                    })
+    unique = {p["ddl"]: p for p in proposals}
+    for p in unique.values():
+        print(f"proposed ({p['where']}): {p['ddl']}")
+    if not unique:
+        print("no full scans on indexable predicates")
+    return list(unique.values())
+
+
+# --------------------------------------------------------------------------------
+# Benchmark
+# --------------------------------------------------------------------------------
+def bench(engine, runs=BENCH_RUNS) -> dict:
+    results = {}
+    with engine.connect() as db_conn:
+        for q in capture_queries():
+            sql = read_only_form(q["sql"])
+            if sql is None:
+                continue
+            params = sample_params(sql)
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                db_conn.execute(text(sql), params).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[q["where"]] = statistics.median(timings)
+    return results
+
+
+def print_bench(before: dict, after: dict | None = None):
+    for where, ms in before.items():
+        line = f"{where:45} {ms:9.2f} ms"
+        if after and where in after:
+            line += f"  ->  {after[where]:9.2f} ms  ({ms / max(after[where], 1e-6):.1f}x)"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--secrets", help="secrets.toml of the target (default: the app's)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status")
+    p_apply = sub.add_parser("apply")
+    p_apply.add_argument("--to", type=int, help="stop after this version")
+    p_apply.add_argument("--bench", action="store_true", help="time the app's queries before and after")
+    sub.add_parser("advise")
+    sub.add_parser("bench")
+    sub.add_parser("queries", help="list the captured query set")
+    args = parser.parse_args(argv)
+
+    if args.command == "queries":
+        for q in capture_queries():
+            print(f"{q['where']}\n    {q['sql']}")
+        return
+
+    with db.tunnel_session(db.load_secrets(args.secrets)) as (secrets, tunnel):
+        engine = db.get_sqlalchemy_engine(tunnel, secrets)
+        if args.command == "status":
+            status(engine)
+        elif args.command == "advise":
+            advise(engine)
+        elif args.command == "bench":
+            print_bench(bench(engine))
+        elif args.command == "apply":
+            before = bench(engine) if args.bench else None
+            apply(engine, args.to)
+            if before is not None:
+                print_bench(before, bench(engine))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+import streamlit as st
+import hmac
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import SQLAlchemyError
+
+import db
+import summary
+
+# --------------------------------------------------------------------------------
+# Page & Layout
+# --------------------------------------------------------------------------------
+st.set_page_config(page_title="Study monitor", initial_sidebar_state="collapsed", layout="wide")
+
+if "sidebar_state" not in st.session_state:
+    st.session_state.sidebar_state = "collapsed"
+
+
+def collapse_sidebar():
+    st.markdown(
+        """
+        <style>
+            [data-testid="collapsedControl"] { display: none; }
+            [data-testid="stSidebar"] { display: none; }
+        </style>
+        """,
+        unsafe_allow_html=True,
+    )
+
+
+if st.session_state.sidebar_state == "collapsed":
+    collapse_sidebar()
+
+# All operators share one poll per POLL_TTL seconds, whatever their refresh rate.
+POLL_TTL = 5
+REFRESH_SECONDS = 10
+# Participants that have not finished Demographics after this long are treated as dropped.
+PENDING_TIMEOUT = 2 * 60 * 60
+# Auto-increment ids are taken at INSERT but show up at COMMIT, so a lower id can
+# appear after a higher one. Each poll re-reads this many ids below the highest seen.
+ID_OVERLAP = 500
+# At seeding, participants this close to the newest id that have not finished
+# Demographics may still be in the study; they are watched like new ones.
+SEED_PENDING = 2000
+ARM_NAMES = {1: "Control", 2: "T1 (inline warning)", 3: "T2 (post-hoc warning)"}
+
+# --------------------------------------------------------------------------------
+# Admin gate
+# --------------------------------------------------------------------------------
+admin_password = st.secrets.get("admin_password")
+if not admin_password:
+    st.error("The monitor is disabled. Set `admin_password` in secrets.toml to enable it.")
+    st.stop()
+
+if not st.session_state.get("admin_ok"):
+    entered = st.text_input("Admin password", type="password")
+    if entered and hmac.compare_digest(entered, admin_password):
+        st.session_state["admin_ok"] = True
+        st.rerun()
+    st.stop()
+
+# --------------------------------------------------------------------------------
+# Incremental monitor state
+# --------------------------------------------------------------------------------
+class Watermark:
+    """Highest auto-increment id counted, plus the ids counted within ID_OVERLAP of it."""
+
+    def __init__(self, high=0, recent=()):
+        self.high = high
+        self.recent = set(recent)
+
+    @property
+    def floor(self):
+        return max(self.high - ID_OVERLAP, 0)
+
+    def fresh(self, rows):
+        """The rows (id first) not counted yet; they are counted from now on."""
+        rows = [row for row in rows if row[0] not in self.recent]
+        for row in rows:
+            self.recent.add(row[0])
+            self.high = max(self.high, row[0])
+        self.recent = {i for i in self.recent if i > self.floor}
+        return rows
+
+
+class MonitorState:
+    """
+    Totals plus auto-increment watermarks, shared by every operator session.
+    Each poll only reads rows above the watermarks (less ID_OVERLAP), so its
+    cost depends on the traffic since the last poll, not on table size.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seeded = False
+        self.ratings_pk = None
+        self.participant_wm = Watermark()
+        self.prolific_wm = Watermark()
+        self.rating_wm = Watermark()
+        self.n_participants = 0
+        self.n_prolific = 0
+        self.n_demographics = 0
+        self.rated_participants = set()
+        self.n_rated_before_start = 0
+        self.pending = {}  # participant_id -> first seen (no demographics yet)
+        self.ratings_timeline = deque(maxlen=720)  # (poll time, new ratings)
+        self.latency_ms = deque(maxlen=200)
+
+
+@st.cache_resource
+def get_monitor_state():
+    return MonitorState()
+
+
+_PENDING_DONE = text(
+    """
+    SELECT participant_id FROM deepfakes.participants_phase3
+    WHERE participant_id IN :ids AND age_group IS NOT NULL
+    """
+).bindparams(bindparam("ids", expanding=True))
+
+
+def _seed(db_conn, state):
+    row = db_conn.execute(text(
+        """
+        SELECT COALESCE(MAX(participant_id), 0), COUNT(*), COALESCE(SUM(age_group IS NOT NULL), 0)
+        FROM deepfakes.participants_phase3
+        """
+    )).fetchone()
+    high, state.n_participants, state.n_demographics = row[0], row[1], int(row[2])
+    recent = db_conn.execute(
+        text(
+            """
+            SELECT participant_id, age_group IS NOT NULL FROM deepfakes.participants_phase3
+            WHERE participant_id > :floor
+            """
+        ),
+        {"floor": max(high - max(ID_OVERLAP, SEED_PENDING), 0)},
+    ).fetchall()
+    state.participant_wm = Watermark(high, [i for i, _ in recent if i > high - ID_OVERLAP])
+    now = time.time()
+    state.pending = {i: now for i, done in recent if not done}
+
+    high, state.n_prolific = db_conn.execute(text(
+        "SELECT COALESCE(MAX(participant_id), 0), COUNT(*) FROM deepfakes.prolific_ids_p3"
+    )).fetchone()
+    recent = db_conn.execute(
+        text("SELECT participant_id FROM deepfakes.prolific_ids_p3 WHERE participant_id > :floor"),
+        {"floor": max(high - ID_OVERLAP, 0)},
+    ).scalars().all()
+    state.prolific_wm = Watermark(high, recent)
+
+    pk = state.ratings_pk = db.primary_key(db_conn, "english_ratings_phase3")
+    high, state.n_rated_before_start = db_conn.execute(text(
+        f"""
+        SELECT COALESCE(MAX({pk}), 0), COUNT(DISTINCT participant_id)
+        FROM deepfakes.english_ratings_phase3
+        """
+    )).fetchone()
+    recent = db_conn.execute(
+        text(f"SELECT {pk} FROM deepfakes.english_ratings_phase3 WHERE {pk} > :floor"),
+        {"floor": max(high - ID_OVERLAP, 0)},
+    ).scalars().all()
+    state.rating_wm = Watermark(high, recent)
+    state.seeded = True
+
+
+def _advance(db_conn, state, now):
+    new_participants = state.participant_wm.fresh(db_conn.execute(
+        text(
+            """
+            SELECT participant_id, age_group IS NOT NULL FROM deepfakes.participants_phase3
+            WHERE participant_id > :wm ORDER BY participant_id
+            """
+        ),
+        {"wm": state.participant_wm.floor},
+    ).fetchall())
+    for participant_id, done in new_participants:
+        state.n_participants += 1
+        if done:
+            state.n_demographics += 1
+        else:
+            state.pending[participant_id] = now
+
+    new_prolific = state.prolific_wm.fresh(db_conn.execute(
+        text("SELECT participant_id FROM deepfakes.prolific_ids_p3 WHERE participant_id > :wm"),
+        {"wm": state.prolific_wm.floor},
+    ).fetchall())
+    state.n_prolific += len(new_prolific)
+
+    pk = state.ratings_pk
+    new_ratings = state.rating_wm.fresh(db_conn.execute(
+        text(
+            f"""
+            SELECT {pk}, participant_id FROM deepfakes.english_ratings_phase3
+            WHERE {pk} > :wm ORDER BY {pk}
+            """
+        ),
+        {"wm": state.rating_wm.floor},
+    ).fetchall())
+    for _, participant_id in new_ratings:
+        state.rated_participants.add(participant_id)
+    state.ratings_timeline.append((now, len(new_ratings)))
+
+    # Demographics is an UPDATE of an old row, so re-check only the open participants.
+    for participant_id, seen in list(state.pending.items()):
+        if now - seen > PENDING_TIMEOUT:
+            del state.pending[participant_id]
+    if state.pending:
+        done = db_conn.execute(_PENDING_DONE, {"ids": list(state.pending)}).fetchall()
+        for (participant_id,) in done:
+            del state.pending[participant_id]
+            state.n_demographics += 1
+
+
+@st.cache_data(ttl=POLL_TTL, show_spinner=False)
+def poll():
+    state = get_monitor_state()
+    pool = db.get_app_engine(st.secrets)
+    db.start_deadline()
+    with state.lock:
+        now = time.time()
+        with pool.connect() as db_conn:
+            start = time.perf_counter()
+            db_conn.execute(text("SELECT 1"))
+            state.latency_ms.append((time.perf_counter() - start) * 1000)
+
+            if not state.seeded:
+                _seed(db_conn, state)
+            else:
+                _advance(db_conn, state, now)
+            arms = summary.arm_summary(db_conn)
+
+        return {
+            "polled_at": now,
+            "funnel": {
+                "Consented + submitted Prolific ID": state.n_participants,
+                "Prolific ID stored": state.n_prolific,
+                "Rated a clip": state.n_rated_before_start + len(state.rated_participants),
+                "Completed Demographics": state.n_demographics,
+            },
+            "timeline": list(state.ratings_timeline),
+            "latency_ms": list(state.latency_ms),
+            "arms": arms,
+        }
+
+
+# --------------------------------------------------------------------------------
+# UI
+# --------------------------------------------------------------------------------
+st.title("Study monitor")
+
+
+def per_minute(timeline):
+    if not timeline:
+        return pd.DataFrame({"ratings": []})
+    df = pd.DataFrame(timeline, columns=["t", "ratings"])
+    df["t"] = pd.to_datetime(df["t"], unit="s")
+    return df.set_index("t").resample("1min").sum()
+
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def render():
+    try:
+        snapshot = poll()
+    except SQLAlchemyError as e:
+        st.error(f"Database query failed: {e}")
+        return
+
+    st.caption(
+        f"Last poll {time.strftime('%H:%M:%S', time.localtime(snapshot['polled_at']))}. "
+        "Consent itself is not stored; a participant row is created once consent is given and the ID is submitted."
+    )
+
+    st.subheader("Completion funnel")
+    funnel = snapshot["funnel"]
+    cols = st.columns(len(funnel))
+    first = max(next(iter(funnel.values())), 1)
+    for col, (stage, n) in zip(cols, funnel.items()):
+        col.metric(stage, n, f"{100 * n / first:.0f}%", delta_color="off")
+
+    left, right = st.columns(2)
+    with left:
+        st.subheader("Submissions per minute")
+        st.bar_chart(per_minute(snapshot["timeline"]))
+    with right:
+        st.subheader("DB latency (SELECT 1)")
+        latency = pd.Series(snapshot["latency_ms"], dtype=float)
+        if len(latency):
+            c1, c2, c3 = st.columns(3)
+            c1.metric("last", f"{latency.iloc[-1]:.0f} ms")
+            c2.metric("p50", f"{latency.quantile(0.5):.0f} ms")
+            c3.metric("p95", f"{latency.quantile(0.95):.0f} ms")
+            st.line_chart(latency.rename("ms"))
+
+    st.subheader("Arm balance")
+    arms = pd.DataFrame(snapshot["arms"])
+    if arms.empty:
+        st.info("No ratings summarised yet.")
+    else:
+        arms["arm"] = arms["group_no"].map(ARM_NAMES).fillna(arms["group_no"].astype(str))
+        st.bar_chart(arms.set_index("arm")["n_ratings"])
+        st.dataframe(arms.set_index("arm").drop(columns=["group_no"]), use_container_width=True)
+
+
+render()
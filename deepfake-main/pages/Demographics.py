@@ -1,14 +1,16 @@
 import streamlit as st
 import streamlit_survey as ss
 import json
-import time
 
-from sqlalchemy import create_engine, text
-import pymysql
-from sshtunnel import SSHTunnelForwarder
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 import pandas as pd
 
+import admission
+import db
+import encoding
+import fallback
+
 st.set_page_config(
     initial_sidebar_state="collapsed"  # Collapsed sidebar by default
 )
@@ -81,31 +83,9 @@ occupation_list = [
     "Other"
 ]
 
-race_list = [
- 
-    "American Indian or Alaska Native",
-    "Asian",
-    "Black or African American",
-    "Hispanic or Latino",
-    "Middle Eastern or North African",
-    "Native Hawaiian or Pacific Islander",
-    "White"
-]
+race_list = encoding.RACES
 
-mother_tongue_list = [
-
-    "English", "Spanish", "Chinese (Mandarin)", "Hindi", "Arabic", "French",
-    "Bengali", "Russian", "Portuguese", "Indonesian", "Japanese", "German",
-    "Korean", "Turkish", "Vietnamese", "Italian", "Tamil", "Urdu", "Persian (Farsi)",
-    "Punjabi", "Javanese", "Telugu", "Marathi", "Thai", "Dutch", "Swedish",
-    "Greek", "Polish", "Czech", "Hungarian", "Romanian", "Ukrainian", "Hebrew",
-    "Malay", "Burmese", "Hausa", "Igbo", "Yoruba", "Swahili", "Tagalog (Filipino)",
-    "Nepali", "Sinhala", "Amharic", "Zulu", "Somali", "Pashto", "Kazakh", "Uzbek",
-    "Khmer", "Lao", "Finnish", "Danish", "Norwegian", "Slovak", "Croatian",
-    "Bulgarian", "Serbian", "Lithuanian", "Latvian", "Estonian", "Georgian",
-    "Armenian", "Mongolian", "Bosnian", "Azerbaijani", "Macedonian", "Albanian",
-    "Malayalam", "Kannada", "Gujarati", "Oriya (Odia)", "Other",
-]
+mother_tongue_list = encoding.MOTHER_TONGUES
 
 languages_spoken_list = [ "1", "2", "3", "4", "5", "More than 5"]
 
@@ -124,16 +104,7 @@ political_inclination_list = [
     "Conservative"
 ]
 
-listening_habit_list = [
-
-    "Symphonies",
-    "Audiobooks",
-    "Podcasts",
-    "Music",
-    "Nature Sounds",
-    "White Noise",
-    "Other"
-]
+listening_habit_list = encoding.LISTENING_HABITS
 
 tech_savy_list = [
 
@@ -164,18 +135,8 @@ media_consumption_list = [
     "Other"
 ]
 
-# Load data with error handling
-try:
-    df_countries = pd.read_csv(
-        "https://raw.githubusercontent.com/DALIAALISIDDIG/Aligniverse_Gender_English/refs/heads/main/aligniverse_gender-main/UNSD_Methodology_ancestry.csv",
-        sep=";"
-    )
-except Exception as e:
-    st.error(
-        "Failed to connect to the database after multiple retries -Data. Please Return the study and check your network!")
-    st.stop()
-
-country_list = sorted(df_countries["Country or Area"].to_list())
+# Bundled UNSD list, sorted; the same list is the nationality code table
+country_list = encoding.COUNTRIES
 
 
 ###################################################################################
@@ -202,80 +163,9 @@ def collapse_sidebar():
 if st.session_state.sidebar_state == 'collapsed':
     collapse_sidebar()
 
-ssh_host = st.secrets["ssh_host"]
-ssh_port = st.secrets["ssh_port"]
-ssh_user = st.secrets["ssh_user"]
-ssh_password = st.secrets["ssh_password"]
-
-db_host = st.secrets["db_host"]
-db_user = st.secrets["db_user"]
-db_password = st.secrets["db_password"]
-db_name = st.secrets["db_name"]
-db_port = st.secrets["db_port"]
-
-
-# Set up SSH tunnel with retry logic
-def start_ssh_tunnel():
-    try:
-        tunnel = SSHTunnelForwarder(
-            (ssh_host, ssh_port),
-            ssh_username=ssh_user,
-            ssh_password=ssh_password,
-            remote_bind_address=(db_host, db_port),
-            set_keepalive=30  # Keeps SSH connection alive
-        )
-        tunnel.start()
-        return tunnel
-    except Exception as e:
-        st.error(f"SSH tunnel connection failed: {e}")
-        raise
-
-
-# Establish a database connection with retries
-def get_connection(tunnel, retries=3, delay=5):
-    for attempt in range(retries):
-        try:
-            conn = pymysql.connect(
-                host='127.0.0.1',
-                user=db_user,
-                password=db_password,
-                database=db_name,
-                port=tunnel.local_bind_port,
-                connect_timeout=10600,  # Increased 
-                read_timeout=9600,  # Increased
-                write_timeout=9600,  # Increased
-                max_allowed_packet=128 * 1024 * 1024  # 128MB
-            )
-            return conn
-        except pymysql.err.OperationalError as e:
-            st.error(f"Connection attempt {attempt + 1} failed: {e}")
-            if attempt < retries - 1:
-                time.sleep(delay)
-            else:
-                st.error("Failed to connect to the database after multiple retries. Please check your network.")
-                raise
-
-
-# Create SQLAlchemy engine with retry and connection pooling
-def create_engine_with_pool(tunnel):
-    try:
-        pool = create_engine(
-            "mysql+pymysql://",
-            creator=lambda: get_connection(tunnel),
-            pool_pre_ping=True,
-            pool_recycle=3600,  # Recycles connections every hour
-            pool_size=3000,  # Set pool size to handle multiple connections
-            max_overflow=3000  # Allow 10 extra simultaneous connections if needed
-        )
-        return pool
-    except Exception as e:
-        st.error(f"Error creating database engine: {e}")
-        st.stop()
-
-
-# Start SSH Tunnel and set up DB pool
-tunnel = start_ssh_tunnel()
-pool = create_engine_with_pool(tunnel)
+# One SSH tunnel + pool per server process, see db.py
+pool, _ = admission.enter(st.session_state, st.secrets, page="pages/Demographics.py")  # renews the lease
+db.start_deadline()  # DB time budget for this rerun
 
 
 # Database operations with error handling
@@ -288,9 +178,38 @@ def update_participant(participant_id, age_group, gender, education, occupation,
                        listening_habits,
                        tech_savy,
                        ai_experience,
-                       media_consumption):
+                       media_consumption,
+                       multiselects=None):
+    # multiselects: {"nationality": [...], "race": [...], ...} as selected on the page
+    multiselects = multiselects or {}
     update_query = text("""
     UPDATE participants_phase3
+    SET age_group = :age_group,
+        gender = :gender,
+        education = :education,
+        occupation = :occupation,
+        country_of_residence = :country_of_residence,
+        nationality = :nationality,
+        race = :race,
+        native_tongue = :native_tongue,
+        languages_spoken = :languages_spoken,
+        english_fluency = :english_fluency,
+        political_party = :political_party,
+        political_inclination = :political_inclination,
+        listening_habits = :listening_habits,
+        tech_savy = :tech_savy,
+        ai_experience = :ai_experience,
+        media_consumption = :media_consumption,
+        race_mask = :race_mask,
+        listening_habits_mask = :listening_habits_mask,
+        nationality_codes = :nationality_codes,
+        native_tongue_codes = :native_tongue_codes
+    WHERE participant_id = :participant_id
+    """)
+
+    # Before migration 2 (encoding.py) there are no encoded columns to write
+    legacy_update_query = text("""
+    UPDATE participants_phase3
     SET age_group = :age_group,
         gender = :gender,
         education = :education,
@@ -311,9 +230,10 @@ def update_participant(participant_id, age_group, gender, education, occupation,
     """)
 
     try:
-        with pool.connect() as connection:
-
-            connection.execute(update_query, {
+        # Spooled locally (fallback.py) if the database is unavailable
+        with fallback.begin(pool) as connection:
+            encoded = encoding.encoded(connection, "participants_phase3")
+            connection.execute(update_query if encoded else legacy_update_query, {
                 'participant_id': participant_id,
                 'age_group': age_group,
                 'gender': gender,
@@ -330,10 +250,14 @@ def update_participant(participant_id, age_group, gender, education, occupation,
                 'listening_habits': listening_habits,
                 'tech_savy': tech_savy,
                 'ai_experience': ai_experience,
-                'media_consumption': media_consumption
+                'media_consumption': media_consumption,
+                **{
+                    encoding.FIELDS[name].column: encoding.encode(name, multiselects.get(name))
+                    for name in ("race", "listening_habits", "nationality", "native_tongue")
+                },
             })
-
-            connection.commit()
+            if encoded:
+                encoding.replace_members(connection, participant_id, multiselects)
 
     except SQLAlchemyError as e:
         st.error(f"Database update failed: {e}")
@@ -516,6 +440,12 @@ elif all([q_age, q_gender, q_education, q_occupation, q_nationality, q_race, q_n
             q_tech_savy,  # Tech Savy
             q_ai_experience,  # AI Experience
             q_media_consumption,  # Media Consumption
+            multiselects={
+                "nationality": q_nationality,
+                "race": q_race,
+                "native_tongue": q_native_tongue,
+                "listening_habits": q_listening_habits,
+            },
         )
         # Closed for test
         st.switch_page("pages/End_participation.py")
@@ -1,5 +1,7 @@
 import streamlit as st
 import streamlit_survey as ss
+
+import admission
 st.set_page_config(
     initial_sidebar_state="collapsed"  # Collapsed sidebar by default
 )
@@ -29,6 +31,9 @@ if st.session_state.sidebar_state == 'collapsed':
     collapse_sidebar()
     
 
+# Done: hand this participant's place to the next one waiting (admission.py)
+admission.release(st.session_state)
+
 st.title("Thank you!")
 st.write("Thank you for being part of our study.")
 st.balloons()
@@ -1,12 +1,16 @@
 import streamlit as st
 import streamlit_survey as ss
-import time
-
-from sqlalchemy import create_engine, text
-import pymysql
-from sshtunnel import SSHTunnelForwarder
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 
+import admission
+import db
+import fallback
+import playlist
+import rum
+import shared_state
+import summary
+
 # --------------------------------------------------------------------------------
 # Page & Layout
 # --------------------------------------------------------------------------------
@@ -54,75 +58,17 @@ if st.session_state.sidebar_state == "collapsed":
     collapse_sidebar()
 
 # --------------------------------------------------------------------------------
-# Secrets
+# DB (one SSH tunnel + pool per server process, see db.py)
 # --------------------------------------------------------------------------------
-ssh_host = st.secrets["ssh_host"]
-ssh_port = st.secrets["ssh_port"]
-ssh_user = st.secrets["ssh_user"]
-ssh_password = st.secrets["ssh_password"]
-
-db_host = st.secrets["db_host"]
-db_user = st.secrets["db_user"]
-db_password = st.secrets["db_password"]
-db_name = st.secrets["db_name"]
-db_port = st.secrets["db_port"]
-
-# --------------------------------------------------------------------------------
-# SSH + DB
-# --------------------------------------------------------------------------------
-def start_ssh_tunnel():
-    try:
-        tunnel = SSHTunnelForwarder(
-            (ssh_host, ssh_port),
-            ssh_username=ssh_user,
-            ssh_password=ssh_password,
-            remote_bind_address=(db_host, db_port),
-            set_keepalive=30,
-        )
-        tunnel.start()
-        return tunnel
-    except Exception as e:
-        st.error(f"SSH tunnel connection failed: {e}")
-        raise
-
-def get_connection(tunnel, retries=10, delay=5):
-    attempt = 0
-    while attempt < retries:
-        try:
-            conn = pymysql.connect(
-                host="127.0.0.1",
-                user=db_user,
-                password=db_password,
-                database=db_name,
-                port=tunnel.local_bind_port,
-                connect_timeout=60,
-                read_timeout=60,
-                write_timeout=60,
-                max_allowed_packet=128 * 1024 * 1024,
-            )
-            return conn
-        except pymysql.err.OperationalError as e:
-            attempt += 1
-            if attempt < retries:
-                st.info(f"DB connection failed (attempt {attempt}/{retries}). Retrying in {delay}s…")
-                time.sleep(delay)
-            else:
-                st.error(f"Failed to connect to DB after {retries} attempts: {e}")
-                raise
-
-def get_sqlalchemy_engine(tunnel):
-    engine = create_engine(
-        "mysql+pymysql://",
-        creator=lambda: get_connection(tunnel),
-        pool_pre_ping=True,
-        pool_recycle=3600,
-        pool_size=10,
-        max_overflow=20,
-    )
-    return engine
-
-tunnel = start_ssh_tunnel()
-pool = get_sqlalchemy_engine(tunnel)
+pool, admitted = admission.enter(st.session_state, st.secrets, page="pages/Rate_responses_phase3_T1.py")
+if not admitted:
+    st.switch_page(admission.WAITING_PAGE)
+if pool is None:
+    st.error(admission.UNREACHABLE)
+    st.stop()
+db.start_deadline()  # DB time budget for this rerun
+# Counters shared with the other workers on this host (shared_state.py)
+state = shared_state.get_shared_state(pool)
 
 # --------------------------------------------------------------------------------
 # DB Helpers (NEW, MINIMAL)
@@ -204,28 +150,42 @@ def insert_rating_phase3(
         """
     )
     try:
-        with pool.begin() as db_conn:
-            db_conn.execute(
-                insert_query,
-                {
-                    "participant_id": participant_id,
-                    "audio_clip_id": audio_clip_id,
-                    "realness_scale": realness_scale,
-                    "realness_perception": realness_perception,
-                    "confident": confident,
-                    "difficult_to_decide": difficult_to_decide,
-                    "trust_content": trust_content,
-                    "trust_media": trust_media,
-                    "scam": scam,
-                    "take_greenland": take_greenland,
-                    "open_ended_response": open_ended_response,
-                    "check_1": check_1,
-                    "group_no":group_no
-                },
-            )
+        # Spooled locally (fallback.py) if the database is unavailable
+        with fallback.begin(pool) as db_conn:
+            rating = {
+                "participant_id": participant_id,
+                "audio_clip_id": audio_clip_id,
+                "realness_scale": realness_scale,
+                "realness_perception": realness_perception,
+                "confident": confident,
+                "difficult_to_decide": difficult_to_decide,
+                "trust_content": trust_content,
+                "trust_media": trust_media,
+                "scam": scam,
+                "take_greenland": take_greenland,
+                "open_ended_response": open_ended_response,
+                "check_1": check_1,
+                "group_no":group_no
+            }
+            # Rating and both aggregates in one round trip (summary.py); statement by
+            # statement, in the same transaction, until migration 5 is applied
+            if not summary.submit_rating(db_conn, rating):
+                db_conn.execute(insert_query, rating)
+                summary.record_rating(
+                    db_conn,
+                    audio_clip_id=audio_clip_id,
+                    group_no=group_no,
+                    realness_scale=realness_scale,
+                    realness_perception=realness_perception,
+                    check_1=check_1,
+                    trust_content=trust_content,
+                    trust_media=trust_media,
+                )
     except SQLAlchemyError as e:
         st.error(f"Database insertion failed: {e}")
         raise
+    # Rated counts for every worker on this host, once the rating is committed
+    state.add_rating(audio_clip_id, group_no)
 
 # --------------------------------------------------------------------------------
 # UI + Logic
@@ -252,6 +212,9 @@ def ten_radio(key: str, left_label: str | None = None, right_label: str | None =
     return val
 
 def save_to_db():
+    # Fresh DB budget: on_click callbacks run before the page body starts its own
+    db.start_deadline()
+
     # participant id
     if "participant_id" not in st.session_state:
         st.session_state["participant_id"] = insert_participant_and_get_id()
@@ -318,21 +281,19 @@ def save_to_db():
     )
 
     st.session_state["count"] += 1
-AUDIO_SET_NO = 4 
+# This participant's clips, picked once from the catalog (playlist.py)
+try:
+    playlist.for_session(
+        st.session_state, pool, group_no, st.secrets.get("clips_per_participant", playlist.CLIPS_PER_PARTICIPANT)
+    )
+except SQLAlchemyError:
+    st.error(admission.UNREACHABLE)
+    st.stop()
+if playlist.finished(st.session_state):
+    st.switch_page("pages/Demographics.py")
 with st.form(key="form_rating", clear_on_submit=True):
     try:
-        # Fetch one clip for the chosen group
-        with pool.connect() as db_conn:
-            query = text(
-                """
-                SELECT audio_clip_id, url, topic
-                FROM deepfakes.audio_clips
-                WHERE group_no = :audio_set_no
-                ORDER BY RAND()
-                LIMIT 1;
-                """
-            )
-            sample_row = db_conn.execute(query, {"audio_set_no": AUDIO_SET_NO}).fetchone()
+        sample_row = playlist.current(st.session_state)
 
         if not sample_row:
             st.error("No audio found for this group. Please try again later.")
@@ -374,6 +335,10 @@ with st.form(key="form_rating", clear_on_submit=True):
             unsafe_allow_html=True,
         )
         st.audio(url, format="audio/wav")
+        # Fetch the next clip's audio while this one is rated
+        st.markdown(playlist.preload_html(playlist.upcoming(st.session_state)), unsafe_allow_html=True)
+        # Load and audio timings from the participant's browser (rum.py)
+        rum.beacon("Rate_responses_phase3_T1", audio_clip_id, group_no, url)
         st.info("❗If the audio isn't playing, refresh the page or try a different browser.")
         st.markdown(f"⬇️ **Download the audio if the player fails:** [{url}]({url})")
 
@@ -478,9 +443,9 @@ with st.form(key="form_rating", clear_on_submit=True):
         st.error(f"An unexpected error occurred: {e}")
 
 # Finish / route
-if st.session_state["count"] < 1:
+if not playlist.finished(st.session_state):
     st.write("Please rate the audio and answer all required questions to finish the survey.")
-    st.write(f"You have rated {st.session_state['count']} audios so far.")
+    st.write(f"You have rated {st.session_state['count']} of {len(st.session_state['playlist'])} audios so far.")
 else:
     st.write("You have rated the audio and you can finish your participation now.")
     st.switch_page("pages/Demographics.py")
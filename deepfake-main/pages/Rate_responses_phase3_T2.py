@@ -1,12 +1,17 @@
 import streamlit as st
 import streamlit_survey as ss
-import time
-
-from sqlalchemy import create_engine, text
-import pymysql
-from sshtunnel import SSHTunnelForwarder
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
-import streamlit.components.v1 as components
+
+import admission
+import answer_collector
+import db
+import fallback
+import playlist
+import questionnaire
+import rum
+import shared_state
+import summary
 
 # --------------------------------------------------------------------------------
 # Page & Layout
@@ -53,75 +58,17 @@ if st.session_state.sidebar_state == "collapsed":
     collapse_sidebar()
 
 # --------------------------------------------------------------------------------
-# Secrets
+# DB (one SSH tunnel + pool per server process, see db.py)
 # --------------------------------------------------------------------------------
-ssh_host = st.secrets["ssh_host"]
-ssh_port = st.secrets["ssh_port"]
-ssh_user = st.secrets["ssh_user"]
-ssh_password = st.secrets["ssh_password"]
-
-db_host = st.secrets["db_host"]
-db_user = st.secrets["db_user"]
-db_password = st.secrets["db_password"]
-db_name = st.secrets["db_name"]
-db_port = st.secrets["db_port"]
-
-# --------------------------------------------------------------------------------
-# SSH + DB
-# --------------------------------------------------------------------------------
-def start_ssh_tunnel():
-    try:
-        tunnel = SSHTunnelForwarder(
-            (ssh_host, ssh_port),
-            ssh_username=ssh_user,
-            ssh_password=ssh_password,
-            remote_bind_address=(db_host, db_port),
-            set_keepalive=30,
-        )
-        tunnel.start()
-        return tunnel
-    except Exception as e:
-        st.error(f"SSH tunnel connection failed: {e}")
-        raise
-
-def get_connection(tunnel, retries=10, delay=5):
-    attempt = 0
-    while attempt < retries:
-        try:
-            conn = pymysql.connect(
-                host="127.0.0.1",
-                user=db_user,
-                password=db_password,
-                database=db_name,
-                port=tunnel.local_bind_port,
-                connect_timeout=60,
-                read_timeout=60,
-                write_timeout=60,
-                max_allowed_packet=128 * 1024 * 1024,
-            )
-            return conn
-        except pymysql.err.OperationalError as e:
-            attempt += 1
-            if attempt < retries:
-                st.info(f"DB connection failed (attempt {attempt}/{retries}). Retrying in {delay}s…")
-                time.sleep(delay)
-            else:
-                st.error(f"Failed to connect to DB after {retries} attempts: {e}")
-                raise
-
-def get_sqlalchemy_engine(tunnel):
-    engine = create_engine(
-        "mysql+pymysql://",
-        creator=lambda: get_connection(tunnel),
-        pool_pre_ping=True,
-        pool_recycle=3600,
-        pool_size=10,
-        max_overflow=20,
-    )
-    return engine
-
-tunnel = start_ssh_tunnel()
-pool = get_sqlalchemy_engine(tunnel)
+pool, admitted = admission.enter(st.session_state, st.secrets, page="pages/Rate_responses_phase3_T2.py")
+if not admitted:
+    st.switch_page(admission.WAITING_PAGE)
+if pool is None:
+    st.error(admission.UNREACHABLE)
+    st.stop()
+db.start_deadline()  # DB time budget for this rerun
+# Counters shared with the other workers on this host (shared_state.py)
+state = shared_state.get_shared_state(pool)
 
 # --------------------------------------------------------------------------------
 # DB Helpers
@@ -196,328 +143,189 @@ def insert_rating_phase3(
         """
     )
     try:
-        with pool.begin() as db_conn:
-            db_conn.execute(
-                insert_query,
-                {
-                    "participant_id": participant_id,
-                    "audio_clip_id": audio_clip_id,
-                    "realness_scale": realness_scale,
-                    "realness_perception": realness_perception,
-                    "confident": confident,
-                    "difficult_to_decide": difficult_to_decide,
-                    "trust_content": trust_content,
-                    "trust_media": trust_media,
-                    "scam": scam,
-                    "take_greenland": take_greenland,
-                    "open_ended_response": open_ended_response,
-                    "check_1": check_1,
-                    "group_no": group_no,
-                },
-            )
+        # Spooled locally (fallback.py) if the database is unavailable
+        with fallback.begin(pool) as db_conn:
+            rating = {
+                "participant_id": participant_id,
+                "audio_clip_id": audio_clip_id,
+                "realness_scale": realness_scale,
+                "realness_perception": realness_perception,
+                "confident": confident,
+                "difficult_to_decide": difficult_to_decide,
+                "trust_content": trust_content,
+                "trust_media": trust_media,
+                "scam": scam,
+                "take_greenland": take_greenland,
+                "open_ended_response": open_ended_response,
+                "check_1": check_1,
+                "group_no": group_no,
+            }
+            # Rating and both aggregates in one round trip (summary.py); statement by
+            # statement, in the same transaction, until migration 5 is applied
+            if not summary.submit_rating(db_conn, rating):
+                db_conn.execute(insert_query, rating)
+                summary.record_rating(
+                    db_conn,
+                    audio_clip_id=audio_clip_id,
+                    group_no=group_no,
+                    realness_scale=realness_scale,
+                    realness_perception=realness_perception,
+                    check_1=check_1,
+                    trust_content=trust_content,
+                    trust_media=trust_media,
+                )
     except SQLAlchemyError as e:
         st.error(f"Database insertion failed: {e}")
         raise
+    # Rated counts for every worker on this host, once the rating is committed
+    state.add_rating(audio_clip_id, group_no)
+
+# --------------------------------------------------------------------------------
+# Questions (rendered and checked in the browser, see answer_collector.py)
+# --------------------------------------------------------------------------------
+FAKE_WARNING = """
+<div style="
+    background:#fff0f0;
+    border:3px solid red;
+    padding:16px;
+    font-size:24px;
+    font-weight:900;
+    text-align:center;
+    border-radius:12px;
+    margin-bottom:20px;">
+    🚨 Warning: You listened to a fake (AI-generated) audio clip
+</div>
+"""
+
+Q = questionnaire.Question
+STEPS = (
+    # STEP 1 — Audio + Q1–Q2
+    questionnaire.Section("listen", "Listen", (
+        Q("key_real_fake", "❓Do you think the speech is real or fake?", "radio", ("Real", "Fake"),
+          label="Real or fake"),
+        Q("key_realness_scale", "❓On a scale from fake to real, how would you rate this audio?",
+          caption="1 = Definitely Fake, 10 = Definitely Real", label="Fake-to-real scale"),
+    ), intro="<h4>🔊 Listen to the audio clip and answer the questions below.</h4>", audio=True),
+    # STEP 2 — Remaining questions + FAKE notice
+    questionnaire.Section("after", "After listening", (
+        Q("key_trust_content", "❓How much do you trust political audio content online?",
+          caption="1 = Not at all, 10 = Completely", label="Trust in political audio content"),
+        Q("key_trust_media", "❓How much do you trust online news media?",
+          caption="1 = Not at all, 10 = Completely", label="Trust in online news media"),
+        Q("key_take_greenland",
+          "❓Do you support or oppose the U.S. using military force to take control of Greenland?",
+          "radio", ("Support", "Oppose", "Not sure"), label="Greenland"),
+        Q("key_check", "I am reading carefully. Select 4 if yes.", label="Reading check"),
+        Q("key_scam", "❓Have you fallen for misleading info online?", "radio", ("Yes", "No", "Not sure"),
+          label="Misleading info"),
+        Q("key_open_ended", "Optional", "text", label="Anything stand out?", required=False),
+    ), intro=FAKE_WARNING),
+)
 
 # --------------------------------------------------------------------------------
 # UI + Logic
 # --------------------------------------------------------------------------------
 st.title("Welcome, Audio Explorer! 🎧")
 
-# Force scroll to top when step changes
-if st.session_state.get("step") == 2 and st.session_state.get("just_switched"):
-    components.html(
-        """
-        <script>
-            window.parent.document.querySelector('section.main').scrollTo(0, 0);
-        </script>
-        """,
-        height=0,
-    )
-    st.session_state["just_switched"] = False
-
 survey = ss.StreamlitSurvey("rate_survey")
 
 if "count" not in st.session_state:
     st.session_state["count"] = 0
 
-if "step" not in st.session_state:
-    st.session_state["step"] = 1  # 1 = first page, 2 = second page
-
 group_no = 3
 
 
-def ten_radio(key: str, left_label: str | None = None, right_label: str | None = None):
-    val = st.radio(
-        "",
-        options=list(range(1, 11)),
-        horizontal=True,
-        index=None,
-        key=key,
-        label_visibility="collapsed",
-    )
-    if left_label and right_label:
-        st.info(f"1 = {left_label}, 10 = {right_label}")
-    return val
-
-def save_to_db():
+def save_to_db(answers: dict):
     # participant id
     if "participant_id" not in st.session_state:
         st.session_state["participant_id"] = insert_participant_and_get_id()
     participant_id = st.session_state["participant_id"]
 
-    # ---- Step-1 answers are frozen into ans_* when clicking Next
-    realness_scale = st.session_state.get("ans_realness_scale")
-
-    rf = st.session_state.get("ans_real_fake")
-    realness_perception = 1 if rf == "Real" else (0 if rf == "Fake" else None)
-
-  #  confident = st.session_state.get("ans_confident")
-  #  difficult_to_decide = st.session_state.get("ans_difficulty")
-    confident = None
-    difficult_to_decide = None
-    
-    # ---- Step-2 answers are read from the step-2 widgets
-    trust_content = st.session_state.get("key_trust_content")
-    trust_media = st.session_state.get("key_trust_media")
-
-    scam = st.session_state.get("key_scam")
-    
-    take_greenland = st.session_state.get("key_take_greenland")
-
-    check_val = st.session_state.get("key_check")
-    check_1 = True if check_val == 4 else False
-
-    open_ended_response = st.session_state.get("key_open_ended")
-
-    required = [
-        realness_scale,
-        realness_perception,
-       # confident,
-      #  difficult_to_decide,
-        trust_content,
-        trust_media,
-        scam,
-        take_greenland,
-        check_val,
+    # Same required lists and options the browser checked; the payload is not trusted blindly
+    gaps = [
+        label for step in STEPS
+        for label in questionnaire.missing(step, answers) + questionnaire.invalid(step, answers)
     ]
-
-    if not all(v is not None for v in required):
-        st.error("You missed required questions. Please answer everything before submitting.")
-        # Helpful debug so you see exactly what is missing
-        st.write("DEBUG required:", {
-            "realness_scale": realness_scale,
-            "realness_perception": realness_perception,
-            "confident": confident,
-            "difficult_to_decide": difficult_to_decide,
-            "trust_content": trust_content,
-            "trust_media": trust_media,
-            "scam": scam,
-            "take_greenland": take_greenland,
-            "check_val": check_val,
-        })
+    if gaps:
+        st.session_state["collector_gaps"] = gaps
         return False
 
+    rf = answers.get("key_real_fake")
+    realness_perception = 1 if rf == "Real" else (0 if rf == "Fake" else None)
+
     insert_rating_phase3(
         participant_id=participant_id,
         audio_clip_id=st.session_state["audio_clip_id"],
-        realness_scale=realness_scale,
+        realness_scale=answers.get("key_realness_scale"),
         realness_perception=realness_perception,
-        confident=confident,
-        difficult_to_decide=difficult_to_decide,
-        trust_content=trust_content,
-        trust_media=trust_media,
-        scam=scam,
-        take_greenland=take_greenland,
-        open_ended_response=open_ended_response,
-        check_1=check_1,
+        confident=None,
+        difficult_to_decide=None,
+        trust_content=answers.get("key_trust_content"),
+        trust_media=answers.get("key_trust_media"),
+        scam=answers.get("key_scam"),
+        take_greenland=answers.get("key_take_greenland"),
+        open_ended_response=answers.get("key_open_ended"),
+        check_1=answers.get("key_check") == 4,
         group_no=group_no,
     )
 
     st.session_state["count"] += 1
     return True
 
-AUDIO_SET_NO = 4      # this filters deepfakes.audio_clips.group_no
-with st.form(key="form_rating", clear_on_submit=False):
-    try:
-        # Fetch clip only when starting a new item
-        if st.session_state["step"] == 1 or "audio_clip_id" not in st.session_state:
-            with pool.connect() as db_conn:
-                query = text(
-                    """
-                    SELECT audio_clip_id, url, topic
-                    FROM deepfakes.audio_clips
-                    WHERE group_no = :audio_set_no
-                    ORDER BY RAND()
-                    LIMIT 1;
-                    """
-                )
-                row = db_conn.execute(query, {"audio_set_no": AUDIO_SET_NO}).fetchone()
-
-            if not row:
-                st.error("No audio found.")
-                st.stop()
-
-            audio_clip_id, url, topic = row
-            st.session_state["audio_clip_id"] = audio_clip_id
-            st.session_state["url"] = url
-
-        url = st.session_state["url"]
-
-        # ==================================================
-        # STEP 1 — Audio + Q1–Q4
-        # ==================================================
-        if st.session_state["step"] == 1:
-            st.warning(
-            "⚠️ Use Google Chrome. Answer every question before submitting. "
-            "If you skip any required question, you may lose answers for this clip."
-            )
-            st.markdown(
-                "<h4>🔊 Listen to the audio clip and answer the questions below.</h4>",
-                unsafe_allow_html=True,
-            )
-            st.audio(url, format="audio/wav")
-            st.info("❗If the audio isn't playing, refresh the page or try a different browser.")
-            st.markdown(f"⬇️ **Download the audio if the player fails:** [{url}]({url})")
-
-            st.divider()
-
-            st.markdown("<h5>❓Do you think the speech is real or fake?</h5>", unsafe_allow_html=True)
-            st.radio("", ["Real", "Fake"], horizontal=True, index=None, key="key_real_fake")
-
-            st.markdown("<h5>❓On a scale from fake to real, how would you rate this audio?</h5>", unsafe_allow_html=True)
-            ten_radio("key_realness_scale", "Definitely Fake", "Definitely Real")
-
-         #   st.markdown("<h5>❓How confident are you in your judgement?</h5>", unsafe_allow_html=True)
-        #    ten_radio("key_confident", "Not confident", "Extremely confident")
-
-           # st.markdown(
-            #    "<h5>❓How difficult was it for you to decide whether the audio was real or fake?</h5>",
-             #   unsafe_allow_html=True,
-         #   )
-         #   ten_radio("key_difficulty", "Very easy", "Very difficult")
-
-            next_clicked = st.form_submit_button("Next ➜")
+# This participant's clips, picked once from the catalog (playlist.py)
+try:
+    playlist.for_session(
+        st.session_state, pool, group_no, st.secrets.get("clips_per_participant", playlist.CLIPS_PER_PARTICIPANT)
+    )
+except SQLAlchemyError:
+    st.error(admission.UNREACHABLE)
+    st.stop()
+if playlist.finished(st.session_state):
+    st.switch_page("pages/Demographics.py")
+try:
+    # The playlist only moves on when count does
+    row = playlist.current(st.session_state)
 
-            if next_clicked:
-                required_step1 = [
-                    st.session_state.get("key_real_fake"),
-                    st.session_state.get("key_realness_scale"),
-                 #   st.session_state.get("key_confident"),
-                 #   st.session_state.get("key_difficulty"),
-                ]
-                if not all(v is not None for v in required_step1):
-                    st.error("Please answer all questions before continuing.")
-                else:
-                    # Freeze step-1 answers so they persist reliably into step-2 submission
-                    st.session_state["ans_real_fake"] = st.session_state.get("key_real_fake")
-                    st.session_state["ans_realness_scale"] = st.session_state.get("key_realness_scale")
-                  #  st.session_state["ans_confident"] = st.session_state.get("key_confident")
-                  #  st.session_state["ans_difficulty"] = st.session_state.get("key_difficulty")
+    if not row:
+        st.error("No audio found.")
+        st.stop()
 
-                    st.session_state["step"] = 2
-                    st.session_state["just_switched"] = True
-                    st.rerun()
+    audio_clip_id, url, topic = row
+    st.session_state["audio_clip_id"] = audio_clip_id
+    st.session_state["url"] = url
 
-        # ==================================================
-        # STEP 2 — Remaining questions + FAKE notice
-        # ==================================================
+    st.warning(
+        "⚠️ Use Google Chrome. Answer every question before submitting. "
+        "If you skip any required question, you may lose answers for this clip."
+    )
+    st.info("❗If the audio isn't playing, refresh the page or try a different browser.")
+    st.markdown(f"⬇️ **Download the audio if the player fails:** [{url}]({url})")
+    # Fetch the next clip's audio while this one is rated
+    st.markdown(playlist.preload_html(playlist.upcoming(st.session_state)), unsafe_allow_html=True)
+
+    # Both steps live in the browser; one rerun per clip, on submit
+    nonce = f"{audio_clip_id}-{st.session_state['count']}"
+    answers = answer_collector.collect(STEPS, url, topic, nonce)
+    # Load and audio timings from the participant's browser (rum.py); finds the player in the collector
+    rum.beacon("Rate_responses_phase3_T2", audio_clip_id, group_no, url)
+    if answers is not None:
+        db.start_deadline()
+        if save_to_db(answers):
+            answer_collector.done(nonce)
+            st.session_state.pop("audio_clip_id", None)
+            st.session_state.pop("url", None)
         else:
-            
-            st.toast("🚨 Warning: You listened to a fake (AI-generated) audio clip", icon="🚨")
-
-            st.markdown(
-                """
-                <div style="
-                    background:#fff0f0;
-                    border:3px solid red;
-                    padding:16px;
-                    font-size:24px;
-                    font-weight:900;
-                    text-align:center;
-                    border-radius:12px;
-                    margin-bottom:20px;">
-                    🚨 Warning: You listened to a fake (AI-generated) audio clip
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )            
-            
-            st.markdown("<h5>❓How much do you trust political audio content online?</h5>", unsafe_allow_html=True)
-            ten_radio("key_trust_content", "Not at all", "Completely")
-
-            st.markdown("<h5>❓How much do you trust online news media?</h5>", unsafe_allow_html=True)
-            ten_radio("key_trust_media", "Not at all", "Completely")
-                    # Q6B: Scam / Greenland
-            st.markdown(
-            "<h5>❓Do you support or oppose the U.S. using military force to take control of Greenland?</h5>",
-            unsafe_allow_html=True,
-            )
-            st.radio(
-                "",
-                options=["Support", "Oppose", "Not sure"],
-                horizontal=True,
-                index=None,
-                key="key_take_greenland",
-                label_visibility="collapsed",
-            )
-
-
-            st.markdown("<h7>I am reading carefully. Select 4 if yes.</h7>", unsafe_allow_html=True)
-            st.radio("", list(range(1, 11)), horizontal=True, index=None, key="key_check")
-
-            st.markdown("<h5>❓Have you fallen for misleading info online?</h5>", unsafe_allow_html=True)
-            st.radio("", ["Yes", "No", "Not sure"], horizontal=True, index=None, key="key_scam")
-            st.markdown(
-                """
-                <div style="
-                    background:#fff0f0;
-                    border:3px solid red;
-                    padding:16px;
-                    font-size:24px;
-                    font-weight:900;
-                    text-align:center;
-                    border-radius:12px;
-                    margin-bottom:20px;">
-                    🚨 Warning: You listened to a fake (AI-generated) audio clip
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )  
-            st.markdown("<h5>Optional</h5>", unsafe_allow_html=True)
-            st.text_area("Anything stand out?", key="key_open_ended")
-
-            submitted = st.form_submit_button("**Submit and View Next**")
-
-            if submitted:
-                ok = save_to_db()
-                if not ok:
-                    st.stop()
-
-                # reset UI state for next clip (only after successful DB insert)
-                st.session_state["step"] = 1
-
-                for k in [
-                    # step-2 widget keys
-                    "key_trust_content", "key_trust_media", "key_check", "key_scam", "key_open_ended",
-                    # frozen step-1 answers
-                    "ans_real_fake", "ans_realness_scale", "ans_confident", "ans_difficulty",
-                    # clip cache
-                    "audio_clip_id", "url",
-                    # step-1 widget keys (optional cleanup)
-                    "key_real_fake", "key_realness_scale", "key_confident", "key_difficulty",
-                ]:
-                    st.session_state.pop(k, None)
-
-                st.rerun()
+            # The collector marks these questions and keeps the other answers
+            answer_collector.reject(nonce, st.session_state.pop("collector_gaps"))
+        st.rerun()
 
-    except Exception as e:
-        st.error(f"Unexpected error: {e}")
+except Exception as e:
+    st.error(f"Unexpected error: {e}")
 
 # Finish / route
-if st.session_state["count"] < 1:
+if not playlist.finished(st.session_state):
     st.write("Please rate the audio and answer all required questions to finish the survey.")
-    st.write(f"You have rated {st.session_state['count']} audios so far.")
+    st.write(f"You have rated {st.session_state['count']} of {len(st.session_state['playlist'])} audios so far.")
 else:
     st.write("You have rated the audio and you can finish your participation now.")
     st.switch_page("pages/Demographics.py")
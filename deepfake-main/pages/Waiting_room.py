@@ -0,0 +1,41 @@
+import streamlit as st
+
+import admission
+
+# --------------------------------------------------------------------------------
+# Waiting room (admission.py). No database access here: this page is what
+# participants see while the database is already at capacity.
+# --------------------------------------------------------------------------------
+st.set_page_config(initial_sidebar_state="collapsed")
+
+st.markdown(
+    """
+    <style>
+        [data-testid="collapsedControl"] { display: none; }
+        [data-testid="stSidebar"] { display: none; }
+    </style>
+    """,
+    unsafe_allow_html=True,
+)
+
+if "admission" not in st.session_state or admission.admit(st.session_state):
+    st.switch_page(admission.return_page(st.session_state))
+
+st.title("Almost there! ⏳")
+st.write(
+    "Many participants are taking part right now. To keep the study running smoothly for everyone, "
+    "we let people in a few at a time. Please keep this tab open; you will be taken to the study automatically."
+)
+
+
+@st.fragment(run_every=3)
+def queue_position():
+    if admission.admit(st.session_state):
+        st.rerun()
+    where = admission.position(st.session_state)
+    col1, col2 = st.columns(2)
+    col1.metric("Participants ahead of you", where["ahead"])
+    col2.metric("Estimated wait", f"{max(where['wait_seconds'] // 60, 1)} min")
+
+
+queue_position()
@@ -0,0 +1,223 @@
+"""
+What each rerun of each page sends to the browser.
+
+Every widget click on a rating page reruns the script, and Streamlit sends the
+whole element tree again: the CSS blocks, the st.info captions, all of it. On a
+slow mobile link those bytes are the wait. With the meter on, every ForwardMsg a
+session enqueues is measured (serialized protobuf size) and grouped per script
+run. One JSON line per run goes to payload/<host>-<pid>.jsonl:
+
+    page, full or fragment run, bytes, messages, and per element type
+    (radio, alert = st.info/warning, markdown, markdown:style = <style> blocks,
+    ...) the count and bytes, plus bytes of elements repeated in the same run
+
+Turn it on per worker (serve.py passes the flag through):
+
+    python worker.py app.py --payload-meter
+    python serve.py --workers 2 --payload-meter
+
+and read it back:
+
+    python payload_meter.py report
+    python payload_meter.py report --kbps 400 --csv payload.csv
+
+Sizes are before Streamlit's websocket message cache, i.e. what a browser
+without a warm cache downloads.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+PAYLOAD_DIR = Path(__file__).resolve().parent / "payload"
+SLOW_LINK_KBPS = 400    # a poor mobile connection
+
+log = logging.getLogger("payload_meter")
+
+
+def element_kind(msg) -> str:
+    kind = msg.WhichOneof("type")
+    if kind != "delta":
+        return kind
+    delta_kind = msg.delta.WhichOneof("type")
+    if delta_kind != "new_element":
+        return delta_kind
+    element = msg.delta.new_element
+    element_type = element.WhichOneof("type")
+    if element_type == "markdown" and "<style" in element.markdown.body:
+        return "markdown:style"
+    return element_type
+
+
+# --------------------------------------------------------------------------------
+# Recording
+# --------------------------------------------------------------------------------
+class Meter:
+    def __init__(self, directory=None):
+        self.directory = Path(directory or PAYLOAD_DIR)
+        self.pages = {}    # page_script_hash -> page name
+        self.runs = {}     # session id -> run being recorded
+        self._lock = threading.Lock()
+
+    def path(self) -> Path:
+        return self.directory / f"{socket.gethostname()}-{os.getpid()}.jsonl"
+
+    def observe(self, session_id: str, msg):
+        kind = msg.WhichOneof("type")
+        if kind == "new_session":
+            new_session = msg.new_session
+            for page in new_session.app_pages:
+                self.pages[page.page_script_hash] = page.page_name
+            self.runs[session_id] = {
+                "at": time.time(),
+                "session": session_id,
+                "page": self.pages.get(new_session.page_script_hash) or Path(new_session.main_script_path).stem,
+                "fragment": bool(new_session.fragment_ids_this_run),
+                "bytes": 0,
+                "messages": 0,
+                "repeated_bytes": 0,
+                "elements": defaultdict(lambda: [0, 0]),
+                "_seen": set(),
+            }
+        run = self.runs.get(session_id)
+        if run is None:
+            return
+        size = msg.ByteSize()
+        run["bytes"] += size
+        run["messages"] += 1
+        counts = run["elements"][element_kind(msg)]
+        counts[0] += 1
+        counts[1] += size
+        if kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+            digest = hashlib.blake2b(msg.delta.new_element.SerializeToString(), digest_size=8).digest()
+            if digest in run["_seen"]:
+                run["repeated_bytes"] += size
+            run["_seen"].add(digest)
+        if kind == "script_finished":
+            self.runs.pop(session_id, None)
+            self._write(run)
+
+    def forget(self, session_id: str):
+        """The session is gone; a run it left unfinished is never written."""
+        self.runs.pop(session_id, None)
+
+    def _write(self, run: dict):
+        run.pop("_seen")
+        run["elements"] = dict(run["elements"])
+        line = json.dumps(run) + "\n"
+        with self._lock:
+            self.directory.mkdir(exist_ok=True)
+            with open(self.path(), "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def install(directory=None) -> Meter:
+    """Measure every ForwardMsg of every session in this process. Call before streamlit starts."""
+    from streamlit.runtime.app_session import AppSession
+
+    meter = Meter(directory)
+    original = AppSession._enqueue_forward_msg
+
+    def _enqueue_forward_msg(self, msg):
+        # A measuring bug must never keep a message from the browser.
+        try:
+            meter.observe(self.id, msg)
+        except Exception:
+            log.exception("payload meter failed on a %s message", msg.WhichOneof("type"))
+        original(self, msg)
+
+    original_shutdown = AppSession.shutdown
+
+    def shutdown(self):
+        # Sessions that disconnect or are reaped mid-run never send script_finished
+        meter.forget(self.id)
+        original_shutdown(self)
+
+    AppSession._enqueue_forward_msg = _enqueue_forward_msg
+    AppSession.shutdown = shutdown
+    return meter
+
+
+# --------------------------------------------------------------------------------
+# Report
+# --------------------------------------------------------------------------------
+def load(directory=None) -> list:
+    directory = Path(directory or PAYLOAD_DIR)
+    runs = []
+    for path in sorted(directory.glob("*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            runs.extend(json.loads(line) for line in f if line.strip())
+    return runs
+
+
+def report(runs: list, kbps: float = SLOW_LINK_KBPS) -> list:
+    """One row per (page, run kind, element type), averaged per run."""
+    groups = defaultdict(list)
+    for run in runs:
+        groups[(run["page"], "fragment" if run["fragment"] else "full")].append(run)
+    rows = []
+    for (page, run_kind), group in sorted(groups.items()):
+        sizes = np.array([run["bytes"] for run in group])
+        totals = defaultdict(lambda: [0, 0])
+        for run in group:
+            for element, (count, size) in run["elements"].items():
+                totals[element][0] += count
+                totals[element][1] += size
+        summary = {
+            "page": page,
+            "run": run_kind,
+            "reruns": len(group),
+            "kb_median": np.median(sizes) / 1024,
+            "kb_p95": np.percentile(sizes, 95) / 1024,
+            "repeated_kb": np.mean([run["repeated_bytes"] for run in group]) / 1024,
+            "seconds_at_link": np.median(sizes) * 8 / (kbps * 1000),
+        }
+        for element, (count, size) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            rows.append({
+                **summary,
+                "element": element,
+                "count_per_run": count / len(group),
+                "kb_per_run": size / len(group) / 1024,
+                "share": size / sizes.sum() if sizes.sum() else 0.0,
+            })
+    return rows
+
+
+def print_report(rows: list, kbps: float):
+    last = None
+    for row in rows:
+        if (row["page"], row["run"]) != last:
+            last = (row["page"], row["run"])
+            print(f"\n{row['page']} ({row['run']} runs: {row['reruns']})  "
+                  f"median {row['kb_median']:.1f} KB, p95 {row['kb_p95']:.1f} KB, "
+                  f"repeated {row['repeated_kb']:.1f} KB, {row['seconds_at_link']:.2f}s at {kbps:g} kbit/s")
+            print(f"  {'element':<24} {'per run':>8} {'KB/run':>8} {'share':>6}")
+        print(f"  {row['element']:<24} {row['count_per_run']:>8.1f} {row['kb_per_run']:>8.2f} {row['share']:>6.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--dir", help=f"where the .jsonl files are (default {PAYLOAD_DIR})")
+    parser.add_argument("--kbps", type=float, default=SLOW_LINK_KBPS, help="link speed for the download estimate")
+    parser.add_argument("--csv", help="also write the rows to this CSV file")
+    args = parser.parse_args()
+
+    rows = report(load(args.dir), args.kbps)
+    if not rows:
+        raise SystemExit("no runs recorded; start the workers with --payload-meter")
+    print_report(rows, args.kbps)
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,74 @@
+"""
+The clips one participant rates, picked once when they reach a rating page.
+
+The rating pages used to draw a fresh clip on every render and route to
+Demographics after the first rating (`count >= 1`). Now build() picks the whole
+sequence up front from the in-process catalog (catalog.py). Showing the next clip
+costs no query. While the current clip is being rated, preload_html() lets the
+browser fetch the next one's audio.
+
+Selection is counterbalanced over the study: the K clips with the fewest ratings
+in the participant's arm so far (shared_state.py counts), ties broken at random.
+The order is the chosen clips rotated by participant_id, so each clip appears in
+each position equally often.
+
+K is `clips_per_participant` in secrets.toml; the default keeps the one-clip
+design.
+"""
+import html
+import random
+from typing import Optional
+
+import numpy as np
+
+import catalog
+import shared_state
+
+CLIPS_PER_PARTICIPANT = 1
+
+
+def build(engine, arm: int, k: int = CLIPS_PER_PARTICIPANT, participant_id=None,
+          audio_set_no: int = catalog.AUDIO_SET_NO) -> list:
+    available = catalog.clips(engine, audio_set_no)
+    if not available:
+        return []
+    k = max(1, min(int(k), len(available)))
+    ids = np.array([clip.audio_clip_id for clip in available])
+    in_range = (ids > 0) & (ids < shared_state.MAX_CLIP_ID)
+    ratings = np.zeros(len(ids), dtype=np.int64)
+    ratings[in_range] = shared_state.get_shared_state().clips[ids[in_range], arm]
+    # Fewest ratings first; the random key spreads concurrent participants over ties.
+    order = np.lexsort((np.random.random(len(ids)), ratings))
+    chosen = sorted((available[i] for i in order[:k]), key=lambda clip: clip.audio_clip_id)
+    shift = (participant_id if participant_id is not None else random.randrange(k)) % k
+    return chosen[shift:] + chosen[:shift]
+
+
+def for_session(session, engine, arm: int, k: int = CLIPS_PER_PARTICIPANT) -> list:
+    """The session's playlist (st.session_state["playlist"]), built on first use."""
+    if not session.get("playlist"):
+        session["playlist"] = build(engine, arm, k, session.get("participant_id"))
+    return session["playlist"]
+
+
+def current(session) -> Optional[catalog.Clip]:
+    """The clip to rate now, or None once the playlist is done."""
+    clips, done = session.get("playlist") or [], session.get("count", 0)
+    return clips[done] if done < len(clips) else None
+
+
+def upcoming(session) -> Optional[catalog.Clip]:
+    clips, done = session.get("playlist") or [], session.get("count", 0)
+    return clips[done + 1] if done + 1 < len(clips) else None
+
+
+def finished(session) -> bool:
+    clips = session.get("playlist")
+    return bool(clips) and session.get("count", 0) >= len(clips)
+
+
+def preload_html(clip: Optional[catalog.Clip]) -> str:
+    """Hidden audio element that makes the browser fetch clip ahead of time."""
+    if clip is None:
+        return ""
+    return f'<audio preload="auto" src="{html.escape(clip.url, quote=True)}" style="display:none"></audio>'
@@ -0,0 +1,225 @@
+"""
+Stack samples of a fraction of script reruns, for flame graphs.
+
+Timing spans say which rerun was slow, not where the CPU went inside it.
+Profiling every rerun would slow every participant down. With this on, a
+worker profiles a configurable share of the reruns of each page: a thread
+samples the script thread's stack every --profile-interval ms while the run
+lasts. Each profiled run is written to profiles/ as one JSON file with page,
+rerun cause (load, navigation, widget, button, fragment, auto), duration and
+the sampled stacks. Only the newest MAX_FILES are kept.
+
+    python worker.py app.py --profile Rate_responses=0.2 --profile Demographics=0.2
+    python serve.py --workers 2 --profile 0.02          # every page, 2% of reruns
+
+Read them back:
+
+    python profiling.py list                            # runs per page and cause
+    python profiling.py list --top 15                   # plus the hottest functions
+    python profiling.py merge --page Rate_responses > rate.folded
+    flamegraph.pl rate.folded > rate.svg                # or open it in speedscope
+
+Stacks start at the first frame from the app folder; runs that never reached
+app code (e.g. Streamlit's own work) are under "(streamlit)". A run that calls
+st.rerun() or st.switch_page() is profiled as one run together with the run it
+starts.
+"""
+import argparse
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+APP_DIR = Path(__file__).resolve().parent
+PROFILE_DIR = APP_DIR / "profiles"
+INTERVAL_MS = 5
+MAX_FILES = 2000
+
+
+def parse_rates(specs) -> dict:
+    """["Rate_responses=0.2", "0.01"] -> {"Rate_responses": 0.2, "*": 0.01}"""
+    rates = {}
+    for spec in specs or ():
+        page, _, rate = spec.rpartition("=")
+        rates[page or "*"] = float(rate)
+    return rates
+
+
+def rerun_cause(rerun_data) -> str:
+    if rerun_data.is_auto_rerun:
+        return "auto"
+    if rerun_data.fragment_id_queue:
+        return "fragment"
+    widgets = rerun_data.widget_states.widgets if rerun_data.widget_states else ()
+    if any(w.WhichOneof("value") == "trigger_value" and w.trigger_value for w in widgets):
+        return "button"
+    if widgets:
+        return "widget"
+    if rerun_data.page_script_hash or rerun_data.page_name:
+        return "navigation"
+    return "load"
+
+
+def _stack(frame) -> str:
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    start = next((i for i, f in enumerate(frames) if f.f_code.co_filename.startswith(str(APP_DIR))), None)
+    if start is None:
+        frames, prefix = frames[-3:], ["(streamlit)"]
+    else:
+        frames, prefix = frames[start:], []
+    return ";".join(prefix + [f"{Path(f.f_code.co_filename).name}:{f.f_code.co_name}" for f in frames])
+
+
+# --------------------------------------------------------------------------------
+# Recording
+# --------------------------------------------------------------------------------
+class Profiler:
+    def __init__(self, rates: dict, directory=None, interval_ms: float = INTERVAL_MS, keep: int = MAX_FILES):
+        self.rates = rates
+        self.directory = Path(directory or PROFILE_DIR)
+        self.interval = interval_ms / 1000
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def rate(self, page: str) -> float:
+        return self.rates.get(page, self.rates.get("*", 0.0))
+
+    def _sample(self, thread_id: int, stop: threading.Event, stacks: Counter):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[_stack(frame)] += 1
+
+    def run(self, page: str, cause: str, fn, *args):
+        """Call fn(*args) in this thread, sampled if page's rate says so."""
+        if random.random() >= self.rate(page):
+            return fn(*args)
+        stacks, stop = Counter(), threading.Event()
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), stop, stacks), name="profiler", daemon=True
+        )
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            return fn(*args)
+        finally:
+            stop.set()
+            sampler.join()
+            self._write({
+                "at": time.time(),
+                "host": socket.gethostname(),
+                "page": page,
+                "cause": cause,
+                "duration_ms": (time.perf_counter() - started) * 1000,
+                "interval_ms": self.interval * 1000,
+                "stacks": dict(stacks),
+            })
+
+    def _write(self, record: dict):
+        name = f"{int(record['at'] * 1000)}-{record['page']}-{record['cause']}-{record['duration_ms']:.0f}ms.json"
+        with self._lock:
+            self.directory.mkdir(exist_ok=True)
+            (self.directory / name).write_text(json.dumps(record), encoding="utf-8")
+            files = sorted(self.directory.glob("*.json"))
+            for old in files[: max(0, len(files) - self.keep)]:
+                old.unlink(missing_ok=True)
+
+
+def _page_name(runner, rerun_data) -> str:
+    pages = runner._pages_manager.get_pages()
+    page_hash = rerun_data.page_script_hash or runner._pages_manager.current_page_script_hash
+    page = pages.get(page_hash) or pages.get(runner._pages_manager.main_script_hash) or {}
+    return page.get("page_name") or rerun_data.page_name or Path(runner._pages_manager.main_script_path).stem
+
+
+def install(rates: dict, directory=None, interval_ms: float = INTERVAL_MS) -> Profiler:
+    """Profile a share of the script runs in this process. Call before streamlit starts."""
+    from streamlit.runtime.scriptrunner.script_runner import ScriptRunner
+
+    profiler = Profiler(rates, directory, interval_ms)
+    original = ScriptRunner._run_script
+
+    def _run_script(self, rerun_data):
+        return profiler.run(_page_name(self, rerun_data), rerun_cause(rerun_data), original, self, rerun_data)
+
+    ScriptRunner._run_script = _run_script
+    return profiler
+
+
+# --------------------------------------------------------------------------------
+# Reading back
+# --------------------------------------------------------------------------------
+def load(directory=None, page=None, cause=None, min_ms: float = 0) -> list:
+    runs = []
+    for path in sorted(Path(directory or PROFILE_DIR).glob("*.json")):
+        run = json.loads(path.read_text(encoding="utf-8"))
+        if (page is None or run["page"] == page) and (cause is None or run["cause"] == cause) \
+                and run["duration_ms"] >= min_ms:
+            runs.append(run)
+    return runs
+
+
+def merge(runs: list) -> Counter:
+    """All stacks of runs, summed: the collapsed ("folded") input of flame graph tools."""
+    stacks = Counter()
+    for run in runs:
+        stacks.update(run["stacks"])
+    return stacks
+
+
+def summary(runs: list, top: int = 0):
+    groups = defaultdict(list)
+    for run in runs:
+        groups[(run["page"], run["cause"])].append(run)
+    print(f"{'page':<28} {'cause':<11} {'runs':>5} {'ms median':>9} {'ms p95':>8} {'samples':>8}")
+    for (page, cause), group in sorted(groups.items()):
+        durations = np.array([run["duration_ms"] for run in group])
+        samples = sum(sum(run["stacks"].values()) for run in group)
+        print(f"{page:<28} {cause:<11} {len(group):>5} {np.median(durations):>9.1f} "
+              f"{np.percentile(durations, 95):>8.1f} {samples:>8}")
+    if top:
+        stacks = merge(runs)
+        total = sum(stacks.values()) or 1
+        own, inclusive = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        print(f"\n{'function':<60} {'self':>6} {'total':>6}")
+        for frame, count in own.most_common(top):
+            print(f"{frame[:60]:<60} {count / total:>6.1%} {inclusive[frame] / total:>6.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["list", "merge"])
+    parser.add_argument("--dir", help=f"where the profiles are (default {PROFILE_DIR})")
+    parser.add_argument("--page")
+    parser.add_argument("--cause")
+    parser.add_argument("--min-ms", type=float, default=0, help="only runs at least this slow")
+    parser.add_argument("--top", type=int, default=0, help="list: also show the N functions with most self time")
+    parser.add_argument("--out", help="merge: write here instead of stdout")
+    args = parser.parse_args()
+
+    runs = load(args.dir, args.page, args.cause, args.min_ms)
+    if not runs:
+        raise SystemExit("no profiles match; start the workers with --profile")
+    if args.command == "list":
+        summary(runs, args.top)
+    else:
+        lines = [f"{stack} {count}\n" for stack, count in sorted(merge(runs).items())]
+        if args.out:
+            Path(args.out).write_text("".join(lines), encoding="utf-8")
+        else:
+            sys.stdout.writelines(lines)
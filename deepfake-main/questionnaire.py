@@ -0,0 +1,302 @@
+"""
+The phase-2 rating questionnaire (pages/Rate_responses.py) as data, and two
+ways to render it.
+
+render_sections() is what the page uses. It shows one section at a time
+(pre-listen, emotions, perception, authenticity, sharing, post-listen) inside
+an st.fragment, with the section's questions in a form. Answering reruns
+nothing; Back and Next rerun only the fragment and send only that section's
+elements, while the header, the CSS and the rest of the page stay as they are. Answers are kept server-side in st.session_state, so going Back, a
+missing answer or a Streamlit widget cleanup never loses what was entered.
+Next only checks the section on screen.
+
+render_form() is the old single st.form with every question, kept as the
+baseline for benchmarks/bench_questionnaire.py.
+"""
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import streamlit as st
+
+import encoding
+
+SCALE = list(range(1, 11))
+TEXT_LIMIT = 5000       # characters kept from a free-text answer
+
+
+@dataclass(frozen=True)
+class Question:
+    key: str                          # st.session_state key, read by save_to_db
+    prompt: Optional[str]             # HTML, {topic} is filled in; None for no heading
+    kind: str = "scale"               # scale | radio | multiselect | checkbox | text
+    options: tuple = ()
+    caption: Optional[str] = None     # st.info under the widget
+    label: str = ""                   # widget label (checkbox, text) / name in the missing list
+    required: bool = True
+    help: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Section:
+    name: str
+    title: str
+    questions: tuple
+    intro: Optional[str] = None       # HTML shown above the questions
+    audio: bool = False               # show the clip's player in this section
+
+
+NOT_AT_ALL = "1 = Not at all, 10 = Extremely"
+IMPORTANCE = "1 = Not important at all, 10 = Extremely important"
+STANCE = "1 = Supports more open policies, 10 = Supports stricter policies"
+AGREE = "1 = Strongly Disagree, 10 = Strongly Agree"
+MIP = "❓What is the most important problem facing the US right now? (Select all that apply)"
+
+SECTIONS = (
+    Section("pre_listen", "Before listening", (
+        Question("key_mip_topics_before", MIP, "multiselect", tuple(encoding.TOPICS),
+                 label="Select the most important problem(s) BEFORE listening"),
+        Question("key_salience_before", "❓ How important is this topic (<i>{topic}</i>) to you?",
+                 caption=IMPORTANCE, label="Rate the topic importance BEFORE listening"),
+        Question("key_stance_before", "❓ What is <i>your personal stance</i> on this topic (<i>{topic}</i>)?",
+                 caption=STANCE, label="State your personal stance BEFORE listening"),
+    )),
+    Section("emotions", "Listen and react", (
+        Question("key_em_anger", "<b>😡 Anger</b>", caption=NOT_AT_ALL, label="Rate your felt Anger"),
+        Question("key_em_fear", "<b>😨 Fear</b>", caption=NOT_AT_ALL, label="Rate your felt Fear"),
+        Question("key_em_enthusiasm", "<b>🤩 Enthusiasm</b>", caption=NOT_AT_ALL, label="Rate your felt Enthusiasm"),
+        Question("key_em_pride", "<b>🦅 Pride</b>", caption=NOT_AT_ALL, label="Rate your felt Pride"),
+        Question("key_perceived_threat", "❓How much do you think this issue threatens your country?",
+                 caption=NOT_AT_ALL, label="Rate national threat"),
+        Question("key_identity_threat",
+                 "❓How much does the topic in this clip disrespect your social or political group?",
+                 caption=NOT_AT_ALL, label="Rate identity disrespect"),
+    ), intro="🔊 Listen to the audio clip of Kamala Harris or Donald Trump. "
+             "Answer the 4 sub questions. While listening to the clip, I felt...", audio=True),
+    Section("perception", "The candidate and the speech", (
+        Question("key_q0", "❓What do you think the candidate’s position on this issue is?",
+                 caption=STANCE, label="Select the candidate’s position"),
+        Question("key_persuasion", "❓ How much do you agree with the candidate’s position on this issue?",
+                 caption=AGREE, label="Agreement with the candidate’s position"),
+        Question("key_q1", "❓How clear was the speech?",
+                 caption="Clarity refers to how easily the speech can be understood. 1 = Not at all, 10 = Extremely",
+                 label="Rate speech clarity"),
+        Question("key_q2", "❓How persuasive was the speech?",
+                 caption="Persuasiveness refers to how convincing the speech felt. 1 = Not at all, 10 = Extremely",
+                 label="Rate speech persuasiveness"),
+        Question("key_q3", "❓Was the pace of the speech engaging or distracting?",
+                 caption="1 = Distracting, 10 = Engaging", label="Rate pace (engaging vs distracting)"),
+        Question("key_q4", "❓To what extent did the speaker seem trustworthy?",
+                 caption=NOT_AT_ALL, label="Rate speaker trustworthiness"),
+        Question("key_q5", "❓To what extent did you find the content of the speech trustworthy?",
+                 caption=NOT_AT_ALL, label="Rate content trustworthiness"),
+        Question("key_q6", "❓How would you rate the speaker’s competence?",
+                 caption="1 = Incompetent, 10 = Expert", label="Rate speaker competence"),
+        Question("key_q7", "❓How did the speed affect your understanding?",
+                 caption="1 = Confusing, 10 = Clear", label="Speed effect on understanding"),
+        Question("key_q8", "❓Variations in pitch affected the speaker’s sincerity?",
+                 caption=NOT_AT_ALL, label="Pitch effect on sincerity"),
+        Question("key_q9", "❓Changes in loudness and emphasis grabbed my attention.",
+                 caption="1 = Not at all, 10 = Completely", label="Loudness/emphasis effect"),
+    ), audio=True),
+    Section("authenticity", "Real or fake?", (
+        Question("key_q11", "❓Do you think the speech is real or fake?", "radio", ("Real", "Fake"),
+                 label="Real or Fake choice"),
+        Question("key_q12", "❓What influenced your judgment about the authenticity of the clip? "
+                            "(Check all that apply, or leave blank if none)",
+                 "checkbox", label="The speaker’s tone of voice", required=False),
+        Question("key_q13", None, "checkbox", label="The audio quality", required=False),
+        Question("key_q14", None, "checkbox", label="The content of the audio clip", required=False),
+        Question("key_q10", "❓On a scale from fake to real, how would you rate this audio?",
+                 caption="1 = Definitely Fake, 10 = Definitely Real", label="Fake→Real scale"),
+        Question("key_q15", "❓ How confident are you that this audio clip is real/fake?",
+                 caption="1 = Not at all, 10 = Completely", label="Confidence in authenticity judgment"),
+        Question("key_check", "I am carefully rating, select 4 if yes.", required=False),
+        Question("key_q16", "❓To what extent do you agree with the policy in the audio clip?",
+                 caption=AGREE, label="Agreement with policy"),
+    ), audio=True),
+    Section("sharing", "Voting and sharing", (
+        Question("key_q17", "❓Based on the speech you just heard, how likely are you to vote for this person?",
+                 caption="1 = Not at all, 10 = Very Much", label="Likelihood to vote"),
+        Question("key_cons", "❓How consistent do you think the candidate’s statements and actions are on this issue?",
+                 caption="1 = Not at all, 10 = Very much", label="Consistency of the candidate"),
+        Question("key_align",
+                 "❓From the audio clip, to what extent do you feel the candidate’s stance aligns with your own views?",
+                 caption="1 = Strongly Opposed, 10 = Strongly Aligned", label="Alignment with your views"),
+        Question("key_conf", "❓How confident are you in your assessment of the candidate’s position?",
+                 caption="1 = Not Confident, 10 = Strongly Confident", label="Confidence in the candidate’s position"),
+        Question("key_q19_private",
+                 "❓How likely are you to share this clip <i>privately</i> (📩🔒 WhatsApp, DM)?",
+                 caption="1 = Not at all , 10 = Very Likely", label="Likelihood to share privately"),
+        Question("key_q20_public",
+                 "❓How likely are you to share this clip <i>publicly</i> (📢 social media post/story)?",
+                 caption="1 = Not at all , 10 = Very Likely", label="Likelihood to share publicly"),
+        Question("key_q21_report", "❓Would you report this clip as misleading on platform 🆇 (Twitter)?",
+                 "radio", ("Yes", "No"), label="Would you report as misleading?"),
+        Question("key_q22_downrank",
+                 "❓ Platforms should downrank content flagged as AI-generated even if not deceptive.",
+                 caption=AGREE, label="Downrank AI-generated content policy"),
+        Question("key_q23_watermark", "❓If a watermark indicated this was synthetic, I would…",
+                 caption="1 = Completely Ignore, 10 = Strongly report as misleading",
+                 label="Action if watermark indicates synthetic"),
+    )),
+    Section("post_listen", "After listening", (
+        Question("key_mip_topics", MIP, "multiselect", tuple(encoding.TOPICS),
+                 label="Select the most important problem(s) AFTER listening"),
+        Question("key_salience_topic_after", "❓ How important is this topic (<i>{topic}</i>) to you?",
+                 caption=IMPORTANCE, label="Rate topic importance AFTER listening"),
+        Question("key_stance_after", "❓ What is <i>your personal stance</i> on this topic (<i>{topic}</i>)?",
+                 caption=STANCE, label="State your personal stance AFTER listening"),
+        Question("key_q18", "Optional Open-Ended Question", "text",
+                 label="Did anything stand out or seem interesting to you? If so, why?", required=False,
+                 help="Feel free to share any thoughts or impressions you found particularly interesting about the audio."),
+    )),
+)
+
+ANSWERS_KEY = "questionnaire_answers"
+SECTION_KEY = "questionnaire_section"
+GAPS_KEY = "questionnaire_gaps"
+SUBMITTED_KEY = "questionnaire_submitted"
+
+
+# --------------------------------------------------------------------------------
+# Widgets
+# --------------------------------------------------------------------------------
+def _widget(question: Question, topic: str):
+    if question.prompt:
+        st.markdown(f"<h5>{question.prompt.format(topic=topic)}</h5>", unsafe_allow_html=True)
+    if question.kind == "scale" or question.kind == "radio":
+        value = st.radio(question.label or question.key, options=list(question.options) or SCALE,
+                         horizontal=True, index=None, key=question.key, label_visibility="collapsed")
+    elif question.kind == "multiselect":
+        value = st.multiselect(question.label, list(question.options), key=question.key,
+                               label_visibility="collapsed")
+    elif question.kind == "checkbox":
+        value = st.checkbox(question.label, key=question.key)
+    elif question.kind == "text":
+        value = st.text_area(question.label, key=question.key, help=question.help)
+    else:
+        raise ValueError(f"unknown question kind {question.kind!r}")
+    if question.caption:
+        st.info(question.caption)
+    return value
+
+
+def missing(section: Section, answers: dict) -> list:
+    """Labels of the required questions in section that have no answer."""
+    return [
+        q.label for q in section.questions
+        if q.required and (answers.get(q.key) is None or answers.get(q.key) == [])
+    ]
+
+
+def _allowed(question: Question, value) -> bool:
+    if question.kind == "scale":
+        return type(value) is int and value in SCALE
+    if question.kind == "radio":
+        return value in question.options
+    if question.kind == "multiselect":
+        return isinstance(value, list) and all(v in question.options for v in value)
+    if question.kind == "checkbox":
+        return isinstance(value, bool)
+    return isinstance(value, str) and len(value) <= TEXT_LIMIT
+
+
+def invalid(section: Section, answers: dict) -> list:
+    """Labels of the questions in section whose answer is not one of its options (or SCALE)."""
+    return [
+        q.label for q in section.questions
+        if answers.get(q.key) is not None and not _allowed(q, answers.get(q.key))
+    ]
+
+
+def answers(session) -> dict:
+    """Everything answered so far in the sectioned questionnaire."""
+    return session.setdefault(ANSWERS_KEY, {})
+
+
+# --------------------------------------------------------------------------------
+# Renderers
+# --------------------------------------------------------------------------------
+def render_sections(topic: str, audio_url: str, on_submit: Callable[[dict], None], sections=SECTIONS):
+    """
+    One section at a time in a fragment. on_submit(answers) runs after the last
+    section is complete; the whole page then reruns so it can route.
+    """
+    st.session_state.setdefault(SECTION_KEY, 0)
+
+    def keep(section):
+        saved = answers(st.session_state)
+        for question in section.questions:
+            saved[question.key] = st.session_state.get(question.key)
+        return saved
+
+    def back():
+        keep(sections[st.session_state[SECTION_KEY]])
+        st.session_state[SECTION_KEY] -= 1
+
+    def forward():
+        # Callbacks run before the fragment does, so it renders the new section in one go.
+        index = st.session_state[SECTION_KEY]
+        saved = keep(sections[index])
+        st.session_state[GAPS_KEY] = missing(sections[index], saved)
+        if st.session_state[GAPS_KEY]:
+            return
+        if index < len(sections) - 1:
+            st.session_state[SECTION_KEY] = index + 1
+            return
+        on_submit(dict(saved))
+        saved.clear()
+        st.session_state[SECTION_KEY] = 0
+        st.session_state[SUBMITTED_KEY] = True
+
+    @st.fragment
+    def questionnaire():
+        if st.session_state.pop(SUBMITTED_KEY, False):
+            st.rerun()  # the page decides what comes after a submitted clip
+        saved = answers(st.session_state)
+        index = st.session_state[SECTION_KEY]
+        section = sections[index]
+        st.progress(index / len(sections), text=f"Part {index + 1} of {len(sections)}: {section.title}")
+        if section.intro:
+            st.markdown(f"<h5>{section.intro}</h5>", unsafe_allow_html=True)
+        if section.audio:
+            st.audio(audio_url, format="audio/wav")
+
+        # A form per section: answering does not rerun anything, Back/Next rerun the fragment.
+        with st.form(f"questionnaire_{section.name}", border=False):
+            for question in section.questions:
+                # Widgets of a section that was not on screen were cleaned up; give their answers back.
+                if question.key not in st.session_state and saved.get(question.key) is not None:
+                    st.session_state[question.key] = saved[question.key]
+                _widget(question, topic)
+
+            gaps = st.session_state.pop(GAPS_KEY, None)
+            if gaps:
+                st.error("Please answer these before you go on (your other answers are kept):\n\n"
+                         + "\n".join(f"- {label}" for label in gaps))
+            last = index == len(sections) - 1
+            left, right = st.columns(2)
+            if index > 0:
+                left.form_submit_button("Back", key=f"{SECTION_KEY}_back", on_click=back)
+            right.form_submit_button("**Submit and View Next**" if last else "Next", key=f"{SECTION_KEY}_next",
+                                     type="primary", on_click=forward)
+
+    questionnaire()
+
+
+def render_form(topic: str, audio_url: str, on_submit: Callable[[dict], None], sections=SECTIONS):
+    """The previous layout: every question in one st.form, cleared on submit."""
+
+    def submitted():
+        on_submit({q.key: st.session_state.get(q.key) for section in sections for q in section.questions})
+
+    with st.form(key="form_rating", clear_on_submit=True):
+        for section in sections:
+            if section.intro:
+                st.markdown(f"<h5>{section.intro}</h5>", unsafe_allow_html=True)
+            if section.audio and section is next(s for s in sections if s.audio):
+                st.audio(audio_url, format="audio/wav")
+            for question in section.questions:
+                _widget(question, topic)
+            st.success("######")
+        st.form_submit_button("**Submit and View Next**", on_click=submitted)
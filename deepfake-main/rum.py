@@ -0,0 +1,272 @@
+"""
+How fast pages and clips load in participants' browsers (real-user monitoring).
+
+Until now slow audio only showed up as free-text complaints. beacon() puts a tiny
+script next to the player on the rating pages. It measures in the browser and
+reports with navigator.sendBeacon to /rum, which serve.py answers:
+
+    render_ms       page load to beacon (first page of a tab), or previous
+                    clip's Submit to this page rendered (later clips)
+    fcp_ms          first contentful paint of the tab (first page only)
+    canplay_ms      page rendered to the player's canplay
+    play_latency_ms play pressed to sound playing, first play
+    stalls/stall_ms waiting events after playback started, and their total time
+    time_on_page_ms page rendered to leaving it (Submit, tab hidden or closed)
+    audio_error     MediaError code if the player failed
+
+tagged with page, audio_clip_id, arm (group_no) and the host of the clip URL. A
+view reports again when the tab is hidden; the report keeps its last report.
+Lines go to rum/<host>-<pid>.jsonl. /rum is on the public port and takes
+no login, so a beacon keeps only the fields above with the expected types, a
+client gets MAX_BEACONS_PER_MINUTE, and a file stops growing at MAX_FILE_BYTES.
+Read them back with
+
+    python rum.py report                   # per page and arm
+    python rum.py report --by host         # clip hosting
+    python rum.py report --by clip --csv rum.csv
+
+--by page also prints the median rerun size from payload_meter.py when that
+ran, so page weight and drop-off sit in one table. With a plain `streamlit run`
+there is no /rum and the browser's beacons are dropped.
+"""
+import argparse
+import csv
+import json
+import os
+import socket
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlparse
+
+import numpy as np
+from tornado import web
+
+RUM_DIR = Path(__file__).resolve().parent / "rum"
+MAX_BEACON_BYTES = 4096
+MAX_FILE_BYTES = 50 * 1024 * 1024
+MAX_BEACONS_PER_MINUTE = 60
+METRICS = ("render_ms", "fcp_ms", "canplay_ms", "play_latency_ms", "stalls", "stall_ms", "time_on_page_ms")
+PERCENTILES = (50, 90, 99)
+# Everything else a beacon may carry, with its type
+TAGS = {"view": str, "page": str, "clip_host": str, "audio_clip_id": int, "arm": int, "audio_error": int}
+MAX_TAG_CHARS = 200
+
+_SCRIPT = """
+<script>
+(function () {
+  var tags = %(tags)s, url = %(url)s;
+  var host = window.parent, perf = host.performance, t0 = perf.now();
+  var view = { view: Math.random().toString(36).slice(2), stalls: 0, stall_ms: 0 };
+  for (var k in tags) view[k] = tags[k];
+  if (!host.__rum) {
+    host.__rum = {};
+    view.render_ms = Math.round(t0);
+    var paint = perf.getEntriesByName("first-contentful-paint")[0];
+    if (paint) view.fcp_ms = Math.round(paint.startTime);
+  } else if (host.__rum.left) {
+    view.render_ms = Math.round(t0 - host.__rum.left);
+  }
+
+  function since(t) { return Math.round(perf.now() - t); }
+  function audios(doc) {
+    var found = Array.prototype.slice.call(doc.querySelectorAll("audio"));
+    doc.querySelectorAll("iframe").forEach(function (frame) {
+      try { if (frame.contentDocument) found = found.concat(audios(frame.contentDocument)); } catch (e) {}
+    });
+    return found;
+  }
+  function watch(audio) {
+    if (audio.__rum) return;
+    audio.__rum = true;
+    var pressed = null, waiting = null, started = false;
+    if (audio.readyState >= 3 && view.canplay_ms == null) view.canplay_ms = since(t0);
+    audio.addEventListener("canplay", function () { if (view.canplay_ms == null) view.canplay_ms = since(t0); });
+    audio.addEventListener("play", function () { if (pressed == null) pressed = perf.now(); });
+    audio.addEventListener("playing", function () {
+      if (!started && pressed != null) { view.play_latency_ms = since(pressed); started = true; }
+      if (waiting != null) { view.stall_ms += since(waiting); waiting = null; }
+    });
+    audio.addEventListener("waiting", function () { if (started) { view.stalls += 1; waiting = perf.now(); } });
+    audio.addEventListener("error", function () { view.audio_error = audio.error ? audio.error.code : 0; });
+  }
+  var poll = setInterval(function () {
+    audios(host.document).forEach(function (audio) {
+      if (audio.currentSrc === url || audio.src === url) watch(audio);
+    });
+  }, 250);
+  setTimeout(function () { clearInterval(poll); }, 60000);
+
+  function send() {
+    view.time_on_page_ms = since(t0);
+    try { host.navigator.sendBeacon(host.location.origin + "/rum", JSON.stringify(view)); } catch (e) {}
+  }
+  host.document.addEventListener("visibilitychange", function () {
+    if (host.document.visibilityState === "hidden") send();
+  });
+  // The iframe goes away when the page or the clip changes
+  window.addEventListener("pagehide", function () { host.__rum.left = perf.now(); send(); });
+})();
+</script>
+"""
+
+
+# --------------------------------------------------------------------------------
+# Browser side
+# --------------------------------------------------------------------------------
+def beacon_html(page: str, audio_clip_id, arm, audio_url: str) -> str:
+    tags = {"page": page, "audio_clip_id": audio_clip_id, "arm": arm, "clip_host": urlparse(audio_url).netloc}
+    return _SCRIPT % {"tags": json.dumps(tags), "url": json.dumps(audio_url)}
+
+
+def beacon(page: str, audio_clip_id, arm, audio_url: str):
+    """Measure this page view and its clip. Put it after the player; it takes no space."""
+    import streamlit.components.v1 as components
+
+    components.html(beacon_html(page, audio_clip_id, arm, audio_url), height=0)
+
+
+# --------------------------------------------------------------------------------
+# Collection (serve.py)
+# --------------------------------------------------------------------------------
+def clean(view):
+    """The known fields of a beacon with the right types, None if it has no usable view id."""
+    if not isinstance(view, dict) or not isinstance(view.get("view"), str) or not view["view"]:
+        return None
+    kept = {}
+    for name, kind in TAGS.items():
+        value = view.get(name)
+        if isinstance(value, kind) and not isinstance(value, bool):
+            kept[name] = value[:MAX_TAG_CHARS] if kind is str else value
+    for name in METRICS:
+        value = view.get(name)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0:
+            kept[name] = value
+    return kept
+
+
+class RumHandler(web.RequestHandler):
+    """POST /rum: one beacon per request, appended as a JSON line."""
+
+    _recent = {}    # client address -> (minute, beacons in it)
+
+    def check_xsrf_cookie(self):
+        pass    # sendBeacon cannot send the token; what is stored is limited instead
+
+    def _over_rate(self) -> bool:
+        minute = int(time.time() // 60)
+        if len(self._recent) > 10_000:
+            RumHandler._recent = {ip: v for ip, v in self._recent.items() if v[0] == minute}
+        seen_minute, count = self._recent.get(self.request.remote_ip, (minute, 0))
+        count = count + 1 if seen_minute == minute else 1
+        self._recent[self.request.remote_ip] = (minute, count)
+        return count > MAX_BEACONS_PER_MINUTE
+
+    def post(self):
+        if len(self.request.body) > MAX_BEACON_BYTES:
+            raise web.HTTPError(413)
+        if self._over_rate():
+            raise web.HTTPError(429)
+        try:
+            view = clean(json.loads(self.request.body))
+        except ValueError:
+            raise web.HTTPError(400)
+        if view is None:
+            raise web.HTTPError(400)
+        view["at"] = time.time()
+        directory = self.settings.get("rum_dir", RUM_DIR)
+        directory.mkdir(exist_ok=True)
+        path = directory / f"{socket.gethostname()}-{os.getpid()}.jsonl"
+        if path.exists() and path.stat().st_size >= MAX_FILE_BYTES:
+            raise web.HTTPError(507)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(view) + "\n")
+        self.set_status(204)
+
+
+# --------------------------------------------------------------------------------
+# Report
+# --------------------------------------------------------------------------------
+def load(directory=None) -> list:
+    """One record per page view: the last beacon it sent. Malformed lines are skipped."""
+    directory = Path(directory or RUM_DIR)
+    views = {}
+    for path in sorted(directory.glob("*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line) if line.strip() else None
+                except ValueError:
+                    continue
+                view = clean(record)
+                if view is not None:
+                    views[view["view"]] = {**view, "at": record.get("at")}
+    return list(views.values())
+
+
+def _payload_kb(by_page: dict) -> dict:
+    import payload_meter
+
+    sizes = defaultdict(list)
+    for run in payload_meter.load():
+        sizes[run["page"]].append(run["bytes"])
+    return {page: np.median(sizes[page]) / 1024 for page in by_page if sizes.get(page)}
+
+
+def report(views: list, by: str = "page") -> list:
+    keys = {
+        "page": lambda v: (v.get("page"), v.get("arm")),
+        "clip": lambda v: (v.get("audio_clip_id"),),
+        "host": lambda v: (v.get("clip_host"),),
+    }[by]
+    groups = defaultdict(list)
+    for view in views:
+        groups[keys(view)].append(view)
+    weights = _payload_kb({key[0] for key in groups}) if by == "page" else {}
+
+    rows = []
+    for key, group in sorted(groups.items(), key=lambda item: str(item[0])):
+        row = {by: key[0], **({"arm": key[1]} if by == "page" else {}), "views": len(group)}
+        for metric in METRICS:
+            values = np.array([v[metric] for v in group if v.get(metric) is not None], dtype=float)
+            for p in PERCENTILES:
+                row[f"{metric}_p{p}"] = np.percentile(values, p) if len(values) else None
+        # Drop-off signals: the clip never became playable, or was never played
+        row["no_canplay"] = np.mean([v.get("canplay_ms") is None for v in group])
+        row["never_played"] = np.mean([v.get("play_latency_ms") is None for v in group])
+        row["audio_errors"] = sum(v.get("audio_error") is not None for v in group)
+        if by == "page":
+            row["payload_kb_median"] = weights.get(key[0])
+        rows.append(row)
+    return rows
+
+
+def print_report(rows: list, by: str):
+    for row in rows:
+        title = f"{row[by]}" + (f" (arm {row['arm']})" if by == "page" else "")
+        extra = f", rerun {row['payload_kb_median']:.1f} KB" if row.get("payload_kb_median") else ""
+        print(f"\n{title}: {row['views']} views, no canplay {row['no_canplay']:.0%}, "
+              f"never played {row['never_played']:.0%}, {row['audio_errors']} audio errors{extra}")
+        print(f"  {'metric':<16}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES))
+        for metric in METRICS:
+            cells = [row[f"{metric}_p{p}"] for p in PERCENTILES]
+            print(f"  {metric:<16}" + "".join(f"{'-' if c is None else format(c, '.0f'):>10}" for c in cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--by", choices=["page", "clip", "host"], default="page")
+    parser.add_argument("--dir", help=f"where the .jsonl files are (default {RUM_DIR})")
+    parser.add_argument("--csv", help="also write the rows to this CSV file")
+    args = parser.parse_args()
+
+    rows = report(load(args.dir), args.by)
+    if not rows:
+        raise SystemExit("no beacons recorded; run the study through serve.py")
+    print_report(rows, args.by)
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
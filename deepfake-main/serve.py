@@ -0,0 +1,328 @@
+"""
+Run the study as N Streamlit worker processes behind a local reverse proxy.
+
+    python serve.py --workers 4 --port 8501
+    python serve.py --workers 4 --script some_other_app.py
+    python serve.py --workers 4 --warm-connections 8   # passed on to worker.py
+
+A single `streamlit run app.py` executes every session's script runs, and the
+blocking DB work inside them, on one interpreter and one GIL. Here each worker is
+its own `streamlit run` (via worker.py) on 127.0.0.1 with its own SSH tunnel and pool
+(db.get_app_engine), and the proxy spreads browsers over them.
+
+A Streamlit session lives in one worker's memory, so a browser must stay on the
+worker that created it: the proxy pins it with the `st_worker` cookie. New
+browsers go to the healthy worker with the fewest open sessions. Workers are
+health-checked on /_stcore/health and restarted if their process exits; the
+sessions they held reconnect to another worker and start over.
+
+All workers map one shared_state.py file for clip counts, arm quotas and the
+catalog version. It is recreated empty on every start and seeded from MySQL.
+
+The proxy also takes the rating pages' load and audio beacons on /rum (rum.py).
+
+Streamlit's XSRF protection stays on in the workers: the proxy passes the
+_streamlit_xsrf cookie and the X-Xsrftoken header through both ways. The
+session websocket is only accepted from the proxy's own host or from an
+--allowed-origin.
+
+Put TLS and the public hostname in front of this proxy (nginx, Caddy, a cloud
+load balancer) the same way as for a single Streamlit process.
+"""
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+from tornado import gen, httpclient, ioloop, web, websocket
+from tornado.httputil import HTTPHeaders
+
+import rum
+import shared_state
+
+APP_DIR = Path(__file__).resolve().parent
+AFFINITY_COOKIE = "st_worker"
+HEALTH_INTERVAL = 5
+# Headers that describe one hop and must not be forwarded.
+HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "content-length",
+}
+
+log = logging.getLogger("serve")
+
+
+# --------------------------------------------------------------------------------
+# Workers
+# --------------------------------------------------------------------------------
+class Worker:
+    def __init__(self, index: int, port: int, script: str, extra_args=()):
+        self.index = index
+        self.port = port
+        self.script = script
+        self.extra_args = list(extra_args)
+        self.process = None
+        self.healthy = False
+        self.sessions = 0
+        # Bumped on every (re)start; websockets of an earlier process no longer count.
+        self.generation = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def command(self) -> list:
+        return [
+            # worker.py warms the tunnel, pool and catalog, then runs `streamlit run`.
+            sys.executable, str(APP_DIR / "worker.py"), self.script,
+            "--server.address", "127.0.0.1",
+            "--server.port", str(self.port),
+            "--server.headless", "true",
+            # The browser only ever talks to the proxy, which checks the Origin itself.
+            "--server.enableCORS", "false",
+            "--browser.gatherUsageStats", "false",
+            *self.extra_args,
+        ]
+
+    def start(self):
+        self.healthy = False
+        self.sessions = 0
+        self.generation += 1
+        self.process = subprocess.Popen(self.command(), cwd=APP_DIR)
+        log.info("worker %d: pid %d on port %d", self.index, self.process.pid, self.port)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class WorkerPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.http = httpclient.AsyncHTTPClient()
+
+    def get(self, cookie_value):
+        """Worker named by the affinity cookie, or None if it is unknown or down."""
+        try:
+            worker = self.workers[int(cookie_value)]
+        except (TypeError, ValueError, IndexError):
+            return None
+        return worker if worker.healthy else None
+
+    def least_loaded(self):
+        healthy = [w for w in self.workers if w.healthy]
+        if not healthy:
+            raise web.HTTPError(503, reason="No Streamlit worker is ready")
+        return min(healthy, key=lambda w: (w.sessions, w.index))
+
+    async def check(self):
+        for worker in self.workers:
+            if worker.process.poll() is not None:
+                log.warning("worker %d exited with %s, restarting", worker.index, worker.process.returncode)
+                worker.start()
+                continue
+            try:
+                response = await self.http.fetch(f"{worker.base_url}/_stcore/health", request_timeout=2)
+                healthy = response.code == 200
+            except Exception:
+                healthy = False
+            if healthy != worker.healthy:
+                log.info("worker %d is %s", worker.index, "up" if healthy else "down")
+            worker.healthy = healthy
+
+    async def wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await self.check()
+            if all(w.healthy for w in self.workers):
+                return
+            await gen.sleep(0.5)
+        log.warning("only %d/%d workers ready after %ds",
+                    sum(w.healthy for w in self.workers), len(self.workers), timeout)
+
+
+# --------------------------------------------------------------------------------
+# Proxy handlers
+# --------------------------------------------------------------------------------
+class _AffinityMixin:
+    def pick_worker(self):
+        pool = self.settings["worker_pool"]
+        worker = pool.get(self.get_cookie(AFFINITY_COOKIE))
+        if worker is None:
+            worker = pool.least_loaded()
+            self.set_cookie(AFFINITY_COOKIE, str(worker.index), httponly=True, samesite="Lax")
+        return worker
+
+
+def _forward_headers(headers):
+    forwarded = HTTPHeaders()
+    for name, value in headers.get_all():
+        if name.lower() not in HOP_HEADERS and name.lower() != "host":
+            forwarded.add(name, value)
+    return forwarded
+
+
+class HttpProxy(_AffinityMixin, web.RequestHandler):
+    SUPPORTED_METHODS = ("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS")
+
+    async def _proxy(self, *args):
+        worker = self.pick_worker()
+        body = self.request.body if self.request.method in ("POST", "PUT", "PATCH") else None
+        request = httpclient.HTTPRequest(
+            worker.base_url + self.request.uri,
+            method=self.request.method,
+            headers=_forward_headers(self.request.headers),
+            body=body,
+            allow_nonstandard_methods=True,
+            follow_redirects=False,
+            decompress_response=False,
+            request_timeout=300,
+        )
+        try:
+            response = await self.settings["worker_pool"].http.fetch(request, raise_error=False)
+        except Exception as e:
+            raise web.HTTPError(502, reason=f"Worker {worker.index} unreachable: {e}")
+        self.set_status(response.code, response.reason)
+        for name, value in response.headers.get_all():
+            if name.lower() not in HOP_HEADERS:
+                if name.lower() == "set-cookie":
+                    self.add_header(name, value)
+                else:
+                    self.set_header(name, value)
+        if response.body and self.request.method != "HEAD":
+            self.write(response.body)
+
+    get = head = post = put = delete = patch = options = _proxy
+
+
+class StreamProxy(_AffinityMixin, websocket.WebSocketHandler):
+    """Relays the Streamlit session websocket (/_stcore/stream) to the pinned worker."""
+
+    upstream = None
+    worker = None
+    generation = None
+
+    def check_origin(self, origin):
+        # Same host as the request (tornado's default), or one named with --allowed-origin.
+        return super().check_origin(origin) or urlparse(origin).netloc.lower() in self.settings["allowed_origins"]
+
+    def select_subprotocol(self, subprotocols):
+        # Streamlit sends ["streamlit", <xsrf token>, <session id>] and expects "streamlit" back.
+        return subprotocols[0] if subprotocols else None
+
+    def prepare(self):
+        # Before the handshake, so a new affinity cookie goes out with the 101 response.
+        self.worker = self.pick_worker()
+
+    async def open(self, *args):
+        url = f"ws://127.0.0.1:{self.worker.port}{self.request.uri}"
+        request = httpclient.HTTPRequest(url, headers=_forward_headers(self.request.headers))
+        subprotocols = [
+            p.strip() for p in self.request.headers.get("Sec-WebSocket-Protocol", "").split(",") if p.strip()
+        ]
+        try:
+            self.upstream = await websocket.websocket_connect(
+                request, subprotocols=subprotocols or None, max_message_size=self.settings["max_message_size"]
+            )
+        except Exception as e:
+            log.warning("worker %d websocket failed: %s", self.worker.index, e)
+            self.close(1011, "worker unavailable")
+            return
+        self.generation = self.worker.generation
+        self.worker.sessions += 1
+        ioloop.IOLoop.current().spawn_callback(self._pump)
+
+    async def _pump(self):
+        while True:
+            message = await self.upstream.read_message()
+            if message is None:
+                self.close()
+                return
+            try:
+                await self.write_message(message, binary=isinstance(message, bytes))
+            except websocket.WebSocketClosedError:
+                return
+
+    async def on_message(self, message):
+        if self.upstream is not None:
+            await self.upstream.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+            self.upstream = None
+            if self.generation == self.worker.generation:
+                self.worker.sessions -= 1
+
+
+def make_app(pool: WorkerPool, extra_handlers=(), allowed_origins=()) -> web.Application:
+    return web.Application(
+        [*extra_handlers, (r".*/_stcore/stream", StreamProxy), (r".*", HttpProxy)],
+        worker_pool=pool,
+        allowed_origins={urlparse(origin).netloc.lower() for origin in allowed_origins},
+        # Same limit as Streamlit's server.maxMessageSize default (200 MB).
+        max_message_size=200 * 1024 * 1024,
+        websocket_ping_interval=30,
+    )
+
+
+# --------------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8501, help="public port of the proxy")
+    parser.add_argument("--address", default="0.0.0.0")
+    parser.add_argument("--first-worker-port", type=int, default=8601)
+    parser.add_argument("--script", default="app.py", help="Streamlit entry script, relative to the app folder")
+    parser.add_argument("--allowed-origin", action="append", default=[], metavar="URL",
+                        help="public origin (e.g. https://study.example.org) when the TLS proxy in front "
+                             "rewrites the Host header")
+    args, streamlit_args = parser.parse_known_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    # Fresh shared counters for this deployment; the workers find the file via the env var.
+    state_path = shared_state.default_path()
+    shared_state.reset(state_path)
+    os.environ[shared_state.ENV_PATH] = str(state_path)
+
+    workers = [
+        Worker(i, args.first_worker_port + i, args.script, streamlit_args) for i in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    pool = WorkerPool(workers)
+
+    def shutdown(*_):
+        for worker in workers:
+            worker.stop()
+        ioloop.IOLoop.current().add_callback_from_signal(ioloop.IOLoop.current().stop)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    loop = ioloop.IOLoop.current()
+    loop.run_sync(pool.wait_ready)
+    # Browser beacons from the rating pages (rum.py)
+    make_app(pool, [(r"/rum", rum.RumHandler)], args.allowed_origin).listen(args.port, args.address, xheaders=True)
+    ioloop.PeriodicCallback(pool.check, HEALTH_INTERVAL * 1000).start()
+    log.info("proxy on %s:%d -> %d workers", args.address, args.port, len(workers))
+    try:
+        loop.start()
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+if __name__ == "__main__":
+    main()
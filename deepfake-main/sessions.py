@@ -0,0 +1,228 @@
+"""
+Memory held by Streamlit sessions, and reaping the abandoned ones.
+
+A participant who closes the tab leaves a session behind. It holds the key_*
+widget values, the clip and playlist picks and an admission lease
+(admission.py). Streamlit keeps a disconnected session for
+server.disconnectedSessionTTL and then drops it. It does not call back into the
+app, so the lease stays taken until it expires.
+
+With this on, a thread in each worker looks at every session each
+SWEEP_SECONDS:
+
+    size            session_state, measured with Streamlit's own asizeof
+    over budget     session_state above --session-budget-mb: logged once with
+                    its largest keys
+    disconnected    gone for DISCONNECTED_SECONDS: its admission lease is
+                    released and the session shut down, before Streamlit's
+                    own TTL drops it silently
+
+Open tabs are left alone, however long they sit idle. Closing their websocket
+does not free anything, because the frontend reconnects to the same session.
+An idle tab does not hold an admission place either, since leases are only
+renewed by reruns.
+
+Every sweep appends one line to session_stats/<host>-<pid>.jsonl: session
+counts, session_state bytes (total, p95, max), process RSS and what was reaped.
+Sizing for a launch:
+
+    python worker.py app.py --session-budget-mb 5
+    python sessions.py report --participants 1000 --workers 4
+
+The report fits worker RSS against open sessions (base + per-session
+slope) and projects the memory for that many concurrent participants.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+import admission
+
+STATS_DIR = Path(__file__).resolve().parent / "session_stats"
+SWEEP_SECONDS = 15
+DISCONNECTED_SECONDS = 60          # below Streamlit's default disconnectedSessionTTL (120s)
+BUDGET_MB = 5
+
+log = logging.getLogger("sessions")
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _largest_keys(session_state, n=3) -> list:
+    from streamlit.runtime.stats import safe_sizeof
+
+    sizes = [(safe_sizeof(value), key) for key, value in session_state.filtered_state.items()]
+    return [f"{key} ({size / 1024:.0f} KB)" for size, key in sorted(sizes, reverse=True)[:n]]
+
+
+# --------------------------------------------------------------------------------
+# Reaper
+# --------------------------------------------------------------------------------
+class Reaper:
+    def __init__(self, budget_mb: float = BUDGET_MB, directory=None):
+        self.budget = budget_mb * 1024 * 1024
+        self.directory = Path(directory or STATS_DIR)
+        self.disconnected_at = {}   # session id -> monotonic time it was first seen without a client
+        self.over_budget = set()    # session ids already logged
+        self.peak = {"sessions": 0, "state_bytes": 0, "rss_bytes": 0}
+
+    def sweep(self, runtime) -> dict:
+        """Measure every session; hand the ones to reap to the event loop. Returns the sample."""
+        from streamlit.runtime.stats import safe_sizeof
+
+        manager = runtime._session_mgr
+        now = time.monotonic()
+        sizes, to_shut = [], []
+        sessions = manager.list_sessions()
+        for info in sessions:
+            session = info.session
+            sid = session.id
+            size = safe_sizeof(session.session_state)
+            sizes.append(size)
+            if size > self.budget and sid not in self.over_budget:
+                self.over_budget.add(sid)
+                log.warning("session %s holds %.1f MB: %s", sid, size / 2**20,
+                            ", ".join(_largest_keys(session.session_state)))
+            if info.client is not None:
+                self.disconnected_at.pop(sid, None)
+            elif now - self.disconnected_at.setdefault(sid, now) > DISCONNECTED_SECONDS:
+                to_shut.append(info)
+
+        live = {info.session.id for info in sessions}
+        for gone in set(self.disconnected_at) - live:
+            self.disconnected_at.pop(gone, None)
+        self.over_budget &= live
+
+        sample = {
+            "at": time.time(),
+            "sessions": len(sessions),
+            "connected": sum(info.client is not None for info in sessions),
+            "state_bytes": int(sum(sizes)),
+            "state_bytes_p95": float(np.percentile(sizes, 95)) if sizes else 0.0,
+            "state_bytes_max": max(sizes, default=0),
+            "rss_bytes": _rss_bytes(),
+            "reaped": len(to_shut),
+        }
+        for key in self.peak:
+            self.peak[key] = max(self.peak[key], sample[key])
+        sample["peak"] = dict(self.peak)
+        if to_shut:
+            runtime._get_async_objs().eventloop.call_soon_threadsafe(self._reap, runtime, to_shut)
+        self._write(sample)
+        return sample
+
+    def _reap(self, runtime, infos):
+        # On the event loop: Runtime.close_session is not thread-safe
+        for info in infos:
+            try:
+                admission.release(info.session.session_state.filtered_state)
+            except Exception as e:
+                log.warning("releasing session %s failed: %s", info.session.id, e)
+            runtime.close_session(info.session.id)
+            self.disconnected_at.pop(info.session.id, None)
+
+    def _write(self, sample: dict):
+        self.directory.mkdir(exist_ok=True)
+        with open(self.directory / f"{socket.gethostname()}-{os.getpid()}.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(sample) + "\n")
+
+
+def install(budget_mb: float = BUDGET_MB, directory=None) -> Reaper:
+    """Start the sweep thread. Call before streamlit starts."""
+    from streamlit.runtime import Runtime
+
+    reaper = Reaper(budget_mb, directory)
+
+    def loop():
+        while True:
+            time.sleep(SWEEP_SECONDS)
+            if not Runtime.exists():
+                continue
+            try:
+                reaper.sweep(Runtime.instance())
+            except Exception as e:
+                log.warning("session sweep failed: %s", e)
+
+    threading.Thread(target=loop, name="session-reaper", daemon=True).start()
+    return reaper
+
+
+# --------------------------------------------------------------------------------
+# Report
+# --------------------------------------------------------------------------------
+def load(directory=None) -> dict:
+    """Samples per worker file."""
+    samples = {}
+    for path in sorted(Path(directory or STATS_DIR).glob("*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            samples[path.stem] = [json.loads(line) for line in f if line.strip()]
+    return samples
+
+
+def fit(samples: list):
+    """RSS = base + per_session * sessions, least squares; None without enough spread."""
+    sessions = np.array([s["sessions"] for s in samples], dtype=float)
+    rss = np.array([s["rss_bytes"] for s in samples], dtype=float)
+    if len(np.unique(sessions)) < 2:
+        return None
+    per_session, base = np.polyfit(sessions, rss, 1)
+    return base, per_session
+
+
+def report(by_worker: dict, participants: int, workers: int):
+    mb = 1024 * 1024
+    fits = []
+    print(f"{'worker':<28} {'samples':>7} {'peak sess':>9} {'peak state MB':>13} {'peak RSS MB':>11} "
+          f"{'reaped':>6}")
+    for name, samples in sorted(by_worker.items()):
+        print(f"{name:<28} {len(samples):>7} {max(s['sessions'] for s in samples):>9} "
+              f"{max(s['state_bytes'] for s in samples) / mb:>13.1f} {max(s['rss_bytes'] for s in samples) / mb:>11.0f} "
+              f"{sum(s['reaped'] for s in samples):>6}")
+        line = fit(samples)
+        if line:
+            fits.append(line)
+
+    all_samples = [s for samples in by_worker.values() for s in samples if s["sessions"]]
+    if all_samples:
+        per_state = np.array([s["state_bytes"] / s["sessions"] for s in all_samples])
+        print(f"\nsession_state per session: median {np.median(per_state) / 1024:.0f} KB, "
+              f"p95 {np.percentile(per_state, 95) / 1024:.0f} KB, "
+              f"largest single session {max(s['state_bytes_max'] for s in all_samples) / mb:.1f} MB")
+    if not fits:
+        print("not enough spread in session counts to fit RSS per session yet")
+        return
+    base = np.median([b for b, _ in fits])
+    per_session = np.median([p for _, p in fits])
+    per_worker = base + per_session * participants / workers
+    print(f"RSS per worker ~ {base / mb:.0f} MB + {per_session / 1024:.0f} KB per open session")
+    print(f"{participants} concurrent participants on {workers} workers: "
+          f"~{per_worker / mb:.0f} MB per worker, ~{workers * per_worker / mb:.0f} MB in total")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--dir", help=f"where the .jsonl files are (default {STATS_DIR})")
+    parser.add_argument("--participants", type=int, default=1000, help="concurrent participants to size for")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    by_worker = load(args.dir)
+    if not by_worker:
+        raise SystemExit("no samples recorded; start the workers without --no-session-reaper")
+    report(by_worker, args.participants, args.workers)
@@ -0,0 +1,384 @@
+"""
+State shared by every Streamlit worker on one host, in a memory-mapped file.
+
+With serve.py running several workers, per-process dicts for clip counts, arm
+quotas or the catalog version drift apart, and asking MySQL on every rerun is
+what we are trying to avoid. All workers map the same file instead:
+
+    header   magic, layout, seeded flag, catalog version
+    arms     target and assigned count per group_no (1 = control, 2 = T1, 3 = T2)
+    admit    admission capacity, queue tickets, DB latency and pool saturation
+    leases   expiry and owner of each admitted session (admission.py)
+    queue    last time each waiting ticket asked to be let in
+    clips    ratings per (audio_clip_id, group_no)
+
+Every slot is an aligned int64, so reads are plain memory loads with no lock and
+no syscall. Python has no atomic fetch-and-add, so a write takes an fcntl lock on
+just that slot's 8 bytes, plus a thread lock because fcntl locks belong to the
+process. Writers of different slots never wait for each other.
+
+The counters are a fast, approximate copy of what is in MySQL. serve.py starts
+every deployment with a fresh file, and seed() reloads it from the summary
+tables (summary.py). The file also records which process seeded it; once that
+process is gone (a plain `streamlit run` restarted, or a crashed worker), the
+next caller seeds it again.
+
+    python shared_state.py show
+    python shared_state.py seed
+    python shared_state.py bump-catalog     # workers reload their clip list
+"""
+import argparse
+import fcntl
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, ProgrammingError, SQLAlchemyError
+
+import db
+
+MAGIC = 0x44464B5354415445  # "DFKSTATE"
+LAYOUT = 3
+ARM_SLOTS = 4          # indexed by group_no, slot 0 unused
+LEASE_SLOTS = 2048     # most sessions admitted at once
+QUEUE_SLOTS = 4096     # waiting tickets tracked, by ticket % QUEUE_SLOTS
+TICKET_SECONDS = 30    # a waiting ticket not seen for this long has left the queue
+MAX_CLIP_ID = 1 << 16  # audio_clip_id must be below this
+SLOT = 8
+
+# Slot indexes
+_MAGIC, _LAYOUT, _SEEDED, _CATALOG_VERSION, _SEEDED_PID = 0, 1, 2, 3, 4
+_ARM_TARGET = 8
+_ARM_ASSIGNED = _ARM_TARGET + ARM_SLOTS
+_ADMIT = _ARM_ASSIGNED + ARM_SLOTS
+_CAPACITY, _NEXT_TICKET, _SERVED_TICKET, _LATENCY_US, _SATURATION_PM, _SAMPLED_MS, _ADJUSTED_MS = range(
+    _ADMIT, _ADMIT + 7
+)
+_LEASE_EXPIRY = _ADMIT + 8
+_LEASE_OWNER = _LEASE_EXPIRY + LEASE_SLOTS
+_TICKET_SEEN = _LEASE_OWNER + LEASE_SLOTS
+_CLIPS = _TICKET_SEEN + QUEUE_SLOTS
+N_SLOTS = _CLIPS + MAX_CLIP_ID * ARM_SLOTS
+
+ENV_PATH = "DEEPFAKE_SHARED_STATE"
+
+log = logging.getLogger("shared_state")
+
+
+def default_path() -> Path:
+    if os.environ.get(ENV_PATH):
+        return Path(os.environ[ENV_PATH])
+    shm = Path("/dev/shm")
+    return (shm if shm.is_dir() else Path(tempfile.gettempdir())) / "deepfake-state.bin"
+
+
+class SharedState:
+    def __init__(self, path=None):
+        self.path = Path(path or default_path())
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_lock = threading.Lock()
+        with self._locked(0, 0):
+            if os.fstat(self._fd).st_size < N_SLOTS * SLOT:
+                os.ftruncate(self._fd, N_SLOTS * SLOT)
+            self._mm = mmap.mmap(self._fd, N_SLOTS * SLOT)
+            self._slots = np.frombuffer(self._mm, dtype=np.int64)
+            if self._slots[_MAGIC] == 0:
+                self._slots[_LAYOUT] = LAYOUT
+                self._slots[_MAGIC] = MAGIC
+            elif self._slots[_MAGIC] != MAGIC or self._slots[_LAYOUT] != LAYOUT:
+                raise RuntimeError(f"{self.path} has a different layout; delete it and restart the workers")
+        self.clips = self._slots[_CLIPS:].reshape(MAX_CLIP_ID, ARM_SLOTS)
+        self._expiry = self._slots[_LEASE_EXPIRY:_LEASE_OWNER]
+        self._owner = self._slots[_LEASE_OWNER:_TICKET_SEEN]
+        self._ticket_seen = self._slots[_TICKET_SEEN:_CLIPS]
+
+    # ----------------------------------------------------------------------------
+    # Locking
+    # ----------------------------------------------------------------------------
+    @contextmanager
+    def _locked(self, first: int, count: int = 1):
+        """Exclusive lock on slots [first, first + count); count 0 locks the whole file."""
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, count * SLOT, first * SLOT)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, count * SLOT, first * SLOT)
+
+    def _add(self, slot: int, n: int) -> int:
+        with self._locked(slot):
+            self._slots[slot] += n
+            return int(self._slots[slot])
+
+    # ----------------------------------------------------------------------------
+    # Catalog
+    # ----------------------------------------------------------------------------
+    @property
+    def catalog_version(self) -> int:
+        return int(self._slots[_CATALOG_VERSION])
+
+    def bump_catalog_version(self) -> int:
+        return self._add(_CATALOG_VERSION, 1)
+
+    def set_catalog_version(self, version: int):
+        with self._locked(_CATALOG_VERSION):
+            if version > self._slots[_CATALOG_VERSION]:
+                self._slots[_CATALOG_VERSION] = version
+
+    # ----------------------------------------------------------------------------
+    # Arms
+    # ----------------------------------------------------------------------------
+    def arm_targets(self) -> dict:
+        return {arm: int(self._slots[_ARM_TARGET + arm]) for arm in range(1, ARM_SLOTS)}
+
+    def arm_assigned(self) -> dict:
+        return {arm: int(self._slots[_ARM_ASSIGNED + arm]) for arm in range(1, ARM_SLOTS)}
+
+    def set_arm_targets(self, targets: dict):
+        with self._locked(_ARM_TARGET, ARM_SLOTS):
+            for arm, target in targets.items():
+                self._slots[_ARM_TARGET + arm] = target
+
+    def add_to_arm(self, arm: int, n: int = 1) -> int:
+        return self._add(_ARM_ASSIGNED + arm, n)
+
+    def claim_arm(self, choose) -> int:
+        """choose(assigned, targets) -> arm, then count it; atomic across workers."""
+        with self._locked(_ARM_TARGET, 2 * ARM_SLOTS):
+            arm = choose(self.arm_assigned(), self.arm_targets())
+            self._slots[_ARM_ASSIGNED + arm] += 1
+            return arm
+
+    # ----------------------------------------------------------------------------
+    # Admission
+    # ----------------------------------------------------------------------------
+    def admission(self, now_ms: int) -> dict:
+        return {
+            "capacity": int(self._slots[_CAPACITY]),
+            "active": self.active_sessions(now_ms),
+            "next_ticket": int(self._slots[_NEXT_TICKET]),
+            "served_ticket": int(self._slots[_SERVED_TICKET]),
+            "latency_ms": float(self._slots[_LATENCY_US]) / 1000,
+            "saturation": float(self._slots[_SATURATION_PM]) / 1000,
+            "sampled_ms": int(self._slots[_SAMPLED_MS]),
+        }
+
+    def active_sessions(self, now_ms: int) -> int:
+        return int((self._expiry > now_ms).sum())
+
+    def take_ticket(self, now_ms: int) -> int:
+        ticket = self._add(_NEXT_TICKET, 1)
+        self._ticket_seen[ticket % QUEUE_SLOTS] = now_ms
+        return ticket
+
+    def tickets_ahead(self, ticket: int, now_ms: int) -> int:
+        """Waiting tickets before `ticket` that were seen within TICKET_SECONDS."""
+        first, last = int(self._slots[_SERVED_TICKET]) + 1, ticket
+        if last <= first:
+            return 0
+        # More than QUEUE_SLOTS back, the slots are reused; count those tickets as waiting.
+        untracked = max(0, last - first - QUEUE_SLOTS)
+        seen = self._ticket_seen[np.arange(first + untracked, last) % QUEUE_SLOTS]
+        return untracked + int((seen > now_ms - TICKET_SECONDS * 1000).sum())
+
+    def publish_load(self, latency_ms: float, saturation: float, now_ms: int):
+        # Single aligned stores; last writer wins, which is all the controller needs.
+        self._slots[_LATENCY_US] = int(latency_ms * 1000)
+        self._slots[_SATURATION_PM] = int(saturation * 1000)
+        self._slots[_SAMPLED_MS] = now_ms
+
+    def adjust_capacity(self, decide, now_ms: int, every_ms: int) -> int:
+        """decide(capacity, state) -> capacity, at most once per every_ms across workers."""
+        with self._locked(_CAPACITY):
+            if now_ms - self._slots[_ADJUSTED_MS] >= every_ms:
+                self._slots[_CAPACITY] = decide(int(self._slots[_CAPACITY]), self.admission(now_ms))
+                self._slots[_ADJUSTED_MS] = now_ms
+            return int(self._slots[_CAPACITY])
+
+    def lease(self, ticket, owner: int, expires_ms: int, now_ms: int):
+        """
+        Admit `owner` and return its lease slot, or None while the queue ahead of
+        `ticket` fills the free capacity. ticket None skips the queue but still
+        needs a free slot. Every call with a ticket marks it as still waiting;
+        tickets of sessions that stopped asking are not counted as ahead.
+        """
+        with self._locked(_SERVED_TICKET, _CLIPS - _SERVED_TICKET):
+            if ticket is not None:
+                self._ticket_seen[ticket % QUEUE_SLOTS] = now_ms
+            free = np.flatnonzero(self._expiry <= now_ms)
+            if not len(free):
+                return None
+            if ticket is not None:
+                active = LEASE_SLOTS - len(free)
+                room = min(int(self._slots[_CAPACITY]) - active, len(free))
+                if room <= 0 or self.tickets_ahead(ticket, now_ms) >= room:
+                    return None
+                self._slots[_SERVED_TICKET] = max(int(self._slots[_SERVED_TICKET]), ticket)
+            slot = int(free[0])
+            self._owner[slot] = owner
+            self._expiry[slot] = expires_ms
+            return slot
+
+    def renew(self, slot: int, owner: int, expires_ms: int) -> bool:
+        with self._locked(_LEASE_EXPIRY + slot):
+            if self._owner[slot] != owner:
+                return False
+            self._expiry[slot] = expires_ms
+            return True
+
+    def release(self, slot: int, owner: int):
+        with self._locked(_LEASE_EXPIRY + slot):
+            if self._owner[slot] == owner:
+                self._expiry[slot] = 0
+
+    # ----------------------------------------------------------------------------
+    # Clips
+    # ----------------------------------------------------------------------------
+    def clip_ratings(self, audio_clip_id: int, arm=None) -> int:
+        row = self.clips[audio_clip_id]
+        return int(row[arm] if arm is not None else row[1:].sum())
+
+    def add_rating(self, audio_clip_id: int, arm: int, n: int = 1) -> int:
+        """Count a saved rating; ids the table has no row for are logged and not counted."""
+        if not (0 < audio_clip_id < MAX_CLIP_ID and 0 < arm < ARM_SLOTS):
+            log.warning("rating of clip %s in arm %s not counted: outside the shared table (clip ids 1..%d)",
+                        audio_clip_id, arm, MAX_CLIP_ID - 1)
+            return 0
+        return self._add(_CLIPS + audio_clip_id * ARM_SLOTS + arm, n)
+
+    # ----------------------------------------------------------------------------
+    # Seeding
+    # ----------------------------------------------------------------------------
+    @property
+    def seeded(self) -> bool:
+        """Seeded by a process that is still running; what an earlier run left is stale."""
+        return bool(self._slots[_SEEDED]) and _alive(int(self._slots[_SEEDED_PID]))
+
+    def seed(self, db_conn, force=False) -> bool:
+        """
+        Load clip ratings from clip_summary_phase3 and participants per arm from
+        arm_assignments_phase3, or count both from english_ratings_phase3 before
+        migrations 1 and 4. Only the first worker to get here does the work.
+        """
+        with self._locked(0, 0):
+            if self.seeded and not force:
+                return False
+            try:
+                rows = db_conn.execute(text(
+                    "SELECT audio_clip_id, group_no, n_ratings FROM deepfakes.clip_summary_phase3"
+                )).fetchall()
+            except ProgrammingError:
+                # Before migration 1 there are no summary tables; count the ratings themselves.
+                rows = db_conn.execute(text(
+                    """
+                    SELECT audio_clip_id, group_no, COUNT(*)
+                    FROM deepfakes.english_ratings_phase3
+                    GROUP BY audio_clip_id, group_no
+                    """
+                )).fetchall()
+            try:
+                arms = db_conn.execute(text(
+                    "SELECT group_no, COUNT(*) FROM deepfakes.arm_assignments_phase3 GROUP BY group_no"
+                )).fetchall()
+            except ProgrammingError:
+                # Before migration 4 there is no assignment log; count who rated in each arm.
+                arms = db_conn.execute(text(
+                    """
+                    SELECT group_no, COUNT(DISTINCT participant_id)
+                    FROM deepfakes.english_ratings_phase3
+                    GROUP BY group_no
+                    """
+                )).fetchall()
+            self.clips[:] = 0
+            for audio_clip_id, group_no, n_ratings in rows:
+                if 0 < audio_clip_id < MAX_CLIP_ID and 0 < group_no < ARM_SLOTS:
+                    self.clips[audio_clip_id, group_no] = n_ratings
+            self._slots[_ARM_ASSIGNED:_ARM_ASSIGNED + ARM_SLOTS] = 0
+            for group_no, participants in arms:
+                if 0 < group_no < ARM_SLOTS:
+                    self._slots[_ARM_ASSIGNED + group_no] = participants
+            self._slots[_SEEDED_PID] = os.getpid()
+            self._slots[_SEEDED] = 1
+            return True
+
+    def snapshot(self) -> dict:
+        rated = np.nonzero(self.clips.sum(axis=1))[0]
+        return {
+            "path": str(self.path),
+            "seeded": self.seeded,
+            "catalog_version": self.catalog_version,
+            "arm_targets": self.arm_targets(),
+            "arm_assigned": self.arm_assigned(),
+            "admission": self.admission(int(time.time() * 1000)),
+            "clips_with_ratings": len(rated),
+            "ratings": int(self.clips.sum()),
+        }
+
+
+def _alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def reset(path=None):
+    """Start a deployment with an empty, unseeded file (serve.py does this)."""
+    path = Path(path or default_path())
+    path.unlink(missing_ok=True)
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state(engine=None) -> SharedState:
+    """The process's mapping of the shared file, seeded through engine if nobody has yet."""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = SharedState()
+    if engine is not None and not _state.seeded:
+        try:
+            with engine.connect() as db_conn:
+                _state.seed(db_conn)
+        except (db.DatabaseUnavailable, OperationalError):
+            pass  # seeded by the next caller once the database answers
+        except SQLAlchemyError:
+            # A page still runs on the unseeded counts; the next caller tries again
+            log.exception("seeding the shared state failed")
+    return _state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["show", "seed", "reset", "bump-catalog"])
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    args = parser.parse_args()
+
+    if args.command == "reset":
+        reset()
+    else:
+        state = get_shared_state()
+        if args.command == "bump-catalog":
+            state.bump_catalog_version()
+        if args.command == "seed":
+            with db.tunnel_session(db.load_secrets(args.secrets)) as (secrets, tunnel):
+                engine = db.get_sqlalchemy_engine(tunnel, secrets)
+                with engine.connect() as conn:
+                    state.seed(conn, force=True)
+        for key, value in state.snapshot().items():
+            print(f"{key}: {value}")
@@ -0,0 +1,294 @@
+"""
+Running per-clip and per-arm aggregates for deepfakes.english_ratings_phase3.
+
+Every rating insert also upserts one row in clip_summary_phase3 (keyed by
+audio_clip_id + group_no) and one row in arm_summary_phase3 (keyed by group_no),
+inside the same transaction. Monitoring then reads O(clips) rows instead of
+scanning every rating.
+
+The phase-3 pages write a rating with one CALL to the stored procedure
+submit_rating_phase3 (migration 5): the insert and both upserts run on the
+server, one round trip through the SSH tunnel instead of three.
+
+Both are probed for (db.SchemaProbe) before use, and probed again while
+missing, so applying a migration takes effect without restarting the workers.
+Until migration 1 has created the tables, ratings are saved without
+aggregates; `rebuild()` fills them in.
+
+Run `python summary.py` to print the DDL and the one-off backfill statements.
+"""
+from sqlalchemy import text
+
+import db
+
+# --------------------------------------------------------------------------------
+# Schema
+# --------------------------------------------------------------------------------
+# Sums and counts are kept separately so means ignore NULL answers,
+# exactly like AVG() over the ratings table would.
+_COUNTER_COLUMNS = """
+    n_ratings INT NOT NULL DEFAULT 0,
+    sum_realness_scale BIGINT NOT NULL DEFAULT 0,
+    n_realness_scale INT NOT NULL DEFAULT 0,
+    n_perceived_real INT NOT NULL DEFAULT 0,
+    n_perceived_fake INT NOT NULL DEFAULT 0,
+    n_check_pass INT NOT NULL DEFAULT 0,
+    sum_trust_content BIGINT NOT NULL DEFAULT 0,
+    n_trust_content INT NOT NULL DEFAULT 0,
+    sum_trust_media BIGINT NOT NULL DEFAULT 0,
+    n_trust_media INT NOT NULL DEFAULT 0
+"""
+
+CREATE_CLIP_SUMMARY = f"""
+CREATE TABLE IF NOT EXISTS deepfakes.clip_summary_phase3 (
+    audio_clip_id INT NOT NULL,
+    group_no INT NOT NULL,
+    {_COUNTER_COLUMNS},
+    PRIMARY KEY (audio_clip_id, group_no)
+)
+"""
+
+CREATE_ARM_SUMMARY = f"""
+CREATE TABLE IF NOT EXISTS deepfakes.arm_summary_phase3 (
+    group_no INT NOT NULL,
+    {_COUNTER_COLUMNS},
+    PRIMARY KEY (group_no)
+)
+"""
+
+_COUNTERS = [
+    "n_ratings",
+    "sum_realness_scale", "n_realness_scale",
+    "n_perceived_real", "n_perceived_fake",
+    "n_check_pass",
+    "sum_trust_content", "n_trust_content",
+    "sum_trust_media", "n_trust_media",
+]
+
+_UPDATE_CLAUSE = ",\n    ".join(f"{c} = {c} + VALUES({c})" for c in _COUNTERS)
+_INSERT_COLUMNS = ", ".join(_COUNTERS)
+_INSERT_VALUES = ", ".join(f":{c}" for c in _COUNTERS)
+
+_UPSERT_CLIP = text(f"""
+INSERT INTO deepfakes.clip_summary_phase3 (audio_clip_id, group_no, {_INSERT_COLUMNS})
+VALUES (:audio_clip_id, :group_no, {_INSERT_VALUES})
+ON DUPLICATE KEY UPDATE
+    {_UPDATE_CLAUSE}
+""")
+
+_UPSERT_ARM = text(f"""
+INSERT INTO deepfakes.arm_summary_phase3 (group_no, {_INSERT_COLUMNS})
+VALUES (:group_no, {_INSERT_VALUES})
+ON DUPLICATE KEY UPDATE
+    {_UPDATE_CLAUSE}
+""")
+
+# Same aggregates recomputed from scratch, used once to backfill existing ratings.
+_AGGREGATES = """
+    COUNT(*),
+    COALESCE(SUM(realness_scale), 0), COUNT(realness_scale),
+    COALESCE(SUM(realness_perception = 1), 0), COALESCE(SUM(realness_perception = 0), 0),
+    COALESCE(SUM(check_1 = 1), 0),
+    COALESCE(SUM(trust_content), 0), COUNT(trust_content),
+    COALESCE(SUM(trust_media), 0), COUNT(trust_media)
+"""
+
+BACKFILL_CLIP_SUMMARY = f"""
+REPLACE INTO deepfakes.clip_summary_phase3 (audio_clip_id, group_no, {_INSERT_COLUMNS})
+SELECT audio_clip_id, group_no, {_AGGREGATES}
+FROM deepfakes.english_ratings_phase3
+GROUP BY audio_clip_id, group_no
+"""
+
+BACKFILL_ARM_SUMMARY = f"""
+REPLACE INTO deepfakes.arm_summary_phase3 (group_no, {_INSERT_COLUMNS})
+SELECT group_no, {_AGGREGATES}
+FROM deepfakes.english_ratings_phase3
+GROUP BY group_no
+"""
+
+
+# The write path as one server-side call. The increments mirror _increments() below.
+_PROCEDURE_INCREMENTS = {
+    "n_ratings": "1",
+    "sum_realness_scale": "COALESCE(p_realness_scale, 0)",
+    "n_realness_scale": "p_realness_scale IS NOT NULL",
+    "n_perceived_real": "COALESCE(p_realness_perception = 1, 0)",
+    "n_perceived_fake": "COALESCE(p_realness_perception = 0, 0)",
+    "n_check_pass": "COALESCE(p_check_1 <> 0, 0)",
+    "sum_trust_content": "COALESCE(p_trust_content, 0)",
+    "n_trust_content": "p_trust_content IS NOT NULL",
+    "sum_trust_media": "COALESCE(p_trust_media, 0)",
+    "n_trust_media": "p_trust_media IS NOT NULL",
+}
+_PROCEDURE_VALUES = ", ".join(_PROCEDURE_INCREMENTS[c] for c in _COUNTERS)
+
+RATING_COLUMNS = [
+    "participant_id", "audio_clip_id", "realness_scale", "realness_perception", "confident",
+    "difficult_to_decide", "trust_content", "trust_media", "scam", "take_greenland",
+    "open_ended_response", "check_1", "group_no",
+]
+
+DROP_SUBMIT_PROCEDURE = "DROP PROCEDURE IF EXISTS deepfakes.submit_rating_phase3"
+
+CREATE_SUBMIT_PROCEDURE = f"""
+CREATE PROCEDURE deepfakes.submit_rating_phase3(
+    IN p_participant_id INT,
+    IN p_audio_clip_id INT,
+    IN p_realness_scale INT,
+    IN p_realness_perception INT,
+    IN p_confident INT,
+    IN p_difficult_to_decide INT,
+    IN p_trust_content INT,
+    IN p_trust_media INT,
+    IN p_scam VARCHAR(255),
+    IN p_take_greenland VARCHAR(255),
+    IN p_open_ended_response TEXT,
+    IN p_check_1 TINYINT,
+    IN p_group_no INT
+)
+MODIFIES SQL DATA
+BEGIN
+    INSERT INTO deepfakes.english_ratings_phase3 ({", ".join(RATING_COLUMNS)})
+    VALUES ({", ".join(f"p_{c}" for c in RATING_COLUMNS)});
+
+    INSERT INTO deepfakes.clip_summary_phase3 (audio_clip_id, group_no, {_INSERT_COLUMNS})
+    VALUES (p_audio_clip_id, p_group_no, {_PROCEDURE_VALUES})
+    ON DUPLICATE KEY UPDATE
+    {_UPDATE_CLAUSE};
+
+    INSERT INTO deepfakes.arm_summary_phase3 (group_no, {_INSERT_COLUMNS})
+    VALUES (p_group_no, {_PROCEDURE_VALUES})
+    ON DUPLICATE KEY UPDATE
+    {_UPDATE_CLAUSE};
+END
+"""
+
+_CALL_SUBMIT = text(
+    f"CALL deepfakes.submit_rating_phase3({', '.join(f':{c}' for c in RATING_COLUMNS)})"
+)
+_summary_tables = db.SchemaProbe("tables", ["clip_summary_phase3", "arm_summary_phase3"],
+                                 needed_by="rating summaries (migration 1)")
+_submit_procedure = db.SchemaProbe("routines", ["submit_rating_phase3"],
+                                   needed_by="one-call rating submission (migration 5)")
+
+
+def ensure_tables(db_conn):
+    db_conn.execute(text(CREATE_CLIP_SUMMARY))
+    db_conn.execute(text(CREATE_ARM_SUMMARY))
+
+
+def rebuild(db_conn):
+    """
+    Recompute both summaries from english_ratings_phase3.
+    Only needed once after creating the tables, or to repair drift.
+    """
+    ensure_tables(db_conn)
+    db_conn.execute(text(BACKFILL_CLIP_SUMMARY))
+    db_conn.execute(text(BACKFILL_ARM_SUMMARY))
+
+
+# --------------------------------------------------------------------------------
+# Write path
+# --------------------------------------------------------------------------------
+def _increments(realness_scale, realness_perception, check_1, trust_content, trust_media):
+    return {
+        "n_ratings": 1,
+        "sum_realness_scale": realness_scale or 0,
+        "n_realness_scale": 0 if realness_scale is None else 1,
+        "n_perceived_real": 1 if realness_perception == 1 else 0,
+        "n_perceived_fake": 1 if realness_perception == 0 else 0,
+        "n_check_pass": 1 if check_1 else 0,
+        "sum_trust_content": trust_content or 0,
+        "n_trust_content": 0 if trust_content is None else 1,
+        "sum_trust_media": trust_media or 0,
+        "n_trust_media": 0 if trust_media is None else 1,
+    }
+
+
+def record_rating(
+    db_conn,
+    audio_clip_id: int,
+    group_no: int,
+    realness_scale: int | None,
+    realness_perception: int | None,
+    check_1: bool,
+    trust_content: int | None,
+    trust_media: int | None,
+):
+    """
+    Fold one rating into both summaries.
+    Call with the same connection that inserted the rating, inside pool.begin(),
+    so the rating and its aggregates commit (or roll back) together. Does
+    nothing while the summary tables do not exist.
+    """
+    if not _summary_tables(db_conn):
+        return
+    params = _increments(realness_scale, realness_perception, check_1, trust_content, trust_media)
+    params["audio_clip_id"] = audio_clip_id
+    params["group_no"] = group_no
+    db_conn.execute(_UPSERT_CLIP, params)
+    db_conn.execute(_UPSERT_ARM, params)
+
+
+def submit_rating(db_conn, rating: dict) -> bool:
+    """
+    Insert the rating (RATING_COLUMNS) and fold it into both summaries with one CALL.
+    Returns False, having run nothing, while the procedure is not installed
+    (migration 5) or not known to be; the caller then runs its INSERT and
+    record_rating() on the same connection. A spooled CALL (fallback.py) is
+    replayed like any other statement.
+    """
+    if not _submit_procedure(db_conn):
+        return False
+    db_conn.execute(_CALL_SUBMIT, {c: rating[c] for c in RATING_COLUMNS})
+    return True
+
+
+# --------------------------------------------------------------------------------
+# Read path
+# --------------------------------------------------------------------------------
+def _ratio(num, den):
+    return float(num) / den if den else None
+
+
+def _derive(row: dict, clips_are_fake: bool) -> dict:
+    judged = row["n_perceived_real"] + row["n_perceived_fake"]
+    correct = row["n_perceived_fake"] if clips_are_fake else row["n_perceived_real"]
+    return {
+        **{k: v for k, v in row.items() if k in ("audio_clip_id", "group_no")},
+        "n_ratings": row["n_ratings"],
+        "mean_realness_scale": _ratio(row["sum_realness_scale"], row["n_realness_scale"]),
+        "perception_accuracy": _ratio(correct, judged),
+        "check_pass_rate": _ratio(row["n_check_pass"], row["n_ratings"]),
+        "mean_trust_content": _ratio(row["sum_trust_content"], row["n_trust_content"]),
+        "mean_trust_media": _ratio(row["sum_trust_media"], row["n_trust_media"]),
+    }
+
+
+def clip_summary(db_conn, clips_are_fake: bool = True) -> list[dict]:
+    """
+    One row per (audio_clip_id, group_no).
+    Audio set 4 only contains AI-generated clips, so by default a "Fake"
+    judgement counts as correct.
+    """
+    rows = db_conn.execute(text(
+        "SELECT * FROM deepfakes.clip_summary_phase3 ORDER BY audio_clip_id, group_no"
+    )).mappings().all()
+    return [_derive(dict(r), clips_are_fake) for r in rows]
+
+
+def arm_summary(db_conn, clips_are_fake: bool = True) -> list[dict]:
+    """One row per group_no (1 = control, 2 = T1, 3 = T2)."""
+    rows = db_conn.execute(text(
+        "SELECT * FROM deepfakes.arm_summary_phase3 ORDER BY group_no"
+    )).mappings().all()
+    return [_derive(dict(r), clips_are_fake) for r in rows]
+
+
+if __name__ == "__main__":
+    for statement in (CREATE_CLIP_SUMMARY, CREATE_ARM_SUMMARY, BACKFILL_CLIP_SUMMARY, BACKFILL_ARM_SUMMARY,
+                      DROP_SUBMIT_PROCEDURE):
+        print(statement.strip() + ";\n")
+    # DELIMITER is only needed in the mysql client; the app sends it as one statement
+    print(f"DELIMITER //\n{CREATE_SUBMIT_PROCEDURE.strip()} //\nDELIMITER ;")
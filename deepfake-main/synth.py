@@ -0,0 +1,457 @@
+"""
+Synthetic study data at production scale, for the local stand-in.
+
+    python synth.py --participants 100000                        # Parquet parts into synth/
+    python synth.py --participants 5000000 --out exports         # analysis.py reads these as is
+    python synth.py --participants 2000000 --load --secrets standin.toml
+    python synth.py --participants 1000 --load --create --no-parquet --secrets standin.toml
+
+Generates audio_clips, participants_phase3, prolific_ids_p3,
+english_ratings_phase3 and english_ratings_phase2 with the values the pages
+store:
+
+    scales          1-10 ints. realness_scale leans to the Real/Fake choice,
+                    which leans to Fake more often in the warning arms.
+    Real/Fake       realness_perception 1/0. The phase-3 check_1 is the
+                    pass/fail outcome; phase 2 stores the raw answer (4 = pass).
+    phase 3         scam Yes/No/Not sure, take_greenland Support/Oppose/Not sure
+    multi-selects   JSON lists (country, race, language, listening habits) or
+                    comma lists (phase-2 topics). Each comes with its encoded
+                    column from encoding.py; countries are the UNSD list.
+    demographics    the option lists of pages/Demographics.py
+
+Participants drop out the way the study sees it. Some rows stay all-NULL
+placeholders with no Prolific ID, some stop part way through their clips,
+and only those who finish fill in the demographics. Each participant rates
+--ratings distinct clips of audio set 4 in their arm (1-3). Phase-2 ratings
+use audio set 2 and group_no 2, like pages/Rate_responses.py.
+
+Rows are drawn column by column with NumPy, --chunk participants at a time, so
+memory stays at one chunk. Each chunk has its own generator seeded from
+(--seed, table, chunk number): the same seed and --chunk give the same rows.
+Output goes to Parquet part files in export_parquet.py's layout, and with
+--load into the database with LOAD DATA LOCAL INFILE (needs local_infile on
+the server). --create first adds the tables with a minimal schema if they are
+missing; run `python migrate.py apply` afterwards for the study's own tables
+and indexes.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import db
+import encoding
+
+DEFAULT_OUT = db.APP_DIR / "synth"
+DEFAULT_CHUNK = 200_000
+DEFAULT_RATINGS = 10
+DEFAULT_CLIPS = 400
+AUDIO_SET_PHASE2 = 2
+AUDIO_SET_PHASE3 = 4
+COMBO_POOL = 4096
+
+# Funnel, per participant row
+P_PROLIFIC = 0.93      # got past the consent page
+P_FINISHED = 0.85      # of those, rated every clip
+P_DEMOGRAPHICS = 0.97  # of those, submitted the demographics
+P_CHECK_PASS = 0.92
+
+# Share answering Fake, per arm (1 = control, 2 = T1, 3 = T2)
+P_FAKE = {1: 0.45, 2: 0.70, 3: 0.60}
+
+# As on pages/Demographics.py
+DEMOGRAPHICS = {
+    "age_group": (["18-30", "31-40", "41-50", "51-60", "60+"], [0.34, 0.27, 0.18, 0.13, 0.08]),
+    "gender": (["she/her/hers", "he/him/his", "they/them/theirs", "ze/hir/hirs", "xe/xem/xyrs",
+                "ey/em/eirs", "ve/ver/vis", "per/pers/perself"],
+               [0.48, 0.46, 0.04, 0.005, 0.005, 0.004, 0.003, 0.003]),
+    "education": (["High school or equivalent", "Associate degree", "Bachelor's degree", "Master's degree",
+                   "Doctorate", "Professional degree", "No degree"],
+                  [0.25, 0.11, 0.36, 0.15, 0.03, 0.04, 0.06]),
+    "occupation": (["Information Technology (IT) & Software", "Healthcare & Medical", "Education & Training",
+                    "Engineering & Architecture", "Business & Management", "Finance & Accounting",
+                    "Sales & Marketing", "Arts, Design & Media", "Law & Legal Services", "Trades & Construction",
+                    "Hospitality & Food Services", "Retail & Customer Service", "Transportation & Logistics",
+                    "Science & Research", "Government & Public Sector", "Real Estate & Property Management",
+                    "Manufacturing & Production", "Freelance & Self-employed", "Student", "Unemployed", "Other"],
+                   None),
+    "languages_spoken": (["1", "2", "3", "4", "5", "More than 5"], [0.55, 0.30, 0.10, 0.03, 0.01, 0.01]),
+    "english_fluency": (["Beginner (A1)", "Elementary (A2)", "Intermediate (B1)", "Upper-Intermediate (B2)",
+                         "Advanced (C1)", "Proficient (C2)"], [0.01, 0.01, 0.03, 0.07, 0.18, 0.70]),
+    "political_party": (["Democrats", "Republicans", "Independent"], [0.42, 0.33, 0.25]),
+    "tech_savy": (["Very comfortable", "Comfortable", "Somewhat comfortable", "Not very comfortable",
+                   "Not comfortable at all"], [0.45, 0.35, 0.14, 0.04, 0.02]),
+    "ai_experience": (["No Experience", "Beginner", "Intermediate", "Advanced", "Expert"],
+                      [0.12, 0.38, 0.33, 0.13, 0.04]),
+    "media_consumption": (["News junkie", "Series binge-watcher", "Bookworm", "Social media scroller",
+                           "Podcast listener", "Casual viewer", "Other"], None),
+}
+
+# name -> max_selections on the page
+MULTISELECTS = {"nationality": 3, "race": 3, "native_tongue": 3, "listening_habits": 3}
+
+OPEN_ENDED = [
+    "Sounded robotic in places", "The pauses felt unnatural", "Voice matched what I remember",
+    "Too smooth to be real", "Background noise made it hard to tell", "Could not tell",
+]
+
+_TABLE_STREAMS = {name: i for i, name in enumerate(
+    ["audio_clips", "participants_phase3", "english_ratings_phase3", "english_ratings_phase2"])}
+
+PHASE2_SCALES = [
+    "speech_clarity", "speech_persuasiveness", "speech_pace_engagement", "speaker_trustworthiness",
+    "speech_trustworthiness", "speaker_competence", "speech_speed_influence", "pitch_sincerity_effect",
+    "loudness_attention_influence", "confidence_level", "policy_agreement", "likelihood_to_vote",
+    "share_likely_private", "share_likely_public", "downrank_agree", "watermark_action",
+    "candidate_position_after", "agreement_candidate_position", "candidate_consistency", "candidate_alignment",
+    "confidence_candidate_position", "em_anger", "em_fear", "em_enthusiasm", "em_pride",
+    "perceived_threat", "identity_threat", "salience_before", "stance_before", "salience_after", "stance_after",
+]
+
+
+def _rng(seed: int, table: str, chunk: int) -> np.random.Generator:
+    return np.random.default_rng([seed, _TABLE_STREAMS[table], chunk])
+
+
+def _zipf_weights(n: int, s: float = 1.1) -> np.ndarray:
+    weights = 1 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def _categorical(rng, labels, n: int, weights=None, present=None) -> pd.Categorical:
+    """n draws from labels; NULL where present is False."""
+    codes = rng.choice(len(labels), n, p=weights)
+    if present is not None:
+        codes = np.where(present, codes, -1)
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def _scale(rng, n: int, centre=None, spread: int = 2, present=None):
+    """1-10 answers, uniform or around centre (scalar or per row)."""
+    if centre is None:
+        values = rng.integers(1, 11, n)
+    else:
+        values = np.clip(np.asarray(centre) + rng.integers(-spread, spread + 1, n), 1, 10)
+    values = pd.array(values.astype(np.int8), dtype="Int8")
+    if present is not None:
+        values[~present] = pd.NA
+    return values
+
+
+class _Combos:
+    """
+    A fixed pool of multi-select answers, drawn once per chunk. Rows pick from
+    the pool with a skewed popularity, so the per-row work stays vectorised.
+    """
+
+    def __init__(self, rng, field: str, max_k: int, fmt: str = "json", size: int = COMBO_POOL):
+        labels = encoding.FIELDS[field].labels
+        option_weights = _zipf_weights(len(labels))
+        if field != "native_tongue":    # English stays the most common mother tongue
+            option_weights = option_weights[rng.permutation(len(labels))]
+        seen = {}
+        for _ in range(size):
+            k = rng.integers(1, max_k + 1)
+            picked = [labels[i] for i in rng.choice(len(labels), k, replace=False, p=option_weights)]
+            text = json.dumps(picked) if fmt == "json" else ", ".join(picked)
+            seen.setdefault(text, encoding.encode(field, picked))
+        self.text = list(seen)
+        self.encoded = np.array(list(seen.values()), dtype=np.int64)
+        self.weights = _zipf_weights(len(self.text), 0.8)
+
+    def draw(self, rng, n: int, present=None):
+        index = rng.choice(len(self.text), n, p=self.weights)
+        if present is not None:
+            index = np.where(present, index, -1)
+        text = pd.Categorical.from_codes(index, categories=self.text)
+        encoded = pd.array(self.encoded[np.maximum(index, 0)], dtype="Int64")
+        encoded[index < 0] = pd.NA
+        return text, encoded
+
+
+# --------------------------------------------------------------------------------
+# Tables
+# --------------------------------------------------------------------------------
+def audio_clips(seed: int, clips_per_set: int) -> pd.DataFrame:
+    rng = _rng(seed, "audio_clips", 0)
+    frames = []
+    for offset, audio_set in enumerate((AUDIO_SET_PHASE2, AUDIO_SET_PHASE3)):
+        ids = np.arange(1, clips_per_set + 1) + offset * clips_per_set
+        frames.append(pd.DataFrame({
+            "audio_clip_id": ids,
+            "url": [f"https://audio.example.org/set{audio_set}/{i:06d}.wav" for i in ids],
+            "topic": _categorical(rng, encoding.TOPICS, clips_per_set, _zipf_weights(len(encoding.TOPICS), 0.7)),
+            "group_no": np.int8(audio_set),
+            "rated": rng.integers(0, 2, clips_per_set).astype(np.int8),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _prolific_ids(rng, n: int) -> np.ndarray:
+    """24 lowercase hex characters, like real Prolific IDs."""
+    hex_pairs = np.array([f"{i:02x}" for i in range(256)], dtype="S2")
+    raw = np.frombuffer(rng.bytes(12 * n), dtype=np.uint8).reshape(n, 12)
+    return hex_pairs[raw].view("S24").ravel().astype("U24").astype(object)
+
+
+def participants(seed: int, chunk: int, first_id: int, n: int, ratings: int):
+    """participants_phase3 and prolific_ids_p3 rows, plus how many clips each one rates and in which arm."""
+    rng = _rng(seed, "participants_phase3", chunk)
+    ids = np.arange(first_id, first_id + n, dtype=np.int64)
+    prolific = rng.random(n) < P_PROLIFIC
+    finished = prolific & (rng.random(n) < P_FINISHED)
+    n_rated = np.where(finished, ratings, np.where(prolific, rng.integers(0, ratings, n), 0))
+    filled = finished & (rng.random(n) < P_DEMOGRAPHICS)
+
+    people = pd.DataFrame({"participant_id": ids})
+    for column, (labels, weights) in DEMOGRAPHICS.items():
+        people[column] = _categorical(rng, labels, n, weights, filled)
+    people["country_of_residence"] = pd.Categorical.from_codes(np.where(filled, 0, -1), categories=["US"])
+    people["political_inclination"] = _scale(rng, n, present=filled)
+    for field, max_k in MULTISELECTS.items():
+        text, encoded = _Combos(rng, field, max_k).draw(rng, n, filled)
+        people[field] = text
+        people[encoding.FIELDS[field].column] = encoded
+
+    ids_table = pd.DataFrame({"participant_id": ids[prolific], "prolific_id": _prolific_ids(rng, int(prolific.sum()))})
+    plan = {"participant_id": ids, "n_rated": n_rated, "arm": rng.integers(1, 4, n).astype(np.int8)}
+    return people, ids_table, plan
+
+
+def _playlists(rng, n_rated: np.ndarray, first_clip: int, n_clips: int):
+    """Distinct clips per participant: start + j * step (mod n_clips) with step coprime to n_clips."""
+    steps = np.array([s for s in range(1, n_clips) if np.gcd(s, n_clips) == 1] or [1])
+    owner = np.repeat(np.arange(len(n_rated)), n_rated)
+    position = np.arange(len(owner)) - np.repeat(np.cumsum(n_rated) - n_rated, n_rated)
+    start = rng.integers(0, n_clips, len(n_rated))[owner]
+    step = rng.choice(steps, len(n_rated))[owner]
+    return owner, first_clip + (start + position * step) % n_clips
+
+
+def ratings_phase3(seed: int, chunk: int, plan: dict, first_rating_id: int, clips_per_set: int) -> pd.DataFrame:
+    rng = _rng(seed, "english_ratings_phase3", chunk)
+    owner, clip = _playlists(rng, plan["n_rated"], clips_per_set + 1, clips_per_set)
+    n = len(owner)
+    arm = plan["arm"][owner]
+    fake = rng.random(n) < np.array([0.0] + [P_FAKE[a] for a in (1, 2, 3)])[arm]
+    perception = (~fake).astype(np.int8)
+    open_ended = rng.random(n) < 0.2
+    return pd.DataFrame({
+        "rating_id": np.arange(first_rating_id, first_rating_id + n, dtype=np.int64),
+        "participant_id": plan["participant_id"][owner],
+        "audio_clip_id": clip,
+        "realness_scale": _scale(rng, n, np.where(fake, 3, 7)),
+        "realness_perception": perception,
+        "confident": pd.array([pd.NA] * n, dtype="Int8"),              # not asked in phase 3
+        "difficult_to_decide": pd.array([pd.NA] * n, dtype="Int8"),
+        "trust_content": _scale(rng, n, np.where(fake, 4, 6), 3),
+        "trust_media": _scale(rng, n, 5, 4),
+        "scam": _categorical(rng, ["Yes", "No", "Not sure"], n, [0.3, 0.45, 0.25]),
+        "take_greenland": _categorical(rng, ["Support", "Oppose", "Not sure"], n, [0.25, 0.55, 0.2]),
+        "open_ended_response": _categorical(rng, OPEN_ENDED, n, present=open_ended),
+        "check_1": (rng.random(n) < P_CHECK_PASS).astype(np.int8),
+        "group_no": arm,
+    })
+
+
+def ratings_phase2(seed: int, chunk: int, first_participant_id: int, n_people: int, ratings: int,
+                   first_rating_id: int, clips_per_set: int) -> pd.DataFrame:
+    rng = _rng(seed, "english_ratings_phase2", chunk)
+    finished = rng.random(n_people) < P_FINISHED
+    n_rated = np.where(finished, ratings, rng.integers(1, ratings + 1, n_people))
+    owner, clip = _playlists(rng, n_rated, 1, clips_per_set)
+    n = len(owner)
+    fake = rng.random(n) < 0.5
+    frame = pd.DataFrame({
+        "rating_id": np.arange(first_rating_id, first_rating_id + n, dtype=np.int64),
+        "participant_id": first_participant_id + owner,
+        "audio_clip_id": clip,
+        "group_no": np.int8(AUDIO_SET_PHASE2),
+        "realness_scale": _scale(rng, n, np.where(fake, 3, 7)),
+        "realness_perception": (~fake).astype(np.int8),
+    })
+    for column in PHASE2_SCALES:
+        frame[column] = _scale(rng, n)
+    frame["em_disgust"] = pd.array([pd.NA] * n, dtype="Int8")        # not displayed
+    frame["em_sadness"] = pd.array([pd.NA] * n, dtype="Int8")
+    for column in ("influenced_by_tone", "influenced_by_quality", "influenced_by_content"):
+        frame[column] = (rng.random(n) < 0.4).astype(np.int8)
+    frame["report_misleading"] = (rng.random(n) < 0.35).astype(np.int8)
+    # Raw answer to "select 4 if yes"; unanswered was stored as 10
+    frame["check_1"] = np.where(rng.random(n) < P_CHECK_PASS, 4, rng.integers(1, 11, n)).astype(np.int8)
+    frame["open_ended_response"] = _categorical(rng, OPEN_ENDED, n, present=rng.random(n) < 0.2)
+    for field in ("mip_topics", "mip_topics_before"):
+        text, encoded = _Combos(rng, field, 4, fmt="comma").draw(rng, n)
+        frame[field] = text
+        frame[encoding.FIELDS[field].column] = encoded
+    return frame
+
+
+# --------------------------------------------------------------------------------
+# Output
+# --------------------------------------------------------------------------------
+# Key columns of the tables --create makes. Loading into existing tables, each
+# frame's key is renamed to that table's primary key (db.primary_key).
+TABLE_KEYS = {
+    "audio_clips": "audio_clip_id",
+    "participants_phase3": "participant_id",
+    "prolific_ids_p3": "participant_id",
+    "english_ratings_phase3": "rating_id",
+    "english_ratings_phase2": "rating_id",
+}
+_AUTO_INCREMENT = {"participants_phase3", "english_ratings_phase3", "english_ratings_phase2"}
+
+
+def write_parquet(out_dir: Path, table: str, frame: pd.DataFrame):
+    """One part file per chunk, named like export_parquet.py's."""
+    if frame.empty:
+        return
+    key = frame[TABLE_KEYS[table]]
+    table_dir = out_dir / table
+    table_dir.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(frame, preserve_index=False),
+                   table_dir / f"part-{key.iloc[0]:012d}-{key.iloc[-1]:012d}.parquet", compression="zstd")
+
+
+def _sql_type(column: str, series: pd.Series) -> str:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        longest = max((len(c) for c in series.cat.categories), default=1)
+        return "TEXT" if longest > 255 or column == "open_ended_response" else "VARCHAR(255)"
+    if series.dtype.kind in "iub":
+        return "BIGINT" if series.dtype.itemsize == 8 else ("TINYINT" if series.dtype.itemsize == 1 else "INT")
+    return "VARCHAR(255)"
+
+
+def create_statement(table: str, frame: pd.DataFrame) -> str:
+    key = TABLE_KEYS[table]
+    columns = []
+    for column in frame.columns:
+        if column == key:
+            auto = " AUTO_INCREMENT" if table in _AUTO_INCREMENT else ""
+            columns.append(f"`{column}` {_sql_type(column, frame[column])} NOT NULL{auto}")
+        else:
+            columns.append(f"`{column}` {_sql_type(column, frame[column])} NULL")
+    body = ",\n    ".join(columns + [f"PRIMARY KEY (`{key}`)"])
+    return f"CREATE TABLE IF NOT EXISTS deepfakes.{table} (\n    {body}\n)"
+
+
+def load_data(conn, table: str, frame: pd.DataFrame):
+    """LOAD DATA LOCAL INFILE of one chunk, committed on its own."""
+    if frame.empty:
+        return
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False, encoding="utf-8", newline="") as f:
+        frame.to_csv(f, sep="\t", header=False, index=False, na_rep="\\N", quoting=csv.QUOTE_NONE,
+                     escapechar="\\", lineterminator="\n")
+    try:
+        columns = ", ".join(f"`{c}`" for c in frame.columns)
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE deepfakes.{table} "
+                f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({columns})",
+                (f.name,),
+            )
+        conn.commit()
+    finally:
+        os.unlink(f.name)
+
+
+# --------------------------------------------------------------------------------
+# Run
+# --------------------------------------------------------------------------------
+def chunks(seed: int, participants_n: int, phase2_n: int, ratings: int, chunk: int, clips_per_set: int):
+    """Yield (table, frame) in load order, --chunk participants at a time."""
+    yield "audio_clips", audio_clips(seed, clips_per_set)
+    rating_id = 1
+    for number, first in enumerate(range(0, participants_n, chunk)):
+        n = min(chunk, participants_n - first)
+        people, prolific_ids, plan = participants(seed, number, first + 1, n, ratings)
+        yield "participants_phase3", people
+        yield "prolific_ids_p3", prolific_ids
+        frame = ratings_phase3(seed, number, plan, rating_id, clips_per_set)
+        rating_id += len(frame)
+        yield "english_ratings_phase3", frame
+    rating_id = 1
+    for number, first in enumerate(range(0, phase2_n, chunk)):
+        n = min(chunk, phase2_n - first)
+        frame = ratings_phase2(seed, number, first + 1, n, ratings, rating_id, clips_per_set)
+        rating_id += len(frame)
+        yield "english_ratings_phase2", frame
+
+
+def run(participants_n: int, phase2_n: int, ratings=DEFAULT_RATINGS, chunk=DEFAULT_CHUNK,
+        clips_per_set=DEFAULT_CLIPS, seed=0, out_dir=DEFAULT_OUT, load=False, create=False, secrets=None):
+    if ratings > clips_per_set:
+        raise SystemExit(f"--ratings {ratings} needs at least as many clips per audio set (--clips)")
+    counts, spent = {}, {"generate": 0.0, "parquet": 0.0, "load": 0.0}
+    conn, created = None, set()
+    with ExitStack() as stack:
+        if load:
+            secrets, tunnel = stack.enter_context(db.tunnel_session(db.load_secrets(secrets)))
+            conn = db.get_connection(tunnel, secrets, autocommit=False, local_infile=True)
+            stack.callback(conn.close)
+            with conn.cursor() as cursor:
+                cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+        started = time.perf_counter()
+        for table, frame in chunks(seed, participants_n, phase2_n, ratings, chunk, clips_per_set):
+            spent["generate"] += time.perf_counter() - started
+            counts[table] = counts.get(table, 0) + len(frame)
+            if out_dir is not None:
+                mark = time.perf_counter()
+                write_parquet(Path(out_dir), table, frame)
+                spent["parquet"] += time.perf_counter() - mark
+            if conn is not None:
+                mark = time.perf_counter()
+                if create and table not in created:
+                    with conn.cursor() as cursor:
+                        cursor.execute(create_statement(table, frame))
+                    created.add(table)
+                key = db.primary_key(conn, table)
+                load_data(conn, table, frame.rename(columns={TABLE_KEYS[table]: key}))
+                spent["load"] += time.perf_counter() - mark
+            print(f"  {table}: {counts[table]:,} rows", end="\r", flush=True)
+            started = time.perf_counter()
+
+    print(" " * 60, end="\r")
+    total = sum(counts.values())
+    for table, count in counts.items():
+        print(f"{table:<24} {count:>14,} rows")
+    print(f"{total:,} rows: generated in {spent['generate']:.1f}s ({total / max(spent['generate'], 1e-9):,.0f} rows/s)"
+          + "".join(f", {step} {seconds:.1f}s" for step, seconds in spent.items() if step != "generate" and seconds))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--participants", type=int, default=100_000, help="participants_phase3 rows")
+    parser.add_argument("--phase2-participants", type=int, help="phase-2 raters (default: half of --participants)")
+    parser.add_argument("--ratings", type=int, default=DEFAULT_RATINGS, help="clips per participant who finishes")
+    parser.add_argument("--clips", type=int, default=DEFAULT_CLIPS, help="clips per audio set")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="participants generated at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT, help="Parquet directory")
+    parser.add_argument("--no-parquet", action="store_true", help="only load into the database")
+    parser.add_argument("--load", action="store_true", help="LOAD DATA into the database in the secrets")
+    parser.add_argument("--create", action="store_true", help="with --load: create missing tables first")
+    parser.add_argument("--secrets", help="path to secrets.toml (the stand-in's)")
+    args = parser.parse_args(argv)
+
+    if args.no_parquet and not args.load:
+        parser.error("--no-parquet leaves nothing to write without --load")
+    phase2 = args.participants // 2 if args.phase2_participants is None else args.phase2_participants
+    run(args.participants, phase2, args.ratings, args.chunk, args.clips, args.seed,
+        None if args.no_parquet else args.out, args.load, args.create, args.secrets)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
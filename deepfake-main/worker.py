@@ -0,0 +1,144 @@
+"""
+Start one Streamlit server after warming up its database access.
+
+    python worker.py app.py --server.port 8601 [more streamlit run options]
+
+Without this, the first participant after a deploy or an idle spell pays for
+the SSH handshake, the MySQL logins and the clip catalog. Here the process opens
+the tunnel, fills --warm-connections pooled connections and loads the catalog,
+the shared counters and the reference data before `streamlit run` starts
+listening. serve.py only routes to a worker once /_stcore/health answers, which
+is after the warm-up.
+
+A keep-warm thread then pings the pooled connections every --keep-warm seconds
+and replaces those close to pool_recycle. Recycling then happens in this thread
+instead of on a participant's request. The same thread replays writes that
+fallback.py spooled while the database was unavailable and flushes arm
+assignments (arms.py). It runs even when the warm-up failed or was turned off,
+connecting on each round until the database answers; --keep-warm 0 only stops
+the pinging.
+
+--payload-meter records the bytes and elements every rerun sends to the
+browser (payload_meter.py). --profile PAGE=RATE samples the call stacks of
+that share of PAGE's reruns (profiling.py). A session thread measures each
+session's memory and reaps abandoned sessions (sessions.py, --no-session-reaper
+to turn it off).
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+import arms
+import catalog
+import db
+import encoding
+import fallback
+import payload_meter
+import profiling
+import sessions
+import shared_state
+
+WARM_CONNECTIONS = 4
+KEEP_WARM_SECONDS = 120
+
+log = logging.getLogger("worker")
+
+
+def _touch(engine, max_age=None):
+    with engine.connect() as conn:
+        if max_age is not None and time.time() - conn.info.get("connected_at", 0) > max_age:
+            conn.invalidate()
+        conn.execute(text("SELECT 1"))
+
+
+def fill_pool(engine, connections: int, max_age=None):
+    """Hold `connections` checkouts at once so that many distinct connections get opened/pinged."""
+    if connections <= 0:
+        return
+    with ThreadPoolExecutor(connections) as executor:
+        for future in [executor.submit(_touch, engine, max_age) for _ in range(connections)]:
+            future.result()
+
+
+def warm_up(secrets: dict, connections: int = WARM_CONNECTIONS):
+    started = time.perf_counter()
+    engine = db.get_app_engine(secrets)
+    fill_pool(engine, connections)
+    shared_state.get_shared_state(engine)
+    catalog.clips(engine, catalog.AUDIO_SET_NO)
+    log.info(
+        "warm in %.1fs: %d connections, %d clips, %d countries",
+        time.perf_counter() - started, connections,
+        len(catalog.clips(engine, catalog.AUDIO_SET_NO)), len(encoding.COUNTRIES),
+    )
+    return engine
+
+
+def keep_warm(secrets_path, connections: int, interval: float):
+    # Reconnect anything that would otherwise hit pool_recycle before the next round.
+    max_age = db.APP_POOL["pool_recycle"] - 2 * interval
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                # Also the first connection when the worker started during an outage
+                engine = db.get_app_engine(db.load_secrets(secrets_path))
+                if connections > 0:
+                    fill_pool(engine, connections, max_age)
+                arms.flush(engine)
+                # Writes spooled during an outage go in as soon as the database answers.
+                if fallback.pending():
+                    fallback.replay(engine)
+            except Exception as e:
+                log.warning("keep-warm failed: %s", e)
+
+    threading.Thread(target=loop, name="keep-warm", daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("script", nargs="?", default="app.py")
+    parser.add_argument("--warm-connections", type=int, default=WARM_CONNECTIONS, help="0 to start cold")
+    parser.add_argument("--keep-warm", type=float, default=KEEP_WARM_SECONDS, help="seconds, 0 to only replay and flush")
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    parser.add_argument("--payload-meter", action="store_true", help="record what each rerun sends (payload_meter.py)")
+    parser.add_argument("--profile", action="append", metavar="[PAGE=]RATE",
+                        help="profile this share of reruns of PAGE (all pages without PAGE=), repeatable")
+    parser.add_argument("--profile-interval", type=float, default=profiling.INTERVAL_MS, help="ms between samples")
+    parser.add_argument("--no-session-reaper", action="store_true",
+                        help="do not measure sessions or shut down disconnected ones (sessions.py)")
+    parser.add_argument("--session-budget-mb", type=float, default=sessions.BUDGET_MB,
+                        help="session_state size that gets logged")
+    args, streamlit_args = parser.parse_known_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    try:
+        if args.warm_connections > 0:
+            warm_up(db.load_secrets(args.secrets), args.warm_connections)
+    except Exception:
+        # Start anyway; the pages connect on demand as before.
+        log.exception("warm-up failed, starting cold")
+    pinged = args.warm_connections if args.keep_warm > 0 else 0
+    keep_warm(args.secrets, pinged, args.keep_warm or KEEP_WARM_SECONDS)
+
+    if args.payload_meter:
+        payload_meter.install()
+    if not args.no_session_reaper:
+        sessions.install(args.session_budget_mb)
+    if args.profile:
+        profiling.install(profiling.parse_rates(args.profile), interval_ms=args.profile_interval)
+
+    from streamlit.web import cli as stcli
+
+    sys.argv = ["streamlit", "run", args.script, *streamlit_args]
+    sys.exit(stcli.main())
+
+
+if __name__ == "__main__":
+    main()